@@ -11,14 +11,20 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import collections
+import contextlib
 import logging
 import sys
+import time
+from typing import AsyncIterator
+
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from src import config
 # The AlloyDB Python Connector is the recommended way to connect from apps.
 # It handles secure, authorized connections automatically.
-from google.cloud.alloydb.connector import Connector
+from google.cloud.alloydb.connector import AsyncConnector
 
 # Configure logging
 logging.basicConfig(
@@ -28,115 +34,313 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Global connector and engine to be initialized at startup
-_db_pool: sqlalchemy.engine.Engine | None = None
-_connector: Connector | None = None
+_db_pool: AsyncEngine | None = None
+_connector: AsyncConnector | None = None
+
+
+class PoolMetrics:
+  """
+    Counts the connection acquisitions from the pool: the requests waiting
+    for a connection, the timeouts, and the latency of the recent
+    acquisitions. Only used from the event loop, no locking needed.
+    """
+
+  def __init__(self, window: int = 1000):
+    self.waiting = 0
+    self.acquired = 0
+    self.timeouts = 0
+    self._latencies: collections.deque[float] = collections.deque(maxlen=window)
+
+  def record(self, seconds: float) -> None:
+    self.acquired += 1
+    self._latencies.append(seconds)
+
+  def latency_ms(self, quantile: float) -> float:
+    """Returns a quantile of the recent acquire latencies, in milliseconds."""
+    if not self._latencies:
+      return 0.0
+    ordered = sorted(self._latencies)
+    return round(
+        ordered[min(len(ordered) - 1, int(quantile * len(ordered)))] * 1000, 2)
 
 
-def init_db_connection_pool():
-  """Initializes a connection pool using the Python Connector."""
+_pool_metrics = PoolMetrics()
+
+
+async def init_db_connection_pool():
+  """
+    Initializes an asyncpg connection pool using the Python Connector, and
+    opens DB_POOL_PREWARM connections so that the first requests do not pay
+    for the connection setup.
+    """
   global _db_pool, _connector
   if _db_pool:
     logger.info("Connection pool already initialized.")
     return
 
-  # Initialize the database connector
-  _connector = Connector(ip_type="PSC")
-
-  #    # The AlloyDB Connector requires ALLOYDB_INSTANCE_URI, DB_NAME, and DB_SA.
-  #    if not all([config.ALLOYDB_INSTANCE_URI, config.DB_NAME, config.DB_SA]):
-  #        logger.warning(
-  #            "AlloyDB configuration (ALLOYDB_INSTANCE_URI, DB_NAME, DB_SA) "
-  #            "is not complete. Database features will be disabled.")
-  #        return
+  # Initialize the database connector, in the event loop that uses it.
+  _connector = AsyncConnector(ip_type="PSC")
 
   # This function will be called by SQLAlchemy to create new connections.
-  def getconn():
+  async def getconn():
     # The connector.connect method handles automatically discovering the
     # AlloyDB instance's IP address and securely connecting to it.
-    logger.info(f"Creating connector...")
-
-    conn = _connector.connect(
-        instance_uri=config.ALLOYDB_INSTANCE_URI,
-        driver="pg8000",
+    conn = await _connector.connect(
+        config.ALLOYDB_INSTANCE_URI,
+        "asyncpg",
         user=config.DB_SA,
         db=config.DB_NAME,
         enable_iam_auth=True,  # Use IAM database authentication
     )
-    logging.info("Direct connection to AlloyDB was successful!")
-
+    # asyncpg has no codec for the pgvector types: exchange them as text.
+    for type_name in ("vector", "halfvec"):
+      try:
+        await conn.set_type_codec(type_name, encoder=str, decoder=str,
+                                  schema="public", format="text")
+      except ValueError:
+        # halfvec only exists since pgvector 0.7.0.
+        logger.debug(f"Type '{type_name}' not found, no codec registered.")
     return conn
 
-    logger.info(
-        f"Attempting to connect to AlloyDB instance '{config.ALLOYDB_INSTANCE_URI}' "
-        f"in database '{config.DB_NAME}', user '{config.DB_SA}' using IAM auth."
-    )
-
   logger.info(
       f"Attempting to connect to AlloyDB instance '{config.ALLOYDB_INSTANCE_URI}' in database '{config.DB_NAME}', user '{config.DB_SA}'"
   )
 
   try:
-    # Create the SQLAlchemy engine using the 'creator' function
-    _db_pool = sqlalchemy.create_engine(
-        "postgresql+pg8000://",
-        creator=getconn,
-        pool_size=5,
-        max_overflow=2,
-        pool_timeout=30,
-        pool_recycle=1800,
+    # Create the SQLAlchemy engine using the 'async_creator' function
+    _db_pool = create_async_engine(
+        "postgresql+asyncpg://",
+        async_creator=getconn,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_POOL_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=True,
+    )
+
+    async def open_connection() -> AsyncConnection:
+      connection = await _db_pool.connect()
+      await connection.execute(sqlalchemy.text("SELECT 1"))
+      return connection
+
+    # Open the connections concurrently, then return them to the pool.
+    prewarm = max(1, min(config.DB_POOL_PREWARM, config.DB_POOL_SIZE))
+    started = time.perf_counter()
+    connections = await asyncio.gather(
+        *(open_connection() for _ in range(prewarm)))
+    for connection in connections:
+      await connection.close()
+    logger.info(
+        f"Connected to the database, {prewarm} pooled connection(s) opened in {time.perf_counter() - started:.2f}s."
     )
-    # Test the connection
-    with _db_pool.connect() as connection:
-      logger.info(
-          "Successfully connected to the database and obtained a connection from the pool."
-      )
   except Exception as e:
     logger.error(f"Error creating the database connection pool: {e}")
     # Clean up the connector and pool on failure
-    if _connector:
-      _connector.close()
-      _connector = None
-    _db_pool = None
+    await dispose_db_pool()
     raise
 
 
-def get_db_session() -> Session:
-  """Dependency to get a database session."""
-  # Raise an error or handle as appropriate
-  # if the DB connection is critical
-  if not _db_pool:
-    logger.error("Database pool not initialized. Cannot provide DB session.")
-    raise ConnectionError("Database pool not initialized.")
-  SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=_db_pool)
-  db = SessionLocal()
+@contextlib.asynccontextmanager
+async def _connect() -> AsyncIterator[AsyncConnection]:
+  """Acquires a pooled connection, recording the wait in the pool metrics."""
+  _pool_metrics.waiting += 1
+  started = time.perf_counter()
   try:
-    yield db
+    connection = await _db_pool.connect()
+  except sqlalchemy.exc.TimeoutError:
+    _pool_metrics.timeouts += 1
+    raise
+  finally:
+    _pool_metrics.waiting -= 1
+  _pool_metrics.record(time.perf_counter() - started)
+  try:
+    yield connection
   finally:
-    db.close()
+    await connection.close()
+
+
+def get_pool_stats() -> dict:
+  """Returns the pool usage and the acquire latency of the recent requests."""
+  if not _db_pool:
+    return {}
+  pool = _db_pool.pool
+  return {
+      "size": pool.size(),
+      "in_use": pool.checkedout(),
+      "idle": pool.checkedin(),
+      "overflow": max(0, pool.overflow()),
+      "waiting": _pool_metrics.waiting,
+      "acquired": _pool_metrics.acquired,
+      "timeouts": _pool_metrics.timeouts,
+      "acquire_ms_p50": _pool_metrics.latency_ms(0.5),
+      "acquire_ms_p99": _pool_metrics.latency_ms(0.99),
+  }
+
+
+_ITERATIVE_SCAN_MODES = ("off", "relaxed_order", "strict_order")
+# Largest hnsw.ef_search accepted by pgvector.
+_HNSW_MAX_EF_SEARCH = 1000
 
 
-def search_similar_documents(db: Session, embedding: list[float],
-                             top_k: int) -> list[str]:
+def index_candidates(top_k: int) -> int:
+  """Returns the number of rows the similarity query reads from the index."""
+  candidates = top_k
+  if config.RETRIEVER_COLLAPSE_CHUNKS:
+    candidates *= config.RETRIEVER_CHUNK_CANDIDATES_FACTOR
+  if config.SEARCH_QUANTIZATION != "none":
+    candidates *= config.SEARCH_RERANK_FACTOR
+  return candidates
+
+
+def resolve_search_params(ef_search: int | None = None,
+                          probes: int | None = None,
+                          iterative_scan: str | None = None,
+                          candidates: int = 0) -> dict:
+  """
+    Fills in the configured defaults for missing search effort parameters
+    and caps the requested ones to the server limits. An HNSW scan returns
+    at most ef_search rows, so ef_search is raised to the number of
+    `candidates` the query reads from the index.
+    """
+  ef_search = min(ef_search or config.SEARCH_HNSW_EF_SEARCH,
+                  config.SEARCH_MAX_HNSW_EF_SEARCH)
+  params = {
+      "ef_search":
+          min(max(ef_search, candidates), _HNSW_MAX_EF_SEARCH),
+      "probes":
+          min(probes or config.SEARCH_IVFFLAT_PROBES,
+              config.SEARCH_MAX_IVFFLAT_PROBES),
+      "iterative_scan":
+          iterative_scan or config.SEARCH_ITERATIVE_SCAN,
+  }
+  if params["iterative_scan"] not in _ITERATIVE_SCAN_MODES:
+    logger.warning(
+        f"Unknown iterative scan mode '{params['iterative_scan']}', using 'off'."
+    )
+    params["iterative_scan"] = "off"
+  return params
+
+
+async def apply_search_params(db: AsyncConnection, params: dict) -> None:
+  """
+    Sets the pgvector search parameters with SET LOCAL, so that they only
+    apply to the current transaction, i.e. the current request.
+    """
+  await db.execute(
+      sqlalchemy.text(f"SET LOCAL hnsw.ef_search = {int(params['ef_search'])}"))
+  await db.execute(
+      sqlalchemy.text(f"SET LOCAL ivfflat.probes = {int(params['probes'])}"))
+  if params["iterative_scan"] != "off":
+    # Only set when needed: the parameters do not exist before pgvector 0.8.0.
+    await db.execute(
+        sqlalchemy.text(
+            f"SET LOCAL hnsw.iterative_scan = {params['iterative_scan']}"))
+    await db.execute(
+        sqlalchemy.text(
+            f"SET LOCAL ivfflat.iterative_scan = {params['iterative_scan']}"))
+
+
+def distance_sql(quantization: str, dimensions: int) -> str:
+  """
+    Returns the distance to :embedding for the given quantization. Quantized
+    distances repeat the expression indexed by the ingestion job, so that
+    the planner uses that index.
+    """
+  column = f'"{config.DB_COLUMN_EMBEDDING}"'
+  if quantization == "halfvec":
+    return (f"{column}::halfvec({dimensions}) "
+            f"<=> CAST(:embedding AS halfvec({dimensions}))")
+  if quantization == "bit":
+    return (f"binary_quantize({column})::bit({dimensions}) "
+            f"<~> binary_quantize(CAST(:embedding AS vector({dimensions})))")
+  return f"{column} <=> :embedding"
+
+
+def nearest_rows_sql(columns: str, limit: str, dimensions: int) -> str:
+  """
+    Returns a query of the `limit` rows nearest to :embedding, with the
+    given columns and their exact cosine 'distance'. With quantization, the
+    quantized index first returns `limit` * :rerank_factor candidates.
+    """
+  exact_distance = distance_sql("none", dimensions)
+  if config.SEARCH_QUANTIZATION == "none":
+    return f"""
+              SELECT {columns}, {exact_distance} AS distance
+              FROM "{config.DB_TABLE}"
+              ORDER BY {exact_distance}
+              LIMIT {limit}"""
+  return f"""
+              SELECT * FROM (
+                SELECT {columns}, {exact_distance} AS distance
+                FROM "{config.DB_TABLE}"
+                ORDER BY {distance_sql(config.SEARCH_QUANTIZATION, dimensions)}
+                LIMIT {limit} * :rerank_factor
+              ) AS coarse
+              ORDER BY distance
+              LIMIT {limit}"""
+
+
+def similarity_query_sql(dimensions: int) -> str:
+  """
+    Returns the nearest-neighbour query, binding :embedding, :top_k,
+    :rerank_factor and (when chunks are collapsed to their parent items)
+    :candidates.
+    """
+  if not config.RETRIEVER_COLLAPSE_CHUNKS:
+    return f"""
+            WITH nearest AS ({nearest_rows_sql(
+                f'"{config.DB_COLUMN_TEXT}" AS content', ":top_k", dimensions)}
+            )
+            SELECT content FROM nearest ORDER BY distance
+            """
+  columns = (
+      f'COALESCE("{config.DB_COLUMN_PARENT_ID}", "{config.DB_COLUMN_ID}") AS parent, '
+      f'"{config.DB_COLUMN_CHUNK_INDEX}" AS chunk_index, '
+      f'"{config.DB_COLUMN_TEXT}" AS content')
+  return f"""
+            WITH nearest AS ({nearest_rows_sql(columns, ":candidates", dimensions)}
+            )
+            SELECT string_agg(content, ' ... ' ORDER BY chunk_index)
+            FROM nearest
+            GROUP BY parent
+            ORDER BY min(distance)
+            LIMIT :top_k
+            """
+
+
+async def search_similar_documents(
+    embedding: list[float], top_k: int, ef_search: int | None = None,
+    probes: int | None = None, iterative_scan: str | None = None) -> list[str]:
   """
     Searches for documents with embeddings similar to
     the query_embedding in PostgreSQL using pgvector.
+    The search effort parameters default to the server configuration.
+    A pooled connection is only held for the duration of the query.
     """
   if not _db_pool:
     logger.warning("Database not configured. Skipping document search.")
     return []
   try:
     embedding_str = str(embedding)
+    search_params = resolve_search_params(ef_search, probes, iterative_scan,
+                                          index_candidates(top_k))
     # Using <=> for cosine distance (pgvector specific).
     # Lower distance = more similar.
-    query = sqlalchemy.text(f"""
-            SELECT "{config.DB_COLUMN_TEXT}"
-            FROM "{config.DB_TABLE}"
-            ORDER BY "{config.DB_COLUMN_EMBEDDING}" <=> :embedding
-            LIMIT :top_k
-            """)
-    result = db.execute(query, {"embedding": embedding_str, "top_k": top_k})
-    documents = [row[0] for row in result.fetchall()]
-    logger.info(f"Retrieved {len(documents)} similar documents from DB.")
+    query = sqlalchemy.text(similarity_query_sql(len(embedding)))
+    async with _connect() as db, db.begin():
+      await apply_search_params(db, search_params)
+      result = await db.execute(
+          query, {
+              "embedding": embedding_str,
+              "top_k": top_k,
+              "candidates": top_k * config.RETRIEVER_CHUNK_CANDIDATES_FACTOR,
+              "rerank_factor": config.SEARCH_RERANK_FACTOR
+          })
+      documents = [row[0] for row in result.fetchall()]
+    logger.info(
+        f"Retrieved {len(documents)} similar documents from DB (ef_search={search_params['ef_search']}, "
+        f"probes={search_params['probes']}, iterative_scan={search_params['iterative_scan']})."
+    )
     return documents
   except sqlalchemy.exc.SQLAlchemyError as e:
     logger.error(f"Database error during similarity search: {e}", exc_info=True)
@@ -147,14 +351,32 @@ def search_similar_documents(db: Session, embedding: list[float],
     return []
 
 
-def dispose_db_pool():
+async def get_corpus_version() -> int | None:
+  """
+    Returns the version of the table content, which the ingestion job bumps
+    whenever it writes or deletes rows, so that cached answers can be
+    invalidated after an ingestion. None before the first ingestion.
+    """
+  version_table = f"{config.DB_TABLE}_corpus_version"
+  async with _connect() as db:
+    exists = (await db.execute(
+        sqlalchemy.text("SELECT to_regclass(:name) IS NOT NULL"),
+        {"name": f'"{version_table}"'})).scalar()
+    if not exists:
+      return None
+    result = await db.execute(
+        sqlalchemy.text(f'SELECT version FROM "{version_table}"'))
+    return result.scalar()
+
+
+async def dispose_db_pool():
   """Disposes of the database connection pool and the database connector."""
   global _db_pool, _connector
   if _db_pool:
-    _db_pool.dispose()
+    await _db_pool.dispose()
     _db_pool = None
     logger.info("Database connection pool disposed.")
   if _connector:
-    _connector.close()
+    await _connector.close()
     _connector = None
     logger.info("Database connector closed.")
@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 
 class Prompt(BaseModel):
   """
     Represents the request body for the prediction endpoint.
-    It expects a single field 'prompt' containing the text to be processed by the model.
+    It expects a field 'prompt' containing the text to be processed by the model
+    and optional search effort parameters for the similarity search.
     """
 
   prompt: str = Field(
@@ -28,3 +31,24 @@ class Prompt(BaseModel):
       "The text prompt to send to the generative model for a response.",
       min_length=1,
   )
+  ef_search: int | None = Field(
+      default=None,
+      title="HNSW ef_search",
+      description=
+      "Size of the HNSW candidate list. Capped server-side; defaults to the server configuration.",
+      ge=1,
+  )
+  probes: int | None = Field(
+      default=None,
+      title="IVFFlat probes",
+      description=
+      "Number of IVFFlat lists to scan. Capped server-side; defaults to the server configuration.",
+      ge=1,
+  )
+  iterative_scan: Literal[
+      "off", "relaxed_order", "strict_order"] | None = Field(
+          default=None,
+          title="Iterative index scan",
+          description=
+          "pgvector iterative scan mode. Defaults to the server configuration.",
+      )
@@ -0,0 +1,340 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmarks run_indexer() without BigQuery, Vertex AI or a managed database.
+
+BigQuery is replaced by a synthetic row generator, the embedding model by a
+fake service with configurable latency and error rate, and the target
+database by a local Postgres with pgvector, for example:
+
+  docker run -d -p 5432:5432 -e POSTGRES_HOST_AUTH_METHOD=trust \\
+      pgvector/pgvector:pg17
+
+  uv run python benchmark.py --rows 20000 --batch-sizes 1000:100,1000:250
+
+Every batch-size setting runs in its own process, so that the configuration
+is read from scratch and the peak RSS is measured per setting.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import types
+
+_RESULT_PREFIX = "BENCHMARK_RESULT "
+_GENRES = ["Action", "Comedy", "Drama", "Horror", "Sci-Fi", "Romance"]
+_WORDS = ("the a of and to in is it that was for on are with as his they be "
+          "at one have this from or had by hot word but what some we can out "
+          "other were all there when up use your how said an each she which "
+          "do their time if will way about many then them write would like "
+          "so these her long make thing see him two has look more day could "
+          "go come did number sound no most people my over know water than "
+          "call first who may down side been now find").split()
+
+
+def synthetic_row(row_id: int) -> dict:
+  """Returns a deterministic movie-like row."""
+  rng = random.Random(row_id)
+  return {
+      "id": row_id,
+      "rank": row_id,
+      "title": " ".join(rng.choices(_WORDS, k=rng.randint(1, 5))).title(),
+      "description": " ".join(rng.choices(_WORDS, k=rng.randint(20, 80))),
+      "genre": ",".join(rng.sample(_GENRES, k=rng.randint(1, 3))),
+      "rating": round(rng.uniform(1, 10), 1),
+      "year": rng.randint(1920, 2025),
+  }
+
+
+class FakeRowIterator:
+  """Stands in for the RowIterator of a BigQuery query job."""
+
+  def __init__(self, row_count: int, page_size: int):
+    self.row_count = row_count
+    self.page_size = page_size
+
+  def __iter__(self):
+    return (synthetic_row(row_id) for row_id in range(1, self.row_count + 1))
+
+  def to_arrow_iterable(self, bqstorage_client=None):
+    import pyarrow as pa
+    for start in range(1, self.row_count + 1, self.page_size):
+      stop = min(start + self.page_size, self.row_count + 1)
+      yield pa.RecordBatch.from_pylist(
+          [synthetic_row(row_id) for row_id in range(start, stop)])
+
+
+class FakeQueryJob:
+
+  def __init__(self, row_count: int):
+    self.row_count = row_count
+
+  def result(self, page_size: int = 1000):
+    return FakeRowIterator(self.row_count, page_size)
+
+
+class FakeBigQueryClient:
+  """Stands in for bigquery.Client: every query returns the synthetic rows."""
+
+  row_count = 0
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def query(self, query: str) -> FakeQueryJob:
+    return FakeQueryJob(self.row_count)
+
+  def get_table(self, table_id: str):
+    from google.cloud import bigquery
+    key_column = os.environ.get("BQ_KEY_COLUMN", "rank")
+    return types.SimpleNamespace(
+        schema=[bigquery.SchemaField(key_column, "INTEGER")])
+
+
+class FakeEmbedding:
+
+  def __init__(self, values: list[float]):
+    self.values = values
+
+
+class FakeEmbeddingModel:
+  """
+    Stands in for TextEmbeddingModel. Each request sleeps for `latency`
+    seconds and fails with a 503 with probability `error_rate`. Vectors are
+    derived from the text, so identical texts get identical embeddings.
+    """
+
+  def __init__(self, dimensions: int, latency: float, error_rate: float):
+    self.dimensions = dimensions
+    self.latency = latency
+    self.error_rate = error_rate
+
+  def get_embeddings(
+      self, texts: list[str],
+      output_dimensionality: int | None = None) -> list[FakeEmbedding]:
+    import google.api_core.exceptions as exceptions
+    time.sleep(self.latency)
+    if random.random() < self.error_rate:
+      raise exceptions.ServiceUnavailable("Injected benchmark error.")
+    dimensions = output_dimensionality or self.dimensions
+    embeddings = []
+    for text in texts:
+      rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+      embeddings.append(
+          FakeEmbedding([rng.uniform(-1, 1) for _ in range(dimensions)]))
+    return embeddings
+
+
+def _offline(*args, **kwargs):
+  raise OSError("The benchmark does not call external services.")
+
+
+def run_single(args: argparse.Namespace) -> dict:
+  """Runs the indexer once in this process with the stand-ins installed."""
+  from google.cloud import bigquery
+  FakeBigQueryClient.row_count = args.rows
+  bigquery.Client = FakeBigQueryClient
+
+  import main
+  from src import config
+  from src import embeddings
+  import sqlalchemy
+
+  main.bigquery_storage.BigQueryReadClient = lambda *a, **kw: None
+  model = FakeEmbeddingModel(config.EMBEDDING_DIMENSIONS,
+                             args.embedding_latency_ms / 1000,
+                             args.embedding_error_rate)
+  embeddings.TextEmbeddingModel.from_pretrained = lambda *a, **kw: model
+
+  def init_local_pool():
+    main.database._db_pool = sqlalchemy.create_engine(
+        args.db_url, pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW)
+
+  main.database.create_database_if_not_exists = lambda: None
+  main.database.init_db_connection_pool = init_local_pool
+  # Nothing may leave the machine, including the end-to-end check.
+  import google.oauth2.id_token
+  import urllib.request
+  google.oauth2.id_token.fetch_id_token = _offline
+  urllib.request.urlopen = _offline
+
+  timings = {"index_seconds": 0.0}
+  create_vector_index = main.database.create_vector_index
+
+  def timed_create_vector_index():
+    started = time.monotonic()
+    try:
+      return create_vector_index()
+    finally:
+      timings["index_seconds"] += time.monotonic() - started
+
+  main.database.create_vector_index = timed_create_vector_index
+
+  # Busy seconds of the read, embed and write stages, when pipelined.
+  stage_stats = {}
+  run_pipeline = main.pipeline.run_pipeline
+
+  def recorded_run_pipeline(*args, **kwargs):
+    stats = run_pipeline(*args, **kwargs)
+    stage_stats.update(stats)
+    return stats
+
+  main.pipeline.run_pipeline = recorded_run_pipeline
+
+  # Start from an empty table so that every setting does the same work.
+  engine = sqlalchemy.create_engine(args.db_url)
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text(f'DROP TABLE IF EXISTS "{config.DB_TABLE}";'))
+  engine.dispose()
+
+  started = time.monotonic()
+  main.run_indexer()
+  elapsed = time.monotonic() - started
+
+  embedding_stats = main.embedding_client.get_stats()
+  write_stats = main.database.get_write_stats()
+  return {
+      "bq_batch_size": config.BQ_BATCH_SIZE,
+      "embedding_batch_size": config.EMBEDDING_BATCH_SIZE,
+      "rows_written": write_stats["rows"],
+      "elapsed_seconds": elapsed,
+      "rows_per_second": write_stats["rows"] / elapsed if elapsed else 0,
+      # Busy time of each pipeline stage, summed over the threads of the
+      # stage: can exceed the elapsed time. None when serial.
+      "read_seconds": stage_stats.get("read_seconds"),
+      "embed_stage_seconds": stage_stats.get("embed_seconds"),
+      "write_stage_seconds": stage_stats.get("write_seconds"),
+      # Embedding request latency and database write time, also summed
+      # over threads.
+      "embed_request_seconds": embedding_stats["latency_seconds"],
+      "write_seconds": write_stats["seconds"],
+      "index_seconds": timings["index_seconds"],
+      "embedding_requests": embedding_stats["requests"],
+      "embedding_retries": embedding_stats["retries"],
+      # ru_maxrss is in KiB on Linux.
+      "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  }
+
+
+def run_setting(args: argparse.Namespace, bq_batch_size: int,
+                embedding_batch_size: int) -> dict:
+  """Runs one batch-size setting in a child process and returns its result."""
+  env = {
+      **os.environ,
+      "PROJECT_ID": os.environ.get("PROJECT_ID", "benchmark"),
+      "DB_NAME": os.environ.get("DB_NAME", "postgres"),
+      "DB_SA": os.environ.get("DB_SA", "postgres"),
+      "DB_TABLE": args.table,
+      "BATCH_SIZE_BQ": str(bq_batch_size),
+      "BATCH_SIZE_EMBEDDING": str(embedding_batch_size),
+      "INGESTION_MODE": args.ingestion_mode,
+      "DB_WRITE_MODE": args.db_write_mode,
+      "BQ_READ_MODE": args.bq_read_mode,
+      "VECTOR_INDEX_TYPE": args.vector_index_type,
+      "VECTOR_QUANTIZATION": args.vector_quantization,
+      "EMBEDDING_RETRY_BASE_DELAY_SECONDS": "0.05",
+      "EMBEDDING_RETRY_MAX_DELAY_SECONDS": "1",
+  }
+  command = [
+      sys.executable, __file__, "--single", "--rows",
+      str(args.rows), "--embedding-latency-ms",
+      str(args.embedding_latency_ms), "--embedding-error-rate",
+      str(args.embedding_error_rate), "--db-url", args.db_url
+  ]
+  process = subprocess.run(command, env=env, capture_output=True, text=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+  for line in process.stdout.splitlines():
+    if line.startswith(_RESULT_PREFIX):
+      return json.loads(line[len(_RESULT_PREFIX):])
+  sys.stderr.write(process.stdout[-4000:] + process.stderr[-4000:])
+  raise RuntimeError(
+      f"Benchmark run failed for batch sizes {bq_batch_size}:{embedding_batch_size}."
+  )
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument("--rows", type=int, default=10000)
+  parser.add_argument(
+      "--batch-sizes", default="1000:100,1000:200,5000:250",
+      help="Comma-separated BQ_BATCH_SIZE:EMBEDDING_BATCH_SIZE settings.")
+  parser.add_argument("--embedding-latency-ms", type=float, default=200)
+  parser.add_argument("--embedding-error-rate", type=float, default=0.0)
+  parser.add_argument(
+      "--db-url", default=os.environ.get(
+          "BENCHMARK_DB_URL",
+          "postgresql+pg8000://postgres@localhost:5432/postgres"))
+  parser.add_argument("--table", default="benchmark_embeddings")
+  parser.add_argument("--ingestion-mode", default="pipelined",
+                      choices=["serial", "pipelined"])
+  parser.add_argument("--db-write-mode", default="copy",
+                      choices=["upsert", "copy"])
+  parser.add_argument("--bq-read-mode", default="rows",
+                      choices=["rows", "arrow"])
+  parser.add_argument("--vector-index-type", default="hnsw",
+                      choices=["hnsw", "ivfflat", "none"])
+  parser.add_argument("--vector-quantization", default="none",
+                      choices=["none", "halfvec", "bit"])
+  parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  if args.single:
+    result = run_single(args)
+    print(_RESULT_PREFIX + json.dumps(result), flush=True)
+    return
+
+  logging.basicConfig(level=logging.INFO, format="%(message)s")
+  results = []
+  for setting in args.batch_sizes.split(","):
+    bq_batch_size, embedding_batch_size = (int(v) for v in setting.split(":"))
+    logging.info(
+        f"Running {args.rows} rows with BQ_BATCH_SIZE={bq_batch_size}, EMBEDDING_BATCH_SIZE={embedding_batch_size}..."
+    )
+    results.append(run_setting(args, bq_batch_size, embedding_batch_size))
+
+  # Stage columns are busy seconds summed over the threads of each stage,
+  # "req s" the embedding request latency summed over threads.
+  header = (f"{'bq':>6} {'embed':>6} {'rows':>8} {'rows/s':>9} {'total s':>8} "
+            f"{'read s':>8} {'embed s':>8} {'write s':>8} {'req s':>8} "
+            f"{'index s':>8} {'retries':>7} {'RSS MiB':>8}")
+  print(header)
+
+  def seconds(value: float | None) -> str:
+    return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+
+  for r in results:
+    print(f"{r['bq_batch_size']:>6} {r['embedding_batch_size']:>6} "
+          f"{r['rows_written']:>8} {r['rows_per_second']:>9.0f} "
+          f"{r['elapsed_seconds']:>8.1f} {seconds(r['read_seconds'])} "
+          f"{seconds(r['embed_stage_seconds'])} "
+          f"{seconds(r['write_stage_seconds'])} "
+          f"{r['embed_request_seconds']:>8.1f} {r['index_seconds']:>8.1f} "
+          f"{r['embedding_retries']:>7} {r['peak_rss_mib']:>8.0f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -12,16 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import hashlib
 import os
 import logging
+import time
 import sys
 
 from google.cloud import bigquery
-from vertexai.language_models import TextEmbeddingModel
+from google.cloud import bigquery_storage
 from google.cloud import aiplatform  # For aiplatform.init()
 
+from src import checkpoint
+from src import chunking
+from src import columnar
 from src import config
+from src import dead_letter
 from src import db as database
+from src import embedding_cache
+from src import embeddings
+from src import pipeline
+from src import rate_limiter
 
 try:
   BQ_TEXT_COLUMNS = [
@@ -84,6 +95,28 @@ except Exception as e:
   logger.error(f"Error initializing Vertex AI SDK: {e}")
   sys.exit(1)
 
+embedding_rate_limiter = rate_limiter.RateLimiter(
+    requests_per_minute=config.EMBEDDING_REQUESTS_PER_MINUTE /
+    config.TASK_COUNT,
+    tokens_per_minute=config.EMBEDDING_TOKENS_PER_MINUTE / config.TASK_COUNT,
+    recovery_seconds=config.EMBEDDING_RATE_RECOVERY_SECONDS,
+)
+embedding_client = embeddings.EmbeddingClient(
+    model_name=config.EMBEDDING_MODEL_NAME,
+    dimensions=config.EMBEDDING_DIMENSIONS,
+    max_retries=config.EMBEDDING_MAX_RETRIES,
+    retry_base_delay=config.EMBEDDING_RETRY_BASE_DELAY_SECONDS,
+    retry_max_delay=config.EMBEDDING_RETRY_MAX_DELAY_SECONDS,
+    chars_per_token=config.EMBEDDING_CHARS_PER_TOKEN,
+    rate_limiter=embedding_rate_limiter,
+    output_dimensionality=config.EMBEDDING_OUTPUT_DIMENSIONALITY or None,
+)
+# Deduplicates the texts of every request. Stores are added at startup by
+# init_embedding_cache().
+embedder = embedding_cache.CachingEmbedder(embedding_client, stores=[])
+# Receives the items that failed, when DEAD_LETTER_PATH is set.
+dead_letter_sink: dead_letter.DeadLetterSink | None = None
+
 
 def format_bq_value_for_embedding(value) -> str:
   """
@@ -111,34 +144,345 @@ def safe_cast(value, cast_type, default=None):
     return default
 
 
-def get_embeddings_batch_vertexai(texts: list[str],
-                                  model_id_name: str) -> list[list[float]]:
-  """Gets embeddings for a batch of texts using Vertex AI TextEmbeddingModel."""
-  if not texts:
-    return []
+def compute_content_hash(text: str) -> str:
+  """
+    Returns the hash stored next to the embedding to detect changed rows.
+    It covers the embedding model, the (output) dimensionality and the
+    chunking settings too, so that switching any of them re-embeds and
+    re-chunks unchanged texts.
+    """
+  chunking_key = "0"
+  if config.CHUNK_MAX_TOKENS > 0:
+    chunking_key = f"{config.CHUNK_MAX_TOKENS}/{config.CHUNK_OVERLAP_TOKENS}/{config.EMBEDDING_CHARS_PER_TOKEN}"
+  key = f"{config.EMBEDDING_MODEL_NAME}\n{config.EMBEDDING_DIMENSIONS}\n{chunking_key}\n{text}"
+  return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+
+def build_item_from_row(row_data) -> dict | None:
+  """
+    Converts a BigQuery row into an ingestion item with the id, the
+    'content_to_embed' text and the metadata for the discrete SQL columns.
+    Returns None if the row has to be skipped.
+    """
   try:
-    model = TextEmbeddingModel.from_pretrained(model_id_name)
-    response = model.get_embeddings(
-        texts)  # Max batch size is 250 for many models
-    embeddings_values = [embedding.values for embedding in response]
+    item_id_val = row_data[config.GENERATED_ID_COLUMN_NAME]
+    if item_id_val is None:
+      raise ValueError("Generated ID is missing or null")
+    item_id_str = str(item_id_val)
+  except (KeyError, TypeError, ValueError) as e:
+    logger.warning(
+        f"Skipping BQ row: Cannot get generated ID '{config.GENERATED_ID_COLUMN_NAME}'. Error: {e}. Row keys: {list(row_data.keys()) if row_data else 'None'}"
+    )
+    return None
 
-    if not embeddings_values:
-      logger.warning(
-          f"Received empty embeddings list from Vertex AI model '{model_id_name}'."
+  # 1. Construct 'content_to_embed'
+  content_parts = []
+  for col_name in ALL_BQ_COLUMNS_TO_FETCH:
+    value = row_data.get(col_name)
+    formatted_value = format_bq_value_for_embedding(value)
+    content_parts.append(f"{col_name}: {formatted_value}")
+  current_text_to_embed = "; ".join(content_parts)
+
+  if not current_text_to_embed.strip():
+    logger.warning(
+        f"Skipping row with ID {item_id_str} due to empty 'content_to_embed'. Original parts: {content_parts}"
+    )
+    return None
+
+  # 2. Extract Metadata for discrete SQL columns using TARGET_BQ_COLUMNS
+  current_metadata_for_sql = {}
+  try:
+    for target_col in TARGET_BQ_COLUMNS:
+      # Text fields (and unlisted columns) become strings or None.
+      cast_type = config.TARGET_COLUMN_TYPES.get(target_col, str)
+      current_metadata_for_sql[target_col] = safe_cast(row_data.get(target_col),
+                                                       cast_type)
+  except Exception as e:
+    logger.warning(
+        f"Error processing metadata for ID {item_id_str}. Skipping row. Error: {e}. Row data sample: {dict(list(row_data.items())[:3])}"
+    )
+    return None
+
+  return {
+      "id": item_id_str,
+      "text_to_embed": current_text_to_embed,
+      "content_hash": compute_content_hash(current_text_to_embed),
+      "metadata": current_metadata_for_sql,
+      "embedding": None
+  }
+
+
+def iter_row_items(rows_iterator, counters: dict):
+  """
+    Yields ingestion items built one BigQuery row at a time, skipping invalid
+    rows. `counters['bq_rows']` is updated with the number of rows read.
+    """
+  for row_data in rows_iterator:
+    counters["bq_rows"] += 1
+    if counters["bq_rows"] % (config.BQ_BATCH_SIZE * 2) == 0:
+      logger.info(
+          f"Read {counters['bq_rows']} BQ rows ({counters['unchanged']} unchanged)."
       )
-      return []
-    if embeddings_values[0] and len(
-        embeddings_values[0]) != config.EMBEDDING_DIMENSIONS:
+    item = build_item_from_row(row_data)
+    if item is not None:
+      yield item
+
+
+def iter_arrow_items(record_batches, counters: dict):
+  """
+    Yields ingestion items built one Arrow record batch at a time.
+    `counters['bq_rows']` is updated with the number of rows read.
+    """
+  target_column_types = {
+      col: config.TARGET_COLUMN_TYPES.get(col, str) for col in TARGET_BQ_COLUMNS
+  }
+  for record_batch in record_batches:
+    counters["bq_rows"] += record_batch.num_rows
+    items = columnar.build_items_from_record_batch(
+        record_batch, id_column=config.GENERATED_ID_COLUMN_NAME,
+        columns_to_embed=ALL_BQ_COLUMNS_TO_FETCH,
+        target_column_types=target_column_types,
+        format_value=format_bq_value_for_embedding)
+    logger.info(
+        f"Read {counters['bq_rows']} BQ rows ({counters['unchanged']} unchanged)."
+    )
+    for item in items:
+      item["content_hash"] = compute_content_hash(item["text_to_embed"])
+      yield item
+
+
+def iter_items(source_items, counters: dict,
+               known_hashes: dict[int, str | None] | None = None,
+               seen_ids: set[int] | None = None):
+  """
+    Filters the ingestion items read from BigQuery.
+
+    In incremental mode `known_hashes` maps the IDs already stored in the
+    database to their content hash: rows whose hash did not change are not
+    yielded (and counted in `counters['unchanged']`), and every valid ID read
+    from the source is added to `seen_ids`.
+    """
+  for item in source_items:
+    if known_hashes is not None:
+      item_id = int(item["id"])
+      seen_ids.add(item_id)
+      if known_hashes.get(item_id) == item["content_hash"]:
+        counters["unchanged"] += 1
+        continue
+    yield item
+
+
+def iter_embedding_batches(source_items, counters: dict, **kwargs):
+  """
+    Splits ingestion items into chunks (when CHUNK_MAX_TOKENS is set) and
+    packs them into embedding requests bounded by both
+    EMBEDDING_BATCH_SIZE items and EMBEDDING_MAX_TOKENS_PER_REQUEST
+    estimated tokens.
+    """
+  items = iter_items(source_items, counters, **kwargs)
+  if config.CHUNK_MAX_TOKENS > 0:
+    items = chunking.iter_chunked_items(
+        items, max_tokens=config.CHUNK_MAX_TOKENS,
+        overlap_tokens=config.CHUNK_OVERLAP_TOKENS,
+        chars_per_token=config.EMBEDDING_CHARS_PER_TOKEN)
+  return embeddings.pack_batches(
+      items, max_items=config.EMBEDDING_BATCH_SIZE,
+      max_tokens=config.EMBEDDING_MAX_TOKENS_PER_REQUEST,
+      chars_per_token=config.EMBEDDING_CHARS_PER_TOKEN)
+
+
+def embed_batch(batch: list[dict]) -> list[dict] | None:
+  """
+    Fills the 'embedding' of every item in the batch. Items whose embedding
+    could not be generated are dropped from the batch. Returns None if no
+    item of the batch could be embedded.
+    """
+  texts_for_api = [item["text_to_embed"] for item in batch]
+  logger.info(
+      f"Requesting embeddings for batch of {len(texts_for_api)} texts (first ID {batch[0]['id']})..."
+  )
+  errors: dict[int, BaseException] = {}
+  try:
+    embeddings_list_result = embedder.embed(texts_for_api, errors)
+  except ValueError as e:
+    logger.error(f"{e} Exiting.")
+    sys.exit(1)
+
+  embedded_items = []
+  for index, (item, embedding) in enumerate(zip(batch, embeddings_list_result)):
+    if embedding is None:
       logger.error(
-          f"Embedding dimension mismatch! Model '{model_id_name}' returned {len(embeddings_values[0])} dims, expected {config.EMBEDDING_DIMENSIONS}. Exiting."
+          f"Failed to get embedding for ID {item['id']}. Skipping DB insert for this row."
       )
-      sys.exit(1)
-    return embeddings_values
+      if dead_letter_sink is not None:
+        dead_letter_sink.write([item], "embedding", errors[index])
+      continue
+    item["embedding"] = embedding
+    embedded_items.append(item)
+  return embedded_items or None
+
+
+def write_batch(batch: list[dict]) -> int:
+  """
+    Writes an embedded batch to the database. If that fails, the batch goes
+    to the dead-letter sink (when configured). With chunking, the chunks
+    left over from longer previous versions of the items are deleted.
+    Returns rows upserted.
+    """
+  if dead_letter_sink is None:
+    written = database.write_batch_to_db(batch)
+  else:
+    try:
+      written = database.write_batch_to_db(batch, raise_on_error=True)
+    except Exception as e:
+      dead_letter_sink.write(batch, "write", e)
+      return 0
+  if written:
+    database.delete_orphan_chunks(batch)
+  return written
+
+
+def iter_replay_items(location: str, counters: dict):
+  """
+    Yields the items of a dead-letter file (or directory/prefix of files)
+    that belong to this task's shard.
+    """
+  for item in dead_letter.read_items(location):
+    # Same predicate as the BigQuery query and database.shard_filter_sql().
+    parent_id = item["id"] if item["parent_id"] is None else item["parent_id"]
+    if abs(int(parent_id)) % config.TASK_COUNT != config.TASK_INDEX:
+      continue
+    counters["bq_rows"] += 1
+    yield item
+
+
+def mark_corpus_changed():
+  """Bumps the corpus version, so that the frontends drop their cached answers."""
+  try:
+    database.bump_corpus_version()
   except Exception as e:
-    logger.error(
-        f"Error getting embeddings from Vertex AI (model: {model_id_name}): {e}"
+    logger.warning(f"Could not bump the corpus version: {e}")
+
+
+def init_embedding_cache():
+  """Puts the configured embedding stores in front of the embedding client."""
+  global embedder
+  stores = []
+  if config.EMBEDDING_CACHE_PATH:
+    stores.append(
+        embedding_cache.SQLiteEmbeddingStore(config.EMBEDDING_CACHE_PATH))
+  if config.EMBEDDING_CACHE_DB:
+    database.create_embedding_cache_table_if_not_exists()
+    stores.append(embedding_cache.DatabaseEmbeddingStore(database))
+  embedder = embedding_cache.CachingEmbedder(embedding_client, stores)
+
+
+def init_dead_letter_sink():
+  """Creates the dead-letter sink if DEAD_LETTER_PATH is set."""
+  global dead_letter_sink
+  if config.DEAD_LETTER_PATH:
+    dead_letter_sink = dead_letter.DeadLetterSink(
+        config.DEAD_LETTER_PATH, config.RUN_ID, config.TASK_INDEX,
+        config.TASK_ATTEMPT, config.DEAD_LETTER_UPLOAD_INTERVAL_SECONDS)
+
+
+def run_serial(batches, embed_fn=embed_batch, write_fn=write_batch) -> int:
+  """Embeds and writes batches one after another. Returns rows upserted."""
+  total_upserted_count = 0
+  for batch in batches:
+    embedded_batch = embed_fn(batch)
+    if embedded_batch is None:
+      continue
+    total_upserted_count += write_fn(embedded_batch)
+    logger.info(f"Approx {total_upserted_count} records upserted.")
+  return total_upserted_count
+
+
+def run_pipelined(batches, embed_fn=embed_batch, write_fn=write_batch) -> int:
+  """
+    Overlaps reading, embedding and writing using bounded queues.
+    Returns rows upserted.
+    """
+  stats = pipeline.run_pipeline(
+      batches, embed_fn=embed_fn, write_fn=write_fn,
+      embedding_workers=config.EMBEDDING_WORKERS, db_writers=config.DB_WRITERS,
+      max_inflight_batches=config.MAX_INFLIGHT_BATCHES)
+  return stats["rows_written"]
+
+
+def build_id_expression() -> str:
+  """
+    Returns the BigQuery expression used for the row ID.
+
+    Without BQ_KEY_COLUMN the ID is a ROW_NUMBER(), which is not stable
+    across runs. With it, integer keys are used as-is and other key types
+    are mapped to a deterministic INT64 with FARM_FINGERPRINT.
+    """
+  if not config.BQ_KEY_COLUMN:
+    return "ROW_NUMBER() OVER()"
+  table = bq_client.get_table(
+      f"{config.PROJECT_ID}.{config.BQ_DATASET}.{config.BQ_TABLE}")
+  key_field = next(
+      (field for field in table.schema if field.name == config.BQ_KEY_COLUMN),
+      None)
+  if key_field is None:
+    raise KeyError(
+        f"Key column '{config.BQ_KEY_COLUMN}' not found in {config.BQ_DATASET}.{config.BQ_TABLE}."
     )
-    return []
+  if key_field.field_type in ("INTEGER", "INT64"):
+    return f"`{config.BQ_KEY_COLUMN}`"
+  return f"FARM_FINGERPRINT(CAST(`{config.BQ_KEY_COLUMN}` AS STRING))"
+
+
+def read_bigquery_items(counters: dict, resume_after_id: int | None = None):
+  """
+    Queries the rows of this task's shard (after `resume_after_id`, if set)
+    and returns an iterator over their ingestion items.
+    """
+  try:
+    id_expression = build_id_expression()
+  except Exception as e:
+    logger.error(f"Error resolving the BigQuery key column: {e}")
+    sys.exit(1)
+
+  select_cols_str = ", ".join([f"`{col}`" for col in ALL_BQ_COLUMNS_TO_FETCH])
+  conditions = []
+  if config.TASK_COUNT > 1:
+    # Same predicate as database.shard_filter_sql(), so that incremental
+    # deletes stay within this task's shard.
+    conditions.append(
+        f"ABS(MOD({id_expression}, {config.TASK_COUNT})) = {config.TASK_INDEX}")
+  if resume_after_id is not None:
+    conditions.append(f"{id_expression} > {int(resume_after_id)}")
+  where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+  # Checkpoints are only meaningful if rows are read in ID order.
+  order_clause = f"ORDER BY {config.GENERATED_ID_COLUMN_NAME}" if config.CHECKPOINTING else ""
+  query = f"""
+    SELECT
+        {id_expression} AS {config.GENERATED_ID_COLUMN_NAME},
+        {select_cols_str}
+    FROM
+        `{config.PROJECT_ID}.{config.BQ_DATASET}.{config.BQ_TABLE}`
+    {where_clause}
+    {order_clause}
+    """
+
+  logger.info("Executing BigQuery query...")
+  try:
+    query_job = bq_client.query(query)
+    rows_iterator = query_job.result(page_size=config.BQ_BATCH_SIZE)
+    logger.info("BigQuery query submitted successfully, iterating results.")
+  except Exception as e:
+    logger.error(f"Error executing BigQuery query: {e}")
+    sys.exit(1)
+
+  if config.BQ_READ_MODE == "arrow":
+    # Arrow record batches are downloaded in parallel streams by the
+    # BigQuery Storage Read API instead of paging through JSON rows.
+    return iter_arrow_items(
+        rows_iterator.to_arrow_iterable(
+            bqstorage_client=bigquery_storage.BigQueryReadClient()), counters)
+  return iter_row_items(rows_iterator, counters)
 
 
 def run_indexer():
@@ -159,153 +503,260 @@ def run_indexer():
       f"Embedding Model: {config.EMBEDDING_MODEL_NAME} ({config.EMBEDDING_DIMENSIONS} dims)"
   )
   logger.info(
-      f"Batch sizes: BQ Page={config.BQ_BATCH_SIZE}, Embedding Request={config.EMBEDDING_BATCH_SIZE}"
+      f"Batch sizes: BQ Page={config.BQ_BATCH_SIZE}, Embedding Request={config.EMBEDDING_BATCH_SIZE} items / ~{config.EMBEDDING_MAX_TOKENS_PER_REQUEST} tokens"
+  )
+  logger.info(
+      f"Ingestion mode: {config.INGESTION_MODE}, BigQuery read mode: {config.BQ_READ_MODE}, DB write mode: {config.DB_WRITE_MODE}"
+  )
+  logger.info(
+      f"Key column: {config.BQ_KEY_COLUMN or 'ROW_NUMBER()'}, incremental: {config.INCREMENTAL_INDEXING}"
   )
+  logger.info(f"Shard: {config.TASK_INDEX} of {config.TASK_COUNT} tasks")
+
+  if config.INGESTION_MODE not in ("serial", "pipelined"):
+    logger.error(
+        f"Unknown INGESTION_MODE '{config.INGESTION_MODE}'. Use 'serial' or 'pipelined'."
+    )
+    sys.exit(1)
+  if min(config.EMBEDDING_WORKERS, config.DB_WRITERS,
+         config.MAX_INFLIGHT_BATCHES) < 1:
+    logger.error(
+        "EMBEDDING_WORKERS, DB_WRITERS and MAX_INFLIGHT_BATCHES must be at least 1."
+    )
+    sys.exit(1)
+  if config.CHUNK_MAX_TOKENS > 0 and not (0 <= config.CHUNK_OVERLAP_TOKENS <
+                                          config.CHUNK_MAX_TOKENS):
+    logger.error(
+        f"CHUNK_OVERLAP_TOKENS ({config.CHUNK_OVERLAP_TOKENS}) must be at least 0 and smaller than CHUNK_MAX_TOKENS ({config.CHUNK_MAX_TOKENS})."
+    )
+    sys.exit(1)
+  if config.DB_WRITE_MODE not in ("upsert", "copy"):
+    logger.error(
+        f"Unknown DB_WRITE_MODE '{config.DB_WRITE_MODE}'. Use 'upsert' or 'copy'."
+    )
+    sys.exit(1)
+  if config.BQ_READ_MODE not in ("rows", "arrow"):
+    logger.error(
+        f"Unknown BQ_READ_MODE '{config.BQ_READ_MODE}'. Use 'rows' or 'arrow'.")
+    sys.exit(1)
+  if config.INCREMENTAL_INDEXING and not config.BQ_KEY_COLUMN:
+    logger.error(
+        "INCREMENTAL_INDEXING requires BQ_KEY_COLUMN: ROW_NUMBER() IDs are not stable across runs."
+    )
+    sys.exit(1)
+  if config.CHECKPOINTING and not config.BQ_KEY_COLUMN:
+    logger.error(
+        "CHECKPOINTING requires BQ_KEY_COLUMN: ROW_NUMBER() IDs are not stable across attempts."
+    )
+    sys.exit(1)
+  if config.TASK_COUNT > 1 and not config.BQ_KEY_COLUMN:
+    logger.error(
+        "Sharding across multiple tasks requires BQ_KEY_COLUMN: ROW_NUMBER() IDs would overlap between shards."
+    )
+    sys.exit(1)
+  if config.VECTOR_INDEX_TYPE not in ("hnsw", "ivfflat", "none"):
+    logger.error(
+        f"Unknown VECTOR_INDEX_TYPE '{config.VECTOR_INDEX_TYPE}'. Use 'hnsw', 'ivfflat' or 'none'."
+    )
+    sys.exit(1)
+  if (config.EMBEDDING_OUTPUT_DIMENSIONALITY and
+      config.EMBEDDING_OUTPUT_DIMENSIONALITY != config.EMBEDDING_DIMENSIONS):
+    logger.error(
+        f"EMBEDDING_OUTPUT_DIMENSIONALITY ({config.EMBEDDING_OUTPUT_DIMENSIONALITY}) and "
+        f"EMBEDDING_DIMENSIONS ({config.EMBEDDING_DIMENSIONS}) differ.")
+    sys.exit(1)
+  if config.VECTOR_QUANTIZATION not in database.VECTOR_QUANTIZATIONS:
+    logger.error(
+        f"Unknown VECTOR_QUANTIZATION '{config.VECTOR_QUANTIZATION}'. Use 'none', 'halfvec' or 'bit'."
+    )
+    sys.exit(1)
+  if config.REPLAY_DEAD_LETTER_PATH and (config.INCREMENTAL_INDEXING or
+                                         config.CHECKPOINTING):
+    logger.error(
+        "REPLAY_DEAD_LETTER_PATH cannot be combined with INCREMENTAL_INDEXING or CHECKPOINTING."
+    )
+    sys.exit(1)
+  if not 0 <= config.TASK_INDEX < config.TASK_COUNT:
+    logger.error(
+        f"Invalid shard: task index {config.TASK_INDEX} for {config.TASK_COUNT} tasks."
+    )
+    sys.exit(1)
+  started = time.monotonic()
 
   try:
     database.create_database_if_not_exists()
     database.init_db_connection_pool()
     database.create_table_if_not_exists()
+    table_dimensions = database.get_embedding_column_dimensions()
+    if table_dimensions and table_dimensions != config.EMBEDDING_DIMENSIONS:
+      # The column, its index and the stored embeddings all have one size.
+      raise ValueError(
+          f"table '{config.DB_TABLE}' stores {table_dimensions}-dimension embeddings but "
+          f"EMBEDDING_DIMENSIONS is {config.EMBEDDING_DIMENSIONS}. Use a new DB_TABLE to change the size"
+      )
+    if (not config.INCREMENTAL_INDEXING and
+        not config.REPLAY_DEAD_LETTER_PATH and config.TASK_COUNT == 1):
+      # Building the index once after the load is much faster than
+      # maintaining it row by row. Tasks of a sharded job keep it, as other
+      # shards may already have finished.
+      database.drop_vector_indexes()
+    if config.CHECKPOINTING:
+      database.create_progress_table_if_not_exists()
+    if config.TASK_COUNT > 1:
+      database.create_finished_shards_table_if_not_exists()
+    init_embedding_cache()
   except Exception as e:
     logger.error(f"Halting job due to inability to setup database: {e}")
     sys.exit(1)
 
-  select_cols_str = ", ".join([f"`{col}`" for col in ALL_BQ_COLUMNS_TO_FETCH])
-  query = f"""
-    SELECT
-        ROW_NUMBER() OVER() AS {config.GENERATED_ID_COLUMN_NAME},
-        {select_cols_str}
-    FROM
-        `{config.PROJECT_ID}.{config.BQ_DATASET}.{config.BQ_TABLE}`
-    """
-
-  logger.info("Executing BigQuery query...")
-  try:
-    query_job = bq_client.query(query)
-    rows_iterator = query_job.result(page_size=config.BQ_BATCH_SIZE)
-    logger.info("BigQuery query submitted successfully, iterating results.")
-  except Exception as e:
-    logger.error(f"Error executing BigQuery query: {e}")
-    sys.exit(1)
-
-  processed_bq_rows_count = 0
-  total_upserted_count = 0
-  batch_for_embedding_processing = []
-
-  for row_idx, row_data in enumerate(rows_iterator):
-    processed_bq_rows_count += 1
-
-    try:
-      item_id_val = row_data[config.GENERATED_ID_COLUMN_NAME]
-      if item_id_val is None:
-        raise ValueError("Generated ID is missing or null")
-      item_id_str = str(item_id_val)
-    except (KeyError, TypeError, ValueError) as e:
-      logger.warning(
-          f"Skipping BQ row number {processed_bq_rows_count} (iterator index {row_idx}): Cannot get generated ID '{config.GENERATED_ID_COLUMN_NAME}'. Error: {e}. Row keys: {list(row_data.keys()) if row_data else 'None'}"
-      )
-      continue
-
-    # 1. Construct 'content_to_embed'
-    content_parts = []
-    for col_name in ALL_BQ_COLUMNS_TO_FETCH:
-      value = row_data.get(col_name)
-      formatted_value = format_bq_value_for_embedding(value)
-      content_parts.append(f"{col_name}: {formatted_value}")
-    current_text_to_embed = "; ".join(content_parts)
-
-    if not current_text_to_embed.strip():
-      logger.warning(
-          f"Skipping row with ID {item_id_str} due to empty 'content_to_embed'. Original parts: {content_parts}"
-      )
-      continue
-
-    # 2. Extract Metadata for discrete SQL columns using TARGET_BQ_COLUMNS
-    current_metadata_for_sql = {}
-    try:
-      for target_col in TARGET_BQ_COLUMNS:
-        raw_value = row_data.get(target_col)
-        if target_col == 'rank':
-          current_metadata_for_sql['rank'] = safe_cast(raw_value, int)
-        elif target_col == 'rating':
-          current_metadata_for_sql['rating'] = safe_cast(raw_value, float)
-        elif target_col == 'year':
-          current_metadata_for_sql['year'] = safe_cast(raw_value, int)
-          # For text fields, ensure they are strings or None.
-        elif target_col in ['title', 'description', 'genre']:
-          current_metadata_for_sql[target_col] = str(
-              raw_value) if raw_value is not None else None
-        else:
-          current_metadata_for_sql[target_col] = str(
-              raw_value) if raw_value is not None else None
-    except Exception as e:
-      logger.warning(
-          f"Error processing metadata for ID {item_id_str}. Skipping row. Error: {e}. Row data sample: {dict(list(row_data.items())[:3])}"
+  resume_after_id = None
+  if config.CHECKPOINTING and config.TASK_ATTEMPT > 0:
+    resume_after_id = database.load_checkpoint(config.RUN_ID, config.TASK_INDEX)
+    if resume_after_id is not None:
+      logger.info(
+          f"Attempt {config.TASK_ATTEMPT} of execution '{config.RUN_ID}': resuming after ID {resume_after_id}."
       )
-      continue
-
-    batch_for_embedding_processing.append({
-        "id": item_id_str,
-        "text_to_embed": current_text_to_embed,
-        "metadata": current_metadata_for_sql,
-        "embedding": None
-    })
-
-    # 3. Process batch for embeddings when full
-    if len(batch_for_embedding_processing) >= config.EMBEDDING_BATCH_SIZE:
-      texts_for_api = [
-          item["text_to_embed"] for item in batch_for_embedding_processing
-      ]
+    else:
       logger.info(
-          f"Requesting embeddings for batch of {len(texts_for_api)} texts (Total BQ rows: {processed_bq_rows_count})..."
+          f"Attempt {config.TASK_ATTEMPT} of execution '{config.RUN_ID}': no checkpoint found, starting over."
       )
-      embeddings_list_result = get_embeddings_batch_vertexai(
-          texts_for_api, config.EMBEDDING_MODEL_NAME)
-
-      if embeddings_list_result and len(embeddings_list_result) == len(
-          batch_for_embedding_processing):
-        for i, item in enumerate(batch_for_embedding_processing):
-          item["embedding"] = embeddings_list_result[i]
-        upserted_in_batch = database.upsert_batch_to_db(
-            batch_for_embedding_processing)
-        total_upserted_count += upserted_in_batch
-      else:
-        logger.error(
-            f"Failed to get embeddings or length mismatch for batch (ID {batch_for_embedding_processing[0]['id']}). Expected {len(batch_for_embedding_processing)}, got {len(embeddings_list_result) if embeddings_list_result else 'None'}. Skipping DB insert."
-        )
-      batch_for_embedding_processing = []
 
-    if processed_bq_rows_count % (config.BQ_BATCH_SIZE * 2) == 0:
+  known_hashes = None
+  seen_ids: set[int] = set()
+  if config.INCREMENTAL_INDEXING:
+    known_hashes = database.fetch_content_hashes(config.TASK_INDEX,
+                                                 config.TASK_COUNT)
+    logger.info(
+        f"Incremental run: {len(known_hashes)} rows already indexed in '{config.DB_TABLE}'."
+    )
+    if resume_after_id is not None:
+      # Rows up to the checkpoint are not read again, so they can neither be
+      # compared nor detected as deleted during this attempt.
+      known_hashes = {
+          item_id: content_hash
+          for item_id, content_hash in known_hashes.items()
+          if item_id > resume_after_id
+      }
       logger.info(
-          f"Processed {processed_bq_rows_count} BQ rows. Approx {total_upserted_count} records upserted."
+          f"Resumed attempt: stale rows are only detected after ID {resume_after_id}."
       )
 
-  # 4. Process any remaining items in the last batch
-  if batch_for_embedding_processing:
-    texts_for_api = [
-        item["text_to_embed"] for item in batch_for_embedding_processing
-    ]
+  counters = {"bq_rows": 0, "unchanged": 0}
+  if config.REPLAY_DEAD_LETTER_PATH:
     logger.info(
-        f"Requesting embeddings for final batch of {len(texts_for_api)} texts..."
+        f"Replay run: re-ingesting the items of {config.REPLAY_DEAD_LETTER_PATH} instead of BigQuery."
     )
-    embeddings_list_result = get_embeddings_batch_vertexai(
-        texts_for_api, config.EMBEDDING_MODEL_NAME)
-
-    if embeddings_list_result and len(embeddings_list_result) == len(
-        batch_for_embedding_processing):
-      for i, item in enumerate(batch_for_embedding_processing):
-        item["embedding"] = embeddings_list_result[i]
-      upserted_in_batch = database.upsert_batch_to_db(
-          batch_for_embedding_processing)
-      total_upserted_count += upserted_in_batch
+    source_items = iter_replay_items(config.REPLAY_DEAD_LETTER_PATH, counters)
+  else:
+    source_items = read_bigquery_items(counters, resume_after_id)
+  batches = iter_embedding_batches(source_items, counters,
+                                   known_hashes=known_hashes, seen_ids=seen_ids)
+  embed_fn, write_fn = embed_batch, write_batch
+  checkpointer = None
+  if config.CHECKPOINTING:
+    checkpointer = checkpoint.Checkpointer(
+        functools.partial(database.save_checkpoint, config.RUN_ID,
+                          config.TASK_INDEX),
+        interval_seconds=config.CHECKPOINT_INTERVAL_SECONDS)
+    batches = checkpointer.track(batches)
+    embed_fn = checkpointer.wrap_embed(embed_fn)
+    write_fn = checkpointer.wrap_write(write_fn)
+  init_dead_letter_sink()
+  try:
+    if config.INGESTION_MODE == "pipelined":
+      total_upserted_count = run_pipelined(batches, embed_fn, write_fn)
     else:
-      logger.error(
-          f"Failed to get embeddings or mismatch for final batch (ID {batch_for_embedding_processing[0]['id']}). Skipping DB insert."
-      )
+      total_upserted_count = run_serial(batches, embed_fn, write_fn)
+  finally:
+    # Whatever was fully written before a failure is not redone by a retry.
+    if checkpointer is not None:
+      checkpointer.flush()
+    if dead_letter_sink is not None:
+      dead_letter_sink.close()
+    if database.get_write_stats()["rows"]:
+      mark_corpus_changed()
+  processed_bq_rows_count = counters["bq_rows"]
+
+  deleted_count = 0
+  if known_hashes is not None:
+    # Only reached when the whole source was read without errors, so every
+    # ID missing from `seen_ids` really disappeared from the source.
+    stale_ids = [item_id for item_id in known_hashes if item_id not in seen_ids]
+    deleted_count = database.delete_rows_by_ids(stale_ids)
+    if deleted_count:
+      mark_corpus_changed()
+    logger.info(
+        f"Incremental summary: {counters['unchanged']} rows unchanged (embedding skipped), "
+        f"{deleted_count} rows deleted because they disappeared from the source."
+    )
+
+  index_build_seconds = None
+  if config.INCREMENTAL_INDEXING or config.REPLAY_DEAD_LETTER_PATH:
+    logger.info(
+        "Incremental or replay run: skipping vector index creation, the existing index is maintained on write."
+    )
+  else:
+    try:
+      finished_shards = config.TASK_COUNT
+      if config.TASK_COUNT > 1:
+        # Built from the rows of every shard, by the last task to finish.
+        finished_shards = database.mark_shard_finished(config.RUN_ID,
+                                                       config.TASK_INDEX)
+      if finished_shards < config.TASK_COUNT:
+        logger.info(
+            f"{finished_shards} of {config.TASK_COUNT} shards finished: the last one builds the vector index."
+        )
+      else:
+        index_build_seconds = database.create_vector_index()
+    except Exception as e:
+      logger.error(f"Error creating the vector index: {e}")
+      sys.exit(1)
+
+  embedding_stats = embedding_client.get_stats()
+  avg_latency_ms = (embedding_stats["latency_seconds"] * 1000 /
+                    embedding_stats["requests"]
+                    if embedding_stats["requests"] else 0)
+  logger.info(
+      f"Embedding summary: {embedding_stats['texts_embedded']} texts embedded, "
+      f"{embedding_stats['texts_failed']} failed, {embedding_stats['requests']} requests "
+      f"(avg {avg_latency_ms:.0f} ms), {embedding_stats['retries']} retries, "
+      f"{embedding_stats['splits']} splits.")
+  if embedding_rate_limiter.enabled:
+    limiter_stats = embedding_rate_limiter.get_stats()
+    logger.info(
+        f"Rate limiter summary: {limiter_stats['acquired']} requests paced, "
+        f"{limiter_stats['wait_seconds']:.1f}s waited, {limiter_stats['throttled']} quota errors, "
+        f"ending at {limiter_stats['rate_fraction']:.0%} of the configured rate."
+    )
+  cache_stats = embedder.get_stats()
+  cache_hits = sum(cache_stats["hits"])
+  logger.info(
+      f"Embedding cache summary: {cache_stats['texts']} texts, {cache_stats['duplicates']} duplicates "
+      f"within requests, {cache_hits} cache hits {cache_stats['hits']} per store, "
+      f"{cache_stats['misses']} sent to the model. Hit rate: "
+      f"{(cache_stats['duplicates'] + cache_hits) / cache_stats['texts'] if cache_stats['texts'] else 0:.1%}."
+  )
+  write_stats = database.get_write_stats()
+  logger.info(
+      f"DB write summary ({config.DB_WRITE_MODE}): {write_stats['rows']} rows in "
+      f"{write_stats['seconds']:.1f}s of write time "
+      f"({write_stats['rows'] / write_stats['seconds'] if write_stats['seconds'] else 0:.0f} rows/s)."
+  )
 
   logger.info(
       f"Indexer job finished. Processed {processed_bq_rows_count} rows from BigQuery."
   )
+  logger.info(
+      f"Shard {config.TASK_INDEX}/{config.TASK_COUNT} summary: {processed_bq_rows_count} rows read, "
+      f"{counters['unchanged']} unchanged, {total_upserted_count} upserted, {deleted_count} deleted "
+      f"in {time.monotonic() - started:.1f}s.")
+  if index_build_seconds is not None:
+    logger.info(
+        f"Vector index ({config.VECTOR_INDEX_TYPE}, quantization {config.VECTOR_QUANTIZATION}) build time: {index_build_seconds:.1f}s."
+    )
+  logger.info(
+      f"Total records attempted for upsert into AlloyDB table '{config.DB_TABLE}': {total_upserted_count}."
+  )
   # E2E RAG Verification Query
   logger.info("Performing E2E RAG movie query verification request...")
   import urllib.request
@@ -359,7 +810,8 @@ if __name__ == "__main__":
   job_task_index = os.environ.get("CLOUD_RUN_TASK_INDEX", "N/A")
   job_attempt = os.environ.get("CLOUD_RUN_TASK_ATTEMPT", "N/A")
   logger.info(
-      f"Cloud Run Job: Task Index {job_task_index}, Attempt {job_attempt}.")
+      f"Cloud Run Job: Task Index {job_task_index} of {config.TASK_COUNT}, Attempt {job_attempt}."
+  )
 
   try:
     run_indexer()
@@ -0,0 +1,95 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+from typing import Iterable, Iterator
+
+
+def chunk_text(text: str, max_chars: int, overlap_chars: int) -> list[str]:
+  """
+    Splits a text on whitespace into chunks of at most `max_chars` characters
+    (a single longer word becomes its own chunk). Consecutive chunks share
+    about `overlap_chars` characters, so that no sentence is only seen cut
+    in half, but each chunk starts at least `max_chars - overlap_chars`
+    characters (or the whole previous chunk) after the previous one.
+    """
+  words = text.split()
+  stride = max(1, max_chars - overlap_chars)
+  chunks = []
+  start = 0
+  while start < len(words):
+    end = start
+    length = 0
+    while end < len(words) and (end == start or
+                                length + 1 + len(words[end]) <= max_chars):
+      length += len(words[end]) + (1 if end > start else 0)
+      end += 1
+    chunks.append(" ".join(words[start:end]))
+    if end == len(words):
+      break
+    # Step back over the last words of the chunk to build the overlap, but
+    # always move forward by at least the stride and by at least one word.
+    overlap_budget = min(overlap_chars, length - stride)
+    next_start = end
+    overlap = 0
+    while next_start - 1 > start and overlap + len(
+        words[next_start - 1]) + 1 <= overlap_budget:
+      next_start -= 1
+      overlap += len(words[next_start]) + 1
+    start = next_start
+  return chunks or [text]
+
+
+def chunk_id(parent_id: int, chunk_index: int) -> int:
+  """
+    Returns the row ID of a chunk. The first chunk keeps the parent ID, the
+    others get a deterministic signed 64-bit hash of (parent ID, index).
+    """
+  if chunk_index == 0:
+    return parent_id
+  digest = hashlib.sha256(f"{parent_id}:{chunk_index}".encode()).digest()
+  return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def iter_chunked_items(items: Iterable[dict], max_tokens: int,
+                       overlap_tokens: int,
+                       chars_per_token: float) -> Iterator[dict]:
+  """
+    Splits every item whose text exceeds `max_tokens` estimated tokens into
+    chunk items of that size, overlapping by `overlap_tokens`. Each chunk is
+    stored as its own row, linked to the item through 'parent_id', and keeps
+    the item's metadata and content hash. Items that already are chunks
+    (e.g. replayed from a dead-letter file) are passed through.
+    """
+  max_chars = max(1, int(max_tokens * chars_per_token))
+  overlap_chars = int(overlap_tokens * chars_per_token)
+  for item in items:
+    if item.get("parent_id") is not None:
+      yield item
+      continue
+    parent_id = int(item["id"])
+    text = item["text_to_embed"]
+    if len(text) <= max_chars:
+      chunks = [text]
+    else:
+      chunks = chunk_text(text, max_chars, overlap_chars)
+    for chunk_index, chunk in enumerate(chunks):
+      yield {
+          **item,
+          "id": str(chunk_id(parent_id, chunk_index)),
+          "parent_id": parent_id,
+          "chunk_index": chunk_index,
+          "chunk_count": len(chunks),
+          "text_to_embed": chunk,
+      }
@@ -14,6 +14,8 @@
 
 import os
 
+from . import utils
+
 PROJECT_ID = os.environ.get("PROJECT_ID")
 REGION = os.environ.get("REGION", "europe-west1")
 
@@ -33,8 +35,53 @@ LLM_MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", 2048))
 # Embedding Model Configuration
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME",
                                       "text-multilingual-embedding-002")
-EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 768))
+# EMBEDDING_OUTPUT_DIMENSIONALITY requests reduced-dimension embeddings from
+# models that support it (Matryoshka embeddings, e.g. 256 instead of 768),
+# and defaults EMBEDDING_DIMENSIONS, the expected size of every embedding, to
+# it. 0 keeps the model's default size.
+EMBEDDING_OUTPUT_DIMENSIONALITY = int(
+    os.environ.get("EMBEDDING_OUTPUT_DIMENSIONALITY", 0))
+EMBEDDING_DIMENSIONS = int(
+    os.environ.get("EMBEDDING_DIMENSIONS", EMBEDDING_OUTPUT_DIMENSIONALITY or
+                   768))
 EMBEDDING_BATCH_SIZE = int(os.environ.get("BATCH_SIZE_EMBEDDING", 200))
+# Per-request limits of the embedding API. Requests are packed so that both
+# the item count and the estimated token count stay under these limits.
+EMBEDDING_MAX_TOKENS_PER_REQUEST = int(
+    os.environ.get("EMBEDDING_MAX_TOKENS_PER_REQUEST", 20000))
+EMBEDDING_CHARS_PER_TOKEN = float(
+    os.environ.get("EMBEDDING_CHARS_PER_TOKEN", 3.0))
+# Chunking splits texts longer than CHUNK_MAX_TOKENS estimated tokens into
+# chunks overlapping by CHUNK_OVERLAP_TOKENS, each stored as its own row with
+# the ID of its item in 'parent_id' (0 = no chunking).
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 0))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 50))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 5))
+EMBEDDING_RETRY_BASE_DELAY_SECONDS = float(
+    os.environ.get("EMBEDDING_RETRY_BASE_DELAY_SECONDS", 1.0))
+EMBEDDING_RETRY_MAX_DELAY_SECONDS = float(
+    os.environ.get("EMBEDDING_RETRY_MAX_DELAY_SECONDS", 60.0))
+# Embedding quota shared by all the tasks of the job, in requests and
+# estimated tokens per minute (0 = unlimited). Each task gets an equal share,
+# paced by a token bucket that slows down on 429 errors and recovers over
+# EMBEDDING_RATE_RECOVERY_SECONDS.
+EMBEDDING_REQUESTS_PER_MINUTE = float(
+    os.environ.get("EMBEDDING_REQUESTS_PER_MINUTE", 0))
+EMBEDDING_TOKENS_PER_MINUTE = float(
+    os.environ.get("EMBEDDING_TOKENS_PER_MINUTE", 0))
+EMBEDDING_RATE_RECOVERY_SECONDS = float(
+    os.environ.get("EMBEDDING_RATE_RECOVERY_SECONDS", 60.0))
+
+# Embedding Cache Configuration
+# Embeddings are keyed by (model, dimensions, SHA-256 of the text). Identical
+# texts of a request are always embedded once. EMBEDDING_CACHE_PATH enables a
+# local SQLite cache for the run and EMBEDDING_CACHE_DB a table in the target
+# database, shared across runs.
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")
+EMBEDDING_CACHE_DB = utils.str_to_bool(
+    os.environ.get("EMBEDDING_CACHE_DB", "false"))
+EMBEDDING_CACHE_TABLE = os.environ.get("EMBEDDING_CACHE_TABLE",
+                                       "embedding_cache")
 
 # Database configuration
 # TODO: DB_HOST probably not needed in case of AlloyDB
@@ -49,9 +96,100 @@ ALLOYDB_INSTANCE_URI = "projects/" + os.environ.get("PROJECT_ID") \
 if not DB_NAME or not DB_SA:
   raise ValueError("No env variables configured for DB_NAME or DB_SA")
 
+# Pipeline Configuration
+# "serial" reads, embeds and writes one batch at a time. "pipelined" runs a
+# BigQuery reader, EMBEDDING_WORKERS embedding threads and DB_WRITERS database
+# threads concurrently, with at most MAX_INFLIGHT_BATCHES batches queued
+# between two stages. DB_WRITERS should not exceed DB_POOL_SIZE + DB_MAX_OVERFLOW.
+INGESTION_MODE = os.environ.get("INGESTION_MODE", "serial")
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", 4))
+DB_WRITERS = int(os.environ.get("DB_WRITERS", 2))
+MAX_INFLIGHT_BATCHES = int(os.environ.get("MAX_INFLIGHT_BATCHES", 4))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+
+# DB Write Configuration
+# "upsert" runs a multi-row INSERT ... ON CONFLICT per batch. "copy" streams
+# each batch with binary COPY into a temporary staging table and merges it into
+# the target table with a single INSERT ... SELECT ... ON CONFLICT.
+DB_WRITE_MODE = os.environ.get("DB_WRITE_MODE", "upsert")
+
+# Vector Index Configuration
+# Full runs drop the index before loading and build it afterwards. Incremental
+# runs keep the existing index, which pgvector maintains on every write.
+# VECTOR_INDEX_TYPE is "hnsw", "ivfflat" or "none". IVFFLAT_LISTS=0 sizes the
+# lists from the row count.
+# VECTOR_QUANTIZATION "halfvec" (16-bit floats, half the size) or "bit"
+# (binary quantization, 1/32 of the size) indexes a quantized expression of
+# the embedding instead of the full vectors, which stay in the table for exact
+# re-ranking. The frontend SEARCH_QUANTIZATION must match.
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw")
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+HNSW_M = int(os.environ.get("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 64))
+IVFFLAT_LISTS = int(os.environ.get("IVFFLAT_LISTS", 0))
+INDEX_MAINTENANCE_WORK_MEM = os.environ.get("INDEX_MAINTENANCE_WORK_MEM", "")
+
 # Columns Configuration
 GENERATED_ID_COLUMN_NAME = os.environ.get("GENERATED_ID_COLUMN_NAME", "id")
 BQ_TEXT_COLUMNS_STR = os.environ.get("BQ_TEXT_COLUMNS", "title,description")
 TARGET_BQ_COLUMNS_DEFAULT = [
     'rank', 'title', 'description', 'genre', 'rating', 'year'
 ]
+# Type each metadata column is cast to before being stored in its own SQL
+# column. Columns not listed here are stored as text.
+TARGET_COLUMN_TYPES = {
+    'rank': int,
+    'title': str,
+    'description': str,
+    'genre': str,
+    'rating': float,
+    'year': int,
+}
+# "rows" iterates query results row by row. "arrow" streams them as Arrow
+# record batches through the BigQuery Storage Read API and builds the
+# 'content_to_embed' strings and metadata column by column.
+BQ_READ_MODE = os.environ.get("BQ_READ_MODE", "rows")
+
+# Incremental Indexing Configuration
+# BQ_KEY_COLUMN is a stable, unique column of the source table used as the row
+# ID (hashed to INT64 if it is not an integer). When unset, IDs are generated
+# with ROW_NUMBER() and change between runs.
+# With INCREMENTAL_INDEXING, rows whose content hash is unchanged are not
+# re-embedded and rows that disappeared from the source are deleted.
+BQ_KEY_COLUMN = os.environ.get("BQ_KEY_COLUMN")
+INCREMENTAL_INDEXING = utils.str_to_bool(
+    os.environ.get("INCREMENTAL_INDEXING", "false"))
+
+# Sharding Configuration
+# Cloud Run Jobs set these for every task. With more than one task, each task
+# only indexes the rows whose ID satisfies ABS(MOD(id, TASK_COUNT)) = TASK_INDEX.
+# Non-integer keys are already hashed into IDs by FARM_FINGERPRINT.
+# The vector index is built by the last task of the execution (RUN_ID) to
+# finish, once every shard is loaded.
+TASK_INDEX = int(os.environ.get("CLOUD_RUN_TASK_INDEX", 0))
+TASK_COUNT = int(os.environ.get("CLOUD_RUN_TASK_COUNT", 1))
+TASK_ATTEMPT = int(os.environ.get("CLOUD_RUN_TASK_ATTEMPT", 0))
+
+# Checkpoint Configuration
+# With CHECKPOINTING, rows are read in ID order and every task records the
+# last ID below which all rows were written in the progress table, at most
+# every CHECKPOINT_INTERVAL_SECONDS. A retried task (CLOUD_RUN_TASK_ATTEMPT
+# > 0) of the same job execution resumes after that ID. Requires BQ_KEY_COLUMN.
+CHECKPOINTING = utils.str_to_bool(os.environ.get("CHECKPOINTING", "false"))
+CHECKPOINT_INTERVAL_SECONDS = float(
+    os.environ.get("CHECKPOINT_INTERVAL_SECONDS", 30))
+RUN_ID = os.environ.get("CLOUD_RUN_EXECUTION", "local")
+
+# Dead-letter Configuration
+# Items that cannot be embedded or written are appended, with the failing
+# stage and error class, to a JSONL file under DEAD_LETTER_PATH (a local
+# directory or a gs:// prefix), one file per task attempt. A gs:// file is
+# re-uploaded at most every DEAD_LETTER_UPLOAD_INTERVAL_SECONDS while the
+# task runs, so records survive a crash, and once more when it finishes.
+# REPLAY_DEAD_LETTER_PATH (a file, directory or gs:// prefix of such files)
+# re-ingests only those items instead of reading BigQuery.
+DEAD_LETTER_PATH = os.environ.get("DEAD_LETTER_PATH", "")
+DEAD_LETTER_UPLOAD_INTERVAL_SECONDS = float(
+    os.environ.get("DEAD_LETTER_UPLOAD_INTERVAL_SECONDS", "30"))
+REPLAY_DEAD_LETTER_PATH = os.environ.get("REPLAY_DEAD_LETTER_PATH", "")
@@ -0,0 +1,130 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+  """
+    Paces calls with two token buckets, one counting requests and one
+    counting (estimated) tokens, both refilled continuously.
+
+    acquire() reserves capacity and sleeps until the reservation is covered,
+    so concurrent callers are spread out evenly instead of bursting into the
+    quota. A reservation larger than a bucket holds is allowed and simply
+    waits longer. On throttled() (a 429 from the API) the rates are halved,
+    down to `min_rate_fraction` of the configured limits; they then recover
+    linearly to the limits over `recovery_seconds`.
+
+    A limit of 0 disables the corresponding bucket. The limiter is safe to
+    share between threads.
+    """
+
+  def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+               min_rate_fraction: float = 0.1, recovery_seconds: float = 60.0,
+               log_interval_seconds: float = 60.0):
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self.min_rate_fraction = min_rate_fraction
+    self.recovery_seconds = recovery_seconds
+    self.log_interval_seconds = log_interval_seconds
+    self._lock = threading.Lock()
+    self._fraction = 1.0
+    now = time.monotonic()
+    self._updated = now
+    self._last_throttled = 0.0
+    self._last_log = now
+    # Buckets start full: one second worth of the configured rate.
+    self._request_level = requests_per_minute / 60
+    self._token_level = tokens_per_minute / 60
+    self._stats = {"acquired": 0, "throttled": 0, "wait_seconds": 0.0}
+
+  @property
+  def enabled(self) -> bool:
+    return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+  def _refill(self, now: float) -> None:
+    """Refills both buckets and recovers the rate. Requires the lock."""
+    elapsed = now - self._updated
+    self._updated = now
+    request_rate = self.requests_per_minute / 60 * self._fraction
+    token_rate = self.tokens_per_minute / 60 * self._fraction
+    self._request_level = min(request_rate,
+                              self._request_level + elapsed * request_rate)
+    self._token_level = min(token_rate,
+                            self._token_level + elapsed * token_rate)
+    if self._fraction < 1.0 and self.recovery_seconds > 0:
+      self._fraction = min(1.0,
+                           self._fraction + elapsed / self.recovery_seconds)
+
+  def acquire(self, tokens: int = 0) -> float:
+    """Blocks until one request of `tokens` tokens may be sent. Returns the wait."""
+    if not self.enabled:
+      return 0.0
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      wait = 0.0
+      if self.requests_per_minute > 0:
+        self._request_level -= 1
+        wait = max(
+            wait, -self._request_level /
+            (self.requests_per_minute / 60 * self._fraction))
+      if self.tokens_per_minute > 0:
+        self._token_level -= tokens
+        wait = max(
+            wait,
+            -self._token_level / (self.tokens_per_minute / 60 * self._fraction))
+      self._stats["acquired"] += 1
+      self._stats["wait_seconds"] += wait
+      if now - self._last_log >= self.log_interval_seconds:
+        self._last_log = now
+        self._log_state(wait)
+    if wait > 0:
+      time.sleep(wait)
+    return wait
+
+  def throttled(self) -> None:
+    """Slows down after the API rejected a call for exceeding the quota."""
+    if not self.enabled:
+      return
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      self._stats["throttled"] += 1
+      # Concurrent callers see the same burst of 429s: halve only once.
+      if now - self._last_throttled < 1.0:
+        return
+      self._last_throttled = now
+      self._fraction = max(self.min_rate_fraction, self._fraction / 2)
+      logger.warning(
+          f"Embedding quota exceeded, slowing down to {self._fraction:.0%} of the configured rate."
+      )
+
+  def _log_state(self, wait: float) -> None:
+    """Logs the current rate and waits. Requires the lock."""
+    logger.info(
+        f"Rate limiter: {self.requests_per_minute * self._fraction:.0f} requests/min, "
+        f"{self.tokens_per_minute * self._fraction:.0f} tokens/min "
+        f"({self._fraction:.0%} of limits). Last wait {wait:.2f}s, "
+        f"{self._stats['wait_seconds']:.1f}s waited in total.")
+
+  def get_stats(self) -> dict:
+    """Returns the counters and the current fraction of the configured rate."""
+    with self._lock:
+      return {**self._stats, "rate_fraction": self._fraction}
@@ -12,21 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
 import os
 import sys
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 import google.api_core.exceptions as exceptions
 from google import genai
 from google.genai import types
 
-from sqlalchemy.orm import Session
-
 import uvicorn
 
 from src import config
+from src.answer_cache import SemanticAnswerCache
+from src.embedding_cache import QueryEmbeddingCache
 from src.request_model import Prompt
 from src import db as database
 
@@ -56,6 +58,66 @@ MODEL_CONFIG = types.GenerateContentConfig(
     candidate_count=config.LLM_CANDIDATE_COUNT,
     max_output_tokens=config.LLM_MAX_OUTPUT_TOKENS,
 )
+EMBEDDING_CONFIG = types.EmbedContentConfig(
+    output_dimensionality=config.EMBEDDING_OUTPUT_DIMENSIONALITY or None)
+# Embeddings of different sizes must not share cache entries.
+EMBEDDING_CACHE_MODEL = f"{config.EMBEDDING_MODEL_NAME}/{config.EMBEDDING_OUTPUT_DIMENSIONALITY}"
+embedding_cache = QueryEmbeddingCache(
+    max_entries=config.QUERY_EMBEDDING_CACHE_SIZE,
+    ttl_seconds=config.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    redis_url=config.QUERY_EMBEDDING_CACHE_REDIS_URL or None)
+answer_cache = SemanticAnswerCache(
+    max_entries=config.SEMANTIC_CACHE_SIZE,
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=config.SEMANTIC_CACHE_TTL_SECONDS,
+    version_check_seconds=config.SEMANTIC_CACHE_VERSION_CHECK_SECONDS
+) if config.SEMANTIC_CACHE_ENABLED else None
+
+
+async def embed_query(prompt: str) -> list[float]:
+  """Returns the embedding of a prompt, from the cache when possible."""
+  embedding = await embedding_cache.get(EMBEDDING_CACHE_MODEL, prompt)
+  if embedding is None:
+    # The async client keeps the event loop free for other requests.
+    embedding = (await genai_client.aio.models.embed_content(
+        model=config.EMBEDDING_MODEL_NAME, contents=[prompt],
+        config=EMBEDDING_CONFIG)).embeddings[0].values
+    await embedding_cache.put(EMBEDDING_CACHE_MODEL, prompt, embedding)
+  return embedding
+
+
+def answer_cache_scope(request: Prompt) -> str:
+  """Returns the request options that change the retrieval, as a cache scope."""
+  return json.dumps(request.model_dump(exclude={"prompt"}), sort_keys=True)
+
+
+def build_augmented_prompt(context: str, prompt: str) -> str:
+  """Returns the prompt grounded in the retrieved context."""
+  return (f"Based on the following context, answer the question.\n\n"
+          f"Context:\n{context}\n\n"
+          f"Question: {prompt}")
+
+
+async def lookup_answer(embedding: list[float], request: Prompt) -> dict | None:
+  """Returns the response to a similar enough prompt from the answer cache."""
+  if answer_cache is None:
+    return None
+  await answer_cache.refresh_version(
+      lambda: run_in_threadpool(database.get_corpus_version))
+  cached = answer_cache.lookup(embedding, answer_cache_scope(request))
+  if cached is None:
+    return None
+  value, similarity = cached
+  logging.info(
+      f"Answer served from the semantic cache (similarity {similarity:.3f}).")
+  # Only the answer is cached: the prompts are those of this request.
+  return {
+      "prompt":
+          request.prompt,
+      "augmented_prompt":
+          build_augmented_prompt(value["retrieved_context"], request.prompt),
+      **value,
+  }
 
 
 @app.on_event("startup")
@@ -69,6 +131,7 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
   logging.info("Application shutdown...")
+  await embedding_cache.close()
   database.close_db_connection_pool()
 
 
@@ -90,14 +153,17 @@ async def root():
           config.EMBEDDING_MODEL_NAME,
       "genai_client_status":
           client_status,
+      "query_embedding_cache":
+          embedding_cache.get_stats(),
+      "semantic_answer_cache":
+          answer_cache.get_stats() if answer_cache else "disabled",
       "database_status":
           db_status,
   }
 
 
 @app.post("/predict")
-async def predict_route(request: Prompt,
-                        db: Session = Depends(database.get_db_session)):
+async def predict_route(request: Prompt):
   """Endpoint to make a prediction using Vertex AI, augmented with context from Cloud SQL."""
 
   if not genai_client:
@@ -114,29 +180,32 @@ async def predict_route(request: Prompt,
 
   context_str = ""
   augmented_prompt = request.prompt
+  embedding_response = None
+  answered = False
 
   if database.engine:
     try:
       logging.info(
           f"Generating embedding for prompt using model: {config.EMBEDDING_MODEL_NAME}"
       )
-      embedding_response = genai_client.models.embed_content(
-          model=config.EMBEDDING_MODEL_NAME,
-          contents=[request.prompt]).embeddings[0].values
+      embedding_response = await embed_query(request.prompt)
 
       logging.info(
           f"Generated query embedding (first 3 dimensions): {embedding_response[:3]}..."
       )
+      cached_response = await lookup_answer(embedding_response, request)
+      if cached_response:
+        return cached_response
 
-      similar_docs = database.search_similar_documents(db, embedding_response,
-                                                       config.RETRIEVER_TOP_K)
+      # The database driver is synchronous: query from a worker thread.
+      similar_docs = await run_in_threadpool(
+          database.search_similar_documents, embedding_response,
+          config.RETRIEVER_TOP_K, ef_search=request.ef_search,
+          probes=request.probes, iterative_scan=request.iterative_scan)
 
       if similar_docs:
         context_str = "\n\n".join(similar_docs)
-        augmented_prompt = (
-            f"Based on the following context, answer the question.\n\n"
-            f"Context:\n{context_str}\n\n"
-            f"Question: {request.prompt}")
+        augmented_prompt = build_augmented_prompt(context_str, request.prompt)
         logging.info("Augmented prompt with context from database.")
       else:
         logging.info(
@@ -151,7 +220,7 @@ async def predict_route(request: Prompt,
       logging.error(f"Unexpected error in RAG pipeline: {e}", exc_info=True)
 
   try:
-    response = genai_client.models.generate_content(
+    response = await genai_client.aio.models.generate_content(
         model=MODEL_NAME,
         contents=[augmented_prompt],
         config=MODEL_CONFIG,
@@ -168,6 +237,7 @@ async def predict_route(request: Prompt,
     if not prediction_text and hasattr(response, 'text'):
       prediction_text = response.text
 
+    answered = bool(prediction_text)
     if not prediction_text:
       logging.warning("Received an empty prediction from Vertex AI.")
       prediction_text = "I could not generate a response based on the input."
@@ -185,12 +255,19 @@ async def predict_route(request: Prompt,
                   exc_info=True)
     prediction_text = "An unexpected error occurred while trying to get an answer."
 
-  return {
+  result = {
       "prompt": request.prompt,
       "augmented_prompt": augmented_prompt if context_str else request.prompt,
       "retrieved_context": context_str,
       "prediction": prediction_text
   }
+  # Only grounded answers are cached, not those without context or failures.
+  if answer_cache is not None and context_str and answered:
+    answer_cache.store(embedding_response, answer_cache_scope(request), {
+        "retrieved_context": context_str,
+        "prediction": prediction_text
+    })
+  return result
 
 
 if __name__ == "__main__":
@@ -14,6 +14,8 @@
 
 import os
 
+from . import utils
+
 PROJECT_ID = os.environ.get("PROJECT_ID")
 REGION = os.environ.get("REGION", "europe-west1")
 
@@ -29,6 +31,41 @@ LLM_MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", 2048))
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME",
                                       "text-multilingual-embedding-002")
 EMBEDDING_TASK_TYPE = "RETRIEVAL_QUERY"
+# Reduced query embedding size, must match the one used at ingestion
+# (0 = model default).
+EMBEDDING_OUTPUT_DIMENSIONALITY = int(
+    os.environ.get("EMBEDDING_OUTPUT_DIMENSIONALITY", 0))
+
+# Query Embedding Cache Configuration
+# Up to QUERY_EMBEDDING_CACHE_SIZE prompt embeddings (0 disables the cache)
+# are kept in memory for QUERY_EMBEDDING_CACHE_TTL_SECONDS, keyed by model and
+# normalized prompt. QUERY_EMBEDDING_CACHE_REDIS_URL (e.g.
+# "redis://10.0.0.3:6379/0") adds a Redis-compatible store shared by all
+# instances.
+QUERY_EMBEDDING_CACHE_SIZE = int(
+    os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(
+    os.environ.get("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 3600))
+QUERY_EMBEDDING_CACHE_REDIS_URL = os.environ.get(
+    "QUERY_EMBEDDING_CACHE_REDIS_URL", "")
+
+# Semantic Answer Cache Configuration
+# With SEMANTIC_CACHE_ENABLED, a prompt whose embedding has a cosine
+# similarity of at least SEMANTIC_CACHE_THRESHOLD with a recently answered
+# one (up to SEMANTIC_CACHE_SIZE answers kept SEMANTIC_CACHE_TTL_SECONDS) gets
+# the cached answer, without retrieval nor generation. The cache is cleared
+# once an ingestion has changed the table (the ingestion job bumps a version in
+# the DB_TABLE_corpus_version table), which is checked every
+# SEMANTIC_CACHE_VERSION_CHECK_SECONDS.
+SEMANTIC_CACHE_ENABLED = utils.str_to_bool(
+    os.environ.get("SEMANTIC_CACHE_ENABLED", "false"))
+SEMANTIC_CACHE_THRESHOLD = float(
+    os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 1000))
+SEMANTIC_CACHE_TTL_SECONDS = float(
+    os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 86400))
+SEMANTIC_CACHE_VERSION_CHECK_SECONDS = float(
+    os.environ.get("SEMANTIC_CACHE_VERSION_CHECK_SECONDS", 60))
 
 # DB configuration
 DB_HOST = os.environ.get("DB_HOST", "127.0.0.1")
@@ -38,6 +75,54 @@ DB_SA = os.environ.get("DB_SA")
 DB_TABLE = os.environ.get("DB_TABLE", "movie_embeddings")
 DB_COLUMN_TEXT = os.environ.get("DB_COLUMN_TEXT", "content_to_embed")
 DB_COLUMN_EMBEDDING = os.environ.get("DB_COLUMN_EMBEDDING", "embedding")
+DB_COLUMN_ID = os.environ.get("DB_COLUMN_ID", "id")
+DB_COLUMN_PARENT_ID = os.environ.get("DB_COLUMN_PARENT_ID", "parent_id")
+DB_COLUMN_CHUNK_INDEX = os.environ.get("DB_COLUMN_CHUNK_INDEX", "chunk_index")
+
+# Connection Pool Configuration
+# pg8000 connections kept open per instance. Each search holds one only while
+# its query runs; searches beyond DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW
+# concurrent ones wait up to DB_POOL_TIMEOUT_SECONDS for a connection.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_MAX_OVERFLOW = int(os.environ.get("DB_POOL_MAX_OVERFLOW", 2))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", 1800))
 
 # Retriever Configuration
 RETRIEVER_TOP_K = int(os.environ.get("RETRIEVER_TOP_K", 10))
+# With RETRIEVER_COLLAPSE_CHUNKS, the nearest top_k * CHUNK_CANDIDATES_FACTOR
+# chunks are grouped by parent item: top_k items are returned, ranked by their
+# best chunk, with their matching chunks joined in document order. Requires a
+# table written by the ingestion job with chunking columns.
+RETRIEVER_COLLAPSE_CHUNKS = utils.str_to_bool(
+    os.environ.get("RETRIEVER_COLLAPSE_CHUNKS", "false"))
+RETRIEVER_CHUNK_CANDIDATES_FACTOR = int(
+    os.environ.get("RETRIEVER_CHUNK_CANDIDATES_FACTOR", 4))
+
+# Search Effort Configuration
+# Defaults for the pgvector query-time parameters, overridable per /predict
+# request up to the MAX_* caps. Higher values improve recall at the cost of
+# latency. SEARCH_ITERATIVE_SCAN is "off", "relaxed_order" or "strict_order"
+# (pgvector 0.8.0+) and keeps scanning the index when filtering leaves fewer
+# than top_k rows.
+SEARCH_HNSW_EF_SEARCH = int(os.environ.get("SEARCH_HNSW_EF_SEARCH", 40))
+SEARCH_MAX_HNSW_EF_SEARCH = int(
+    os.environ.get("SEARCH_MAX_HNSW_EF_SEARCH", 1000))
+SEARCH_IVFFLAT_PROBES = int(os.environ.get("SEARCH_IVFFLAT_PROBES", 1))
+SEARCH_MAX_IVFFLAT_PROBES = int(os.environ.get("SEARCH_MAX_IVFFLAT_PROBES",
+                                               100))
+SEARCH_ITERATIVE_SCAN = os.environ.get("SEARCH_ITERATIVE_SCAN", "off")
+
+# Quantized Search Configuration
+# SEARCH_QUANTIZATION must match the VECTOR_QUANTIZATION of the ingestion job.
+# With "halfvec" or "bit", the quantized index returns the nearest
+# top_k * SEARCH_RERANK_FACTOR candidates, which are re-ranked by their exact
+# cosine distance on the full vectors. Binary quantization loses more
+# precision and needs a higher factor. With HNSW, ef_search is raised to the
+# number of candidates.
+SEARCH_QUANTIZATION = os.environ.get("SEARCH_QUANTIZATION", "none")
+SEARCH_RERANK_FACTOR = int(os.environ.get("SEARCH_RERANK_FACTOR", 4))
+if SEARCH_QUANTIZATION not in ("none", "halfvec", "bit"):
+  raise ValueError(
+      f"Unknown SEARCH_QUANTIZATION '{SEARCH_QUANTIZATION}'. Use 'none', 'halfvec' or 'bit'."
+  )
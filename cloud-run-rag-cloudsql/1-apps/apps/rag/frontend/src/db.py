@@ -31,12 +31,13 @@ logging.basicConfig(
 # Global connector and engine to be initialized at startup
 connector: Connector = None
 engine: sqlalchemy.engine.Engine = None
+SessionLocal: sessionmaker = None
 
 
 def init_db_connection_pool():
   """Initializes the Cloud SQL (PostgreSQL) connector
     and SQLAlchemy engine using IAM authentication."""
-  global connector, engine
+  global connector, engine, SessionLocal
   if not all([config.DB_HOST, config.DB_NAME, config.DB_PORT, config.DB_SA]):
     logging.warning("Database configuration (DB_HOST, DB_NAME, DB_PORT, DB_SA) "
                     "is not complete. Database features will be disabled.")
@@ -48,8 +49,12 @@ def init_db_connection_pool():
                                               port=config.DB_PORT,
                                               username=config.DB_SA,
                                               database=config.DB_NAME)
-    engine = sqlalchemy.create_engine(db_url, pool_size=5, max_overflow=2,
-                                      pool_timeout=30, pool_recycle=1800)
+    engine = sqlalchemy.create_engine(
+        db_url, pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_POOL_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=config.DB_POOL_RECYCLE_SECONDS)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     logging.info("Database connection pool initialized successfully.")
   except Exception as e:
     logging.error(f"Failed to initialize database connection pool: {e}",
@@ -57,26 +62,143 @@ def init_db_connection_pool():
     engine = None  # Ensure engine is None if init fails
 
 
-def get_db_session() -> Session:
-  """Dependency to get a database session."""
-  if not engine:
-    # Raise an error or handle as appropriate
-    # if the DB connection is critical
-    logging.error("Database engine not initialized. Cannot provide DB session.")
-    raise ConnectionError("Database engine not initialized.")
-  SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-  db = SessionLocal()
-  try:
-    yield db
-  finally:
-    db.close()
+_ITERATIVE_SCAN_MODES = ("off", "relaxed_order", "strict_order")
+# Largest hnsw.ef_search accepted by pgvector.
+_HNSW_MAX_EF_SEARCH = 1000
+
+
+def index_candidates(top_k: int) -> int:
+  """Returns the number of rows the similarity query reads from the index."""
+  candidates = top_k
+  if config.RETRIEVER_COLLAPSE_CHUNKS:
+    candidates *= config.RETRIEVER_CHUNK_CANDIDATES_FACTOR
+  if config.SEARCH_QUANTIZATION != "none":
+    candidates *= config.SEARCH_RERANK_FACTOR
+  return candidates
+
+
+def resolve_search_params(ef_search: int | None = None,
+                          probes: int | None = None,
+                          iterative_scan: str | None = None,
+                          candidates: int = 0) -> dict:
+  """
+    Fills in the configured defaults for missing search effort parameters
+    and caps the requested ones to the server limits. An HNSW scan returns
+    at most ef_search rows, so ef_search is raised to the number of
+    `candidates` the query reads from the index.
+    """
+  ef_search = min(ef_search or config.SEARCH_HNSW_EF_SEARCH,
+                  config.SEARCH_MAX_HNSW_EF_SEARCH)
+  params = {
+      "ef_search":
+          min(max(ef_search, candidates), _HNSW_MAX_EF_SEARCH),
+      "probes":
+          min(probes or config.SEARCH_IVFFLAT_PROBES,
+              config.SEARCH_MAX_IVFFLAT_PROBES),
+      "iterative_scan":
+          iterative_scan or config.SEARCH_ITERATIVE_SCAN,
+  }
+  if params["iterative_scan"] not in _ITERATIVE_SCAN_MODES:
+    logging.warning(
+        f"Unknown iterative scan mode '{params['iterative_scan']}', using 'off'."
+    )
+    params["iterative_scan"] = "off"
+  return params
+
+
+def apply_search_params(db: Session, params: dict) -> None:
+  """
+    Sets the pgvector search parameters with SET LOCAL, so that they only
+    apply to the current transaction, i.e. the current request.
+    """
+  db.execute(text(f"SET LOCAL hnsw.ef_search = {int(params['ef_search'])}"))
+  db.execute(text(f"SET LOCAL ivfflat.probes = {int(params['probes'])}"))
+  if params["iterative_scan"] != "off":
+    # Only set when needed: the parameters do not exist before pgvector 0.8.0.
+    db.execute(
+        text(f"SET LOCAL hnsw.iterative_scan = {params['iterative_scan']}"))
+    db.execute(
+        text(f"SET LOCAL ivfflat.iterative_scan = {params['iterative_scan']}"))
 
 
-def search_similar_documents(db: Session, embedding: list[float],
-                             top_k: int) -> list[str]:
+def distance_sql(quantization: str, dimensions: int) -> str:
+  """
+    Returns the distance to :embedding for the given quantization. Quantized
+    distances repeat the expression indexed by the ingestion job, so that
+    the planner uses that index.
+    """
+  column = f'"{config.DB_COLUMN_EMBEDDING}"'
+  if quantization == "halfvec":
+    return (f"{column}::halfvec({dimensions}) "
+            f"<=> CAST(:embedding AS halfvec({dimensions}))")
+  if quantization == "bit":
+    return (f"binary_quantize({column})::bit({dimensions}) "
+            f"<~> binary_quantize(CAST(:embedding AS vector({dimensions})))")
+  return f"{column} <=> :embedding"
+
+
+def nearest_rows_sql(columns: str, limit: str, dimensions: int) -> str:
+  """
+    Returns a query of the `limit` rows nearest to :embedding, with the
+    given columns and their exact cosine 'distance'. With quantization, the
+    quantized index first returns `limit` * :rerank_factor candidates.
+    """
+  exact_distance = distance_sql("none", dimensions)
+  if config.SEARCH_QUANTIZATION == "none":
+    return f"""
+              SELECT {columns}, {exact_distance} AS distance
+              FROM "{config.DB_TABLE}"
+              ORDER BY {exact_distance}
+              LIMIT {limit}"""
+  return f"""
+              SELECT * FROM (
+                SELECT {columns}, {exact_distance} AS distance
+                FROM "{config.DB_TABLE}"
+                ORDER BY {distance_sql(config.SEARCH_QUANTIZATION, dimensions)}
+                LIMIT {limit} * :rerank_factor
+              ) AS coarse
+              ORDER BY distance
+              LIMIT {limit}"""
+
+
+def similarity_query_sql(dimensions: int) -> str:
+  """
+    Returns the nearest-neighbour query, binding :embedding, :top_k,
+    :rerank_factor and (when chunks are collapsed to their parent items)
+    :candidates.
+    """
+  if not config.RETRIEVER_COLLAPSE_CHUNKS:
+    return f"""
+            WITH nearest AS ({nearest_rows_sql(
+                f'"{config.DB_COLUMN_TEXT}" AS content', ":top_k", dimensions)}
+            )
+            SELECT content FROM nearest ORDER BY distance
+            """
+  columns = (
+      f'COALESCE("{config.DB_COLUMN_PARENT_ID}", "{config.DB_COLUMN_ID}") AS parent, '
+      f'"{config.DB_COLUMN_CHUNK_INDEX}" AS chunk_index, '
+      f'"{config.DB_COLUMN_TEXT}" AS content')
+  return f"""
+            WITH nearest AS ({nearest_rows_sql(columns, ":candidates", dimensions)}
+            )
+            SELECT string_agg(content, ' ... ' ORDER BY chunk_index)
+            FROM nearest
+            GROUP BY parent
+            ORDER BY min(distance)
+            LIMIT :top_k
+            """
+
+
+def search_similar_documents(embedding: list[float], top_k: int,
+                             ef_search: int | None = None,
+                             probes: int | None = None,
+                             iterative_scan: str | None = None) -> list[str]:
   """
     Searches for documents with embeddings similar to
     the query_embedding in PostgreSQL using pgvector.
+    The search effort parameters default to the server configuration.
+    The session only lives for the search: its pooled connection is returned
+    before the answer is generated.
     """
   if not engine:
     logging.warning("Database not configured. Skipping document search.")
@@ -84,19 +206,29 @@ def search_similar_documents(db: Session, embedding: list[float],
 
   try:
     embedding_str = str(embedding)
+    search_params = resolve_search_params(ef_search, probes, iterative_scan,
+                                          index_candidates(top_k))
 
     # Using <=> for cosine distance (pgvector specific).
     # Lower distance = more similar.
-    query = text(f"""
-            SELECT "{config.DB_COLUMN_TEXT}"
-            FROM "{config.DB_TABLE}"
-            ORDER BY "{config.DB_COLUMN_EMBEDDING}" <=> :embedding
-            LIMIT :top_k
-            """)
+    query = text(similarity_query_sql(len(embedding)))
 
-    result = db.execute(query, {"embedding": embedding_str, "top_k": top_k})
-    documents = [row[0] for row in result.fetchall()]
-    logging.info(f"Retrieved {len(documents)} similar documents from DB.")
+    # The transaction scopes the SET LOCAL search parameters; it is committed
+    # on success and rolled back on error.
+    with SessionLocal() as db, db.begin():
+      apply_search_params(db, search_params)
+      result = db.execute(
+          query, {
+              "embedding": embedding_str,
+              "top_k": top_k,
+              "candidates": top_k * config.RETRIEVER_CHUNK_CANDIDATES_FACTOR,
+              "rerank_factor": config.SEARCH_RERANK_FACTOR
+          })
+      documents = [row[0] for row in result.fetchall()]
+    logging.info(
+        f"Retrieved {len(documents)} similar documents from DB (ef_search={search_params['ef_search']}, "
+        f"probes={search_params['probes']}, iterative_scan={search_params['iterative_scan']})."
+    )
     return documents
   except sqlalchemy.exc.SQLAlchemyError as e:
     logging.error(f"Database error during similarity search: {e}",
@@ -108,6 +240,23 @@ def search_similar_documents(db: Session, embedding: list[float],
     return []
 
 
+def get_corpus_version() -> int | None:
+  """
+    Returns the version of the table content, which the ingestion job bumps
+    whenever it writes or deletes rows, so that cached answers can be
+    invalidated after an ingestion. None before the first ingestion.
+    """
+  version_table = f"{config.DB_TABLE}_corpus_version"
+  with engine.connect() as connection:
+    exists = connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {
+        "name": f'"{version_table}"'
+    }).scalar()
+    if not exists:
+      return None
+    return connection.execute(
+        text(f'SELECT version FROM "{version_table}"')).scalar()
+
+
 def close_db_connection_pool():
   """Closes the Cloud SQL connector and disposes the SQLAlchemy engine."""
   global connector, engine
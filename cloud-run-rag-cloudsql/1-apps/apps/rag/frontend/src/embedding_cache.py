@@ -0,0 +1,143 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import collections
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+  """
+    Returns the form of a prompt used as cache key: case-folded, with runs of
+    whitespace collapsed, so that trivially different prompts share an entry.
+    """
+  return " ".join(prompt.casefold().split())
+
+
+class QueryEmbeddingCache:
+  """
+    Caches query embeddings by (model, normalized prompt).
+
+    Entries are kept in process in an LRU of `max_entries` entries, expiring
+    after `ttl_seconds`. With `redis_url`, a Redis-compatible store is used
+    as a second level shared by all instances: local misses are looked up
+    there, and new embeddings are written to both. Store errors are logged
+    and treated as misses, a broken cache never fails a request.
+
+    Only used from the event loop, no locking needed.
+    """
+
+  def __init__(self, max_entries: int, ttl_seconds: float,
+               redis_url: str | None = None):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._entries: collections.OrderedDict[str, tuple[
+        float, list[float]]] = collections.OrderedDict()
+    self._stats = {
+        "hits": 0,
+        "shared_hits": 0,
+        "misses": 0,
+        "errors": 0,
+    }
+    self._redis = None
+    if redis_url:
+      # Only needed with a shared store.
+      import redis.asyncio
+      self._redis = redis.asyncio.from_url(redis_url)
+      logger.info("Query embeddings are also cached in the shared store.")
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_entries > 0
+
+  @staticmethod
+  def _key(model: str, prompt: str) -> str:
+    digest = hashlib.sha256(
+        f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+    return f"query-embedding:{digest}"
+
+  async def get(self, model: str, prompt: str) -> list[float] | None:
+    """Returns the cached embedding of the prompt, or None."""
+    if not self.enabled:
+      return None
+    key = self._key(model, prompt)
+    entry = self._entries.get(key)
+    if entry is not None:
+      expires, embedding = entry
+      if expires > time.monotonic():
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return embedding
+      del self._entries[key]
+    if self._redis is not None:
+      try:
+        value = await self._redis.get(key)
+      except Exception as e:
+        self._stats["errors"] += 1
+        logger.warning(
+            f"Shared embedding cache lookup failed ({type(e).__name__}: {e}).")
+        value = None
+      if value is not None:
+        embedding = array.array("f", value).tolist()
+        self._put_local(key, embedding)
+        self._stats["hits"] += 1
+        self._stats["shared_hits"] += 1
+        return embedding
+    self._stats["misses"] += 1
+    return None
+
+  def _put_local(self, key: str, embedding: list[float]) -> None:
+    self._entries[key] = (time.monotonic() + self.ttl_seconds, embedding)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+  async def put(self, model: str, prompt: str, embedding: list[float]) -> None:
+    """Caches the embedding of the prompt."""
+    if not self.enabled:
+      return
+    key = self._key(model, prompt)
+    self._put_local(key, embedding)
+    if self._redis is not None:
+      try:
+        await self._redis.set(key,
+                              array.array("f", embedding).tobytes(),
+                              ex=max(1, int(self.ttl_seconds)))
+      except Exception as e:
+        self._stats["errors"] += 1
+        logger.warning(
+            f"Shared embedding cache write failed ({type(e).__name__}: {e}).")
+
+  def get_stats(self) -> dict:
+    """Returns the cache counters and the number of local entries."""
+    lookups = self._stats["hits"] + self._stats["misses"]
+    return {
+        **self._stats,
+        "hit_rate":
+            round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries":
+            len(self._entries),
+        "max_entries":
+            self.max_entries,
+        "shared_store":
+            self._redis is not None,
+    }
+
+  async def close(self) -> None:
+    if self._redis is not None:
+      await self._redis.aclose()
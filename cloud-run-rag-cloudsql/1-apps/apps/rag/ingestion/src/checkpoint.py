@@ -0,0 +1,132 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+def _last_complete_id(batch: list[dict]) -> int | None:
+  """
+    Returns the highest item ID of the batch whose text is fully contained
+    in this or earlier batches, or None if the batch only holds leading
+    chunks of an item.
+    """
+  ids = [
+      int(item["id"] if item.get("parent_id") is None else item["parent_id"])
+      for item in batch
+      if item.get("chunk_index", 0) + 1 >= item.get("chunk_count", 1)
+  ]
+  return max(ids, default=None)
+
+
+class Checkpointer:
+  """
+    Tracks the highest ID below which every batch has been written.
+
+    Batches must be read in ascending ID order (of parent IDs for chunked
+    items, whose chunks are read consecutively). An item split into chunks
+    only counts once the batch holding its last chunk is done. They may be embedded and
+    written out of order (pipelined mode): the checkpoint only moves past a
+    batch once it and all the batches read before it are done. A batch is
+    done when it was written or when its embedding failed, exactly as a run
+    without interruption would have left it.
+
+    The checkpoint is persisted with `save_fn` at most every
+    `interval_seconds`, and once more by flush().
+    """
+
+  def __init__(self, save_fn: Callable[[int], None], interval_seconds: float):
+    self.save_fn = save_fn
+    self.interval_seconds = interval_seconds
+    self._lock = threading.Lock()
+    self._next_seq = 0
+    self._last_id_by_seq: dict[int, int | None] = {}
+    self._done: set[int] = set()
+    self._seq_by_batch: dict[int, int] = {}
+    self._watermark_seq = -1
+    self._checkpoint: int | None = None
+    self._saved_checkpoint: int | None = None
+    self._last_save = time.monotonic()
+
+  def track(self, batches: Iterable[list[dict]]) -> Iterator[list[dict]]:
+    """Registers every batch in read order before passing it on."""
+    for batch in batches:
+      with self._lock:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._last_id_by_seq[seq] = _last_complete_id(batch)
+        self._seq_by_batch[id(batch)] = seq
+      yield batch
+
+  def wrap_embed(
+      self, embed_fn: Callable[[list[dict]], list[dict] | None]
+  ) -> Callable[[list[dict]], list[dict] | None]:
+    """Wraps the embedding step so that the embedded batch stays tracked."""
+
+    def _embed(batch: list[dict]) -> list[dict] | None:
+      embedded_batch = embed_fn(batch)
+      with self._lock:
+        seq = self._seq_by_batch.pop(id(batch))
+        if embedded_batch is not None:
+          self._seq_by_batch[id(embedded_batch)] = seq
+      if embedded_batch is None:
+        self._complete(seq)
+      return embedded_batch
+
+    return _embed
+
+  def wrap_write(
+      self, write_fn: Callable[[list[dict]],
+                               int]) -> Callable[[list[dict]], int]:
+    """Wraps the write step so that written batches advance the checkpoint."""
+
+    def _write(batch: list[dict]) -> int:
+      written = write_fn(batch)
+      with self._lock:
+        seq = self._seq_by_batch.pop(id(batch))
+      self._complete(seq)
+      return written
+
+    return _write
+
+  def _complete(self, seq: int) -> None:
+    with self._lock:
+      self._done.add(seq)
+      while self._watermark_seq + 1 in self._done:
+        self._watermark_seq += 1
+        self._done.remove(self._watermark_seq)
+        last_id = self._last_id_by_seq.pop(self._watermark_seq)
+        if last_id is not None:
+          self._checkpoint = last_id
+      if time.monotonic() - self._last_save >= self.interval_seconds:
+        self._save()
+
+  def _save(self) -> None:
+    """Persists the checkpoint if it moved. Must be called with the lock held."""
+    self._last_save = time.monotonic()
+    if self._checkpoint is None or self._checkpoint == self._saved_checkpoint:
+      return
+    self.save_fn(self._checkpoint)
+    self._saved_checkpoint = self._checkpoint
+    logger.info(
+        f"Checkpoint saved: all rows up to ID {self._checkpoint} written.")
+
+  def flush(self) -> None:
+    """Persists the latest checkpoint."""
+    with self._lock:
+      self._save()
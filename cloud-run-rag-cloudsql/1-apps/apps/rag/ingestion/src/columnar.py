@@ -0,0 +1,143 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Any, Callable
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+_ARROW_TYPES = {
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+}
+
+
+def _formats_like_python(arrow_type: pa.DataType) -> bool:
+  """
+    Whether casting values of this type to strings gives what str() gives
+    for the Python values the BigQuery client returns.
+    """
+  return (pa.types.is_string(arrow_type) or
+          pa.types.is_large_string(arrow_type) or
+          pa.types.is_integer(arrow_type) or pa.types.is_date32(arrow_type))
+
+
+def format_column_for_embedding(column: pa.Array,
+                                format_value: Callable[[Any], str]) -> pa.Array:
+  """
+    Formats a whole column like `format_value` (format_bq_value_for_embedding()
+    in main.py) formats single values: NULL becomes "None", arrays are joined
+    with ",", booleans are rendered as "True"/"False" and values are stripped.
+
+    Strings, integers, dates, booleans and arrays of the former are formatted
+    with Arrow compute kernels. Other types (floats, timestamps, numerics...)
+    render differently in Arrow, e.g. 1e-05 as "0.00001", so their values
+    are formatted one by one with `format_value`.
+    """
+  if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+    if not _formats_like_python(column.type.value_type):
+      return pa.array([format_value(value) for value in column.to_pylist()],
+                      pa.string())
+    child_values = pc.fill_null(
+        pc.utf8_trim_whitespace(pc.cast(column.values, pa.string())), "None")
+    items = pa.ListArray.from_arrays(column.offsets, child_values,
+                                     mask=column.is_null())
+    formatted = pc.binary_join(items, ",")
+  elif pa.types.is_boolean(column.type):
+    formatted = pc.if_else(column, "True", "False")
+  elif _formats_like_python(column.type):
+    formatted = pc.utf8_trim_whitespace(pc.cast(column, pa.string()))
+  else:
+    return pa.array([format_value(value) for value in column.to_pylist()],
+                    pa.string())
+  return pc.fill_null(formatted, "None")
+
+
+def cast_column(column: pa.Array, column_name: str, cast_type: type) -> list:
+  """
+    Casts a metadata column to the Python type configured for it. Values that
+    cannot be cast become None, like safe_cast() in the row-by-row path.
+    """
+  arrow_type = _ARROW_TYPES.get(cast_type, pa.string())
+  try:
+    return pc.cast(column, arrow_type).to_pylist()
+  except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+    # Fall back to per-value casting only for the columns that need it.
+    logger.warning(
+        f"Column '{column_name}' cannot be cast to {cast_type.__name__} as a whole, casting values one by one."
+    )
+    values = []
+    for value in column.to_pylist():
+      try:
+        values.append(cast_type(value) if value is not None else None)
+      except (ValueError, TypeError):
+        values.append(None)
+    return values
+
+
+def build_items_from_record_batch(
+    record_batch: pa.RecordBatch, id_column: str, columns_to_embed: list[str],
+    target_column_types: dict[str,
+                              type], format_value: Callable[[Any],
+                                                            str]) -> list[dict]:
+  """
+    Builds the ingestion items of a whole Arrow record batch at once.
+
+    The 'content_to_embed' strings are assembled with Arrow compute kernels
+    and each metadata column is cast in a single call; only the final item
+    dictionaries are created per row. Column values are rendered exactly
+    as `format_value` renders them. Rows without an ID are skipped.
+    """
+  ids = record_batch.column(id_column)
+  valid_rows = pc.is_valid(ids)
+  if not pc.all(valid_rows).as_py():
+    skipped_count = record_batch.num_rows - pc.sum(valid_rows).as_py()
+    logger.warning(
+        f"Skipping {skipped_count} BQ rows without generated ID '{id_column}'.")
+    record_batch = record_batch.filter(valid_rows)
+  if record_batch.num_rows == 0:
+    return []
+
+  content_parts = [
+      pc.binary_join_element_wise(
+          f"{col_name}: ",
+          format_column_for_embedding(record_batch.column(col_name),
+                                      format_value), "")
+      for col_name in columns_to_embed
+  ]
+  texts = pc.binary_join_element_wise(*content_parts, "; ").to_pylist()
+  ids_str = pc.cast(record_batch.column(id_column), pa.string()).to_pylist()
+
+  metadata_columns = {
+      col_name:
+          cast_column(record_batch.column(col_name), col_name,
+                      target_column_types.get(col_name, str))
+      for col_name in target_column_types
+      if col_name in record_batch.schema.names
+  }
+  metadata_rows = [
+      dict(zip(metadata_columns, values))
+      for values in zip(*metadata_columns.values())
+  ] if metadata_columns else [{} for _ in ids_str]
+
+  return [{
+      "id": item_id,
+      "text_to_embed": text,
+      "metadata": metadata,
+      "embedding": None
+  } for item_id, text, metadata in zip(ids_str, texts, metadata_rows)]
@@ -12,13 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import json
 import logging
+import math
+import struct
+import threading
+import time
+
 import sqlalchemy
 
 from src import config
 
 logger = logging.getLogger(__name__)
 
+# Fixed parts of the Postgres binary COPY format.
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_COPY_NULL = struct.pack(">i", -1)
+
+# ANN index types managed by the indexer. pgvector caps IVFFlat at 32768 lists.
+VECTOR_INDEX_TYPES = ("hnsw", "ivfflat")
+VECTOR_QUANTIZATIONS = ("none", "halfvec", "bit")
+_IVFFLAT_MAX_LISTS = 32768
+
 _db_pool: sqlalchemy.engine.Engine | None = None
 
 
@@ -48,7 +65,8 @@ def init_db_connection_pool():
       f"Attempting to connect to database: {config.DB_NAME} on {config.DB_HOST}:{db_port_val} with user {config.DB_SA}"
   )
   try:
-    _db_pool = sqlalchemy.create_engine(db_url, pool_size=5, max_overflow=2,
+    _db_pool = sqlalchemy.create_engine(db_url, pool_size=config.DB_POOL_SIZE,
+                                        max_overflow=config.DB_MAX_OVERFLOW,
                                         pool_timeout=30, pool_recycle=1800)
     with _db_pool.connect() as connection:
       logger.info(
@@ -93,13 +111,32 @@ def create_table_if_not_exists():
         rating REAL,
         year INTEGER,
         content_to_embed TEXT,
+        content_hash TEXT,
+        parent_id BIGINT,
+        chunk_index INTEGER,
+        chunk_count INTEGER,
         embedding vector({config.EMBEDDING_DIMENSIONS})
     );
+    ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS content_hash TEXT;
+    ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS parent_id BIGINT;
+    ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS chunk_index INTEGER;
+    ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS chunk_count INTEGER;
+    CREATE INDEX IF NOT EXISTS "{table_name}_parent_id_idx" ON "{table_name}" (parent_id);
     GRANT SELECT ON TABLE "{table_name}" TO PUBLIC;
+    CREATE TABLE IF NOT EXISTS "{corpus_version_table_name()}" (
+        id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+        version BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    GRANT SELECT ON TABLE "{corpus_version_table_name()}" TO PUBLIC;
     """
   try:
     with engine.connect() as connection:
       with connection.begin():  # Use transaction
+        # Serialize schema changes between the tasks of a sharded job.
+        connection.execute(
+            sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext(:name));"),
+            {"name": table_name})
         connection.execute(
             sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS vector;"))
         connection.execute(sqlalchemy.text(create_table_sql))
@@ -111,46 +148,76 @@ def create_table_if_not_exists():
     raise
 
 
-def upsert_batch_to_db(batch_data: list[dict]) -> int:
+def corpus_version_table_name() -> str:
+  """Returns the name of the table holding the version of the table content."""
+  return f"{config.DB_TABLE}_corpus_version"
+
+
+def bump_corpus_version():
   """
-    Upserts a batch of data (including embeddings and specific columns) into Cloud SQL.
-    The `batch_data` items should have an 'id', 'text_to_embed', 'embedding',
-    and a 'metadata' dictionary containing keys like 'rank', 'title', etc.
+    Increments the version of the table content, which the frontends check
+    to invalidate the answers they cached before it changed.
     """
   engine = get_db_pool()
-  if not batch_data:
-    return 0
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text(f"""
+            INSERT INTO "{corpus_version_table_name()}" AS v (id, version)
+            VALUES (true, 1)
+            ON CONFLICT (id) DO UPDATE
+            SET version = v.version + 1, updated_at = now();
+            """))
 
-  db_columns = [
-      config.GENERATED_ID_COLUMN_NAME, 'rank', 'title', 'description', 'genre',
-      'rating', 'year', 'content_to_embed', 'embedding'
-  ]
-  cols_str = ", ".join([f'"{col}"' for col in db_columns])
-  placeholders = ", ".join([f":{col}" for col in db_columns])
-  update_cols = [
-      col for col in db_columns if col != config.GENERATED_ID_COLUMN_NAME
-  ]
-  update_statements = [f'"{col}" = EXCLUDED."{col}"' for col in update_cols]
-  update_str = ", ".join(update_statements)
 
-  upsert_sql_stmt = sqlalchemy.text(f"""
-    INSERT INTO "{config.DB_TABLE}" ({cols_str})
-    VALUES ({placeholders})
-    ON CONFLICT ("{config.GENERATED_ID_COLUMN_NAME}") DO UPDATE
-    SET {update_str};
-    """)
+# Postgres type of every column written by the indexer, used to build the
+# binary COPY payload. Must match create_table_if_not_exists().
+_COLUMN_PG_TYPES = {
+    'rank': 'integer',
+    'title': 'text',
+    'description': 'text',
+    'genre': 'text',
+    'rating': 'real',
+    'year': 'integer',
+    'content_to_embed': 'text',
+    'content_hash': 'text',
+    'parent_id': 'bigint',
+    'chunk_index': 'integer',
+    'chunk_count': 'integer',
+    'embedding': 'vector',
+}
+
+_write_stats = {"rows": 0, "seconds": 0.0}
+_write_stats_lock = threading.Lock()
+
+
+def get_db_columns() -> list[str]:
+  """Returns the columns written by the indexer, ID first."""
+  return [config.GENERATED_ID_COLUMN_NAME, *_COLUMN_PG_TYPES]
 
+
+def _prepare_rows(batch_data: list[dict],
+                  embedding_as_text: bool = True) -> list[dict]:
+  """Maps ingestion items to dictionaries keyed by DB column."""
+  db_columns = get_db_columns()
   prepared_batch = []
   for item in batch_data:
     try:
       row_dict = {col: None for col in db_columns}  # Initialize all DB keys
+      embedding = item.get('embedding')
+      if embedding and embedding_as_text:
+        embedding = str(embedding)
+      item_id = int(item['id'])
+      # Unchunked items are their own single chunk.
+      parent_id = item.get('parent_id')
       row_dict.update({
-          config.GENERATED_ID_COLUMN_NAME:
-              int(item['id']),
-          'content_to_embed':
-              item['text_to_embed'],
-          'embedding':
-              str(item['embedding']) if item.get('embedding') else None,
+          config.GENERATED_ID_COLUMN_NAME: item_id,
+          'content_to_embed': item['text_to_embed'],
+          'content_hash': item.get('content_hash'),
+          'parent_id': item_id if parent_id is None else int(parent_id),
+          'chunk_index': item.get('chunk_index') or 0,
+          'chunk_count': item.get('chunk_count') or 1,
+          'embedding': embedding if embedding else None,
       })
 
       if 'metadata' in item and isinstance(item['metadata'], dict):
@@ -168,15 +235,63 @@ def upsert_batch_to_db(batch_data: list[dict]) -> int:
           f"Error preparing row data for DB upsert (ID: {item.get('id', 'N/A')}). Skipping row. Error: {e}. Data text_to_embed[:50]='{str(item.get('text_to_embed'))[:50]}'"
       )
       continue
+  return prepared_batch
+
+
+def _record_write(rows: int, seconds: float) -> None:
+  with _write_stats_lock:
+    _write_stats["rows"] += rows
+    _write_stats["seconds"] += seconds
+
+
+def get_write_stats() -> dict:
+  """Returns the rows written and the time spent writing them."""
+  with _write_stats_lock:
+    return dict(_write_stats)
+
+
+def _upsert_set_clause(db_columns: list[str]) -> str:
+  update_cols = [
+      col for col in db_columns if col != config.GENERATED_ID_COLUMN_NAME
+  ]
+  update_statements = [f'"{col}" = EXCLUDED."{col}"' for col in update_cols]
+  return ", ".join(update_statements)
+
+
+def upsert_batch_to_db(batch_data: list[dict],
+                       raise_on_error: bool = False) -> int:
+  """
+    Upserts a batch of data (including embeddings and specific columns) into Cloud SQL.
+    The `batch_data` items should have an 'id', 'text_to_embed', 'embedding',
+    and a 'metadata' dictionary containing keys like 'rank', 'title', etc.
+    Errors are logged and 0 is returned, unless `raise_on_error` is set.
+    """
+  engine = get_db_pool()
+  if not batch_data:
+    return 0
 
+  db_columns = get_db_columns()
+  cols_str = ", ".join([f'"{col}"' for col in db_columns])
+  placeholders = ", ".join([f":{col}" for col in db_columns])
+
+  upsert_sql_stmt = sqlalchemy.text(f"""
+    INSERT INTO "{config.DB_TABLE}" ({cols_str})
+    VALUES ({placeholders})
+    ON CONFLICT ("{config.GENERATED_ID_COLUMN_NAME}") DO UPDATE
+    SET {_upsert_set_clause(db_columns)};
+    """)
+
+  prepared_batch = _prepare_rows(batch_data)
   if not prepared_batch:
     logger.warning("No valid rows prepared for DB upsert in this batch.")
     return 0
 
   try:
+    started = time.monotonic()
     with engine.connect() as connection:
       with connection.begin():
         connection.execute(upsert_sql_stmt, prepared_batch)
+    _record_write(len(prepared_batch), time.monotonic() - started)
     logger.info(
         f"Successfully attempted upsert for {len(prepared_batch)} records into {config.DB_TABLE}."
     )
@@ -187,4 +302,499 @@ def upsert_batch_to_db(batch_data: list[dict]) -> int:
       logger.error(
           f"Problematic batch (first generated ID): {prepared_batch[0].get(config.GENERATED_ID_COLUMN_NAME)}"
       )
+    if raise_on_error:
+      raise
+    return 0
+
+
+def _encode_binary_field(value, pg_type: str) -> bytes:
+  """Encodes one field in the Postgres binary COPY format (length + data)."""
+  if value is None:
+    return _COPY_NULL
+  if pg_type == 'bigint':
+    data = struct.pack(">q", value)
+  elif pg_type == 'integer':
+    data = struct.pack(">i", value)
+  elif pg_type == 'real':
+    data = struct.pack(">f", value)
+  elif pg_type == 'vector':
+    # pgvector binary format: dimensions (int16), unused (int16), float4[].
+    data = struct.pack(f">hh{len(value)}f", len(value), 0, *value)
+  else:
+    data = str(value).encode("utf-8")
+  return struct.pack(">i", len(data)) + data
+
+
+def encode_copy_binary(rows: list[dict], db_columns: list[str]) -> bytes:
+  """Encodes rows as a complete Postgres binary COPY payload."""
+  pg_types = [_COLUMN_PG_TYPES.get(col, 'bigint') for col in db_columns
+             ]  # The ID column is the only one not listed and is a BIGINT.
+  field_count = struct.pack(">h", len(db_columns))
+  chunks = [_COPY_HEADER]
+  for row in rows:
+    chunks.append(field_count)
+    for col, pg_type in zip(db_columns, pg_types):
+      chunks.append(_encode_binary_field(row[col], pg_type))
+  chunks.append(_COPY_TRAILER)
+  return b"".join(chunks)
+
+
+def copy_upsert_batch_to_db(batch_data: list[dict],
+                            raise_on_error: bool = False) -> int:
+  """
+    Bulk-loads a batch with COPY into a session-private staging table, then
+    merges it into the target table with a single INSERT ... SELECT ...
+    ON CONFLICT statement. Embeddings are sent in pgvector's binary format,
+    so Postgres does not have to parse them from text.
+    Errors are logged and 0 is returned, unless `raise_on_error` is set.
+    """
+  engine = get_db_pool()
+  if not batch_data:
+    return 0
+
+  prepared_batch = _prepare_rows(batch_data, embedding_as_text=False)
+  if not prepared_batch:
+    logger.warning("No valid rows prepared for DB upsert in this batch.")
+    return 0
+
+  db_columns = get_db_columns()
+  cols_str = ", ".join([f'"{col}"' for col in db_columns])
+  id_col = config.GENERATED_ID_COLUMN_NAME
+  staging_table = f"{config.DB_TABLE}_staging"
+
+  try:
+    started = time.monotonic()
+    payload = encode_copy_binary(prepared_batch, db_columns)
+    raw_connection = engine.raw_connection()
+    try:
+      cursor = raw_connection.cursor()
+      # TEMP tables are not WAL-logged and are private to the session, so
+      # concurrent writers never see each other's staged rows.
+      cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS "{staging_table}"
+        (LIKE "{config.DB_TABLE}" INCLUDING DEFAULTS)
+        ON COMMIT DELETE ROWS
+        """)
+      cursor.execute(
+          f'COPY "{staging_table}" ({cols_str}) FROM STDIN WITH (FORMAT binary)',
+          stream=io.BytesIO(payload))
+      cursor.execute(f"""
+        INSERT INTO "{config.DB_TABLE}" ({cols_str})
+        SELECT DISTINCT ON ("{id_col}") {cols_str}
+        FROM "{staging_table}"
+        ORDER BY "{id_col}"
+        ON CONFLICT ("{id_col}") DO UPDATE
+        SET {_upsert_set_clause(db_columns)}
+        """)
+      raw_connection.commit()
+    except Exception:
+      raw_connection.rollback()
+      raise
+    finally:
+      raw_connection.close()
+    elapsed = time.monotonic() - started
+    _record_write(len(prepared_batch), elapsed)
+    logger.info(
+        f"COPY-upserted {len(prepared_batch)} records into {config.DB_TABLE} in {elapsed * 1000:.0f} ms "
+        f"({len(prepared_batch) / elapsed if elapsed else 0:.0f} rows/s).")
+    return len(prepared_batch)
+  except Exception as e:
+    logger.error(f"Error during COPY bulk load to Cloud SQL: {e}")
+    logger.error(
+        f"Problematic batch (first generated ID): {prepared_batch[0].get(id_col)}"
+    )
+    if raise_on_error:
+      raise
+    return 0
+
+
+def write_batch_to_db(batch_data: list[dict],
+                      raise_on_error: bool = False) -> int:
+  """Writes a batch with the method selected by DB_WRITE_MODE."""
+  if config.DB_WRITE_MODE == "copy":
+    return copy_upsert_batch_to_db(batch_data, raise_on_error)
+  return upsert_batch_to_db(batch_data, raise_on_error)
+
+
+def parent_id_sql() -> str:
+  """Returns the SQL expression of a row's parent ID (rows from before chunking have none)."""
+  return f'COALESCE(parent_id, "{config.GENERATED_ID_COLUMN_NAME}")'
+
+
+def shard_filter_sql(shard_index: int, shard_count: int) -> str:
+  """Returns the WHERE clause matching the rows of one ingestion shard."""
+  if shard_count <= 1:
+    return ""
+  # Chunks belong to the shard of their parent.
+  return f'WHERE abs({parent_id_sql()} % {int(shard_count)}) = {int(shard_index)}'
+
+
+def fetch_content_hashes(shard_index: int = 0,
+                         shard_count: int = 1) -> dict[int, str | None]:
+  """
+    Returns the content hash of every item of the shard already stored, keyed
+    by parent ID. The hash is None unless all the chunks of the item are
+    stored with the same hash, e.g. after a run that failed to write some of
+    them, so that such items are embedded again. As the hash covers the
+    chunking settings, changing them re-chunks every item.
+    """
+  engine = get_db_pool()
+  query = sqlalchemy.text(f"""
+    SELECT {parent_id_sql()},
+        CASE WHEN count(DISTINCT content_hash) = 1
+            AND count(content_hash) = count(*)
+            AND min(chunk_count) = max(chunk_count)
+            AND count(*) = min(chunk_count)
+        THEN min(content_hash) END
+    FROM "{config.DB_TABLE}"
+    {shard_filter_sql(shard_index, shard_count)}
+    GROUP BY 1
+    """)
+  with engine.connect() as connection:
+    result = connection.execute(query)
+    return {row[0]: row[1] for row in result}
+
+
+def delete_rows_by_ids(ids: list[int], chunk_size: int = 10000) -> int:
+  """Deletes the items with the given parent IDs, with all their chunks. Returns the number of rows deleted."""
+  if not ids:
+    return 0
+  engine = get_db_pool()
+  delete_sql_stmt = sqlalchemy.text(f"""
+    DELETE FROM "{config.DB_TABLE}"
+    WHERE "{config.GENERATED_ID_COLUMN_NAME}" = ANY(:ids) OR parent_id = ANY(:ids)
+    """)
+  deleted_count = 0
+  with engine.connect() as connection:
+    with connection.begin():
+      for start in range(0, len(ids), chunk_size):
+        result = connection.execute(delete_sql_stmt,
+                                    {"ids": ids[start:start + chunk_size]})
+        deleted_count += result.rowcount
+  logger.info(f"Deleted {deleted_count} rows from {config.DB_TABLE}.")
+  return deleted_count
+
+
+def vector_index_name(index_type: str, quantization: str = "none") -> str:
+  """Returns the name of the ANN index of the given type on the table."""
+  if quantization == "none":
+    return f"{config.DB_TABLE}_embedding_{index_type}_idx"
+  return f"{config.DB_TABLE}_embedding_{quantization}_{index_type}_idx"
+
+
+def vector_index_expression(quantization: str) -> tuple[str, str]:
+  """
+    Returns the indexed expression and its operator class. Quantized indexes
+    are expression indexes: the table keeps the full vectors, and the frontend
+    orders by the same expression to use them.
+    """
+  dimensions = int(config.EMBEDDING_DIMENSIONS)
+  if quantization == "halfvec":
+    return f"(embedding::halfvec({dimensions}))", "halfvec_cosine_ops"
+  if quantization == "bit":
+    return f"(binary_quantize(embedding)::bit({dimensions}))", "bit_hamming_ops"
+  return "embedding", "vector_cosine_ops"
+
+
+def ivfflat_lists_for(row_count: int) -> int:
+  """
+    Sizes IVFFlat lists as recommended by pgvector: rows / 1000 up to 1M rows,
+    sqrt(rows) above.
+    """
+  if row_count <= 1_000_000:
+    lists = row_count // 1000
+  else:
+    lists = int(math.sqrt(row_count))
+  return min(max(lists, 1), _IVFFLAT_MAX_LISTS)
+
+
+def drop_vector_indexes():
+  """Drops the ANN indexes managed by the indexer, so a bulk load does not maintain them."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    with connection.begin():
+      for index_type in VECTOR_INDEX_TYPES:
+        for quantization in VECTOR_QUANTIZATIONS:
+          index_name = vector_index_name(index_type, quantization)
+          connection.execute(
+              sqlalchemy.text(f'DROP INDEX IF EXISTS "{index_name}";'))
+  logger.info(
+      f"Dropped vector indexes on '{config.DB_TABLE}' before bulk load.")
+
+
+def create_vector_index() -> float | None:
+  """
+    Creates the configured ANN index on the embedding column, or on its
+    quantized expression, unless it already exists. The operator class
+    matches the distance operator used by the frontend: cosine (<=>), or
+    Hamming (<~>) for binary quantization.
+
+    Returns:
+        The build time in seconds, or None if no index was built.
+    """
+  index_type = config.VECTOR_INDEX_TYPE
+  if index_type == "none":
+    logger.info("VECTOR_INDEX_TYPE is 'none', not creating a vector index.")
+    return None
+  engine = get_db_pool()
+  quantization = config.VECTOR_QUANTIZATION
+  index_name = vector_index_name(index_type, quantization)
+  expression, operator_class = vector_index_expression(quantization)
+  with engine.connect() as connection:
+    with connection.begin():
+      # Serializes concurrent builds of the same index.
+      connection.execute(
+          sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext(:name));"),
+          {"name": index_name})
+      exists = connection.execute(
+          sqlalchemy.text("SELECT to_regclass(:name) IS NOT NULL;"), {
+              "name": f'"{index_name}"'
+          }).scalar()
+      if exists:
+        logger.info(f"Vector index '{index_name}' already exists.")
+        return None
+
+      if index_type == "hnsw":
+        options = (f"m = {int(config.HNSW_M)}, "
+                   f"ef_construction = {int(config.HNSW_EF_CONSTRUCTION)}")
+      else:
+        lists = config.IVFFLAT_LISTS
+        if lists <= 0:
+          row_count = connection.execute(
+              sqlalchemy.text(
+                  f'SELECT count(*) FROM "{config.DB_TABLE}";')).scalar()
+          lists = ivfflat_lists_for(row_count)
+        options = f"lists = {int(lists)}"
+
+      if config.INDEX_MAINTENANCE_WORK_MEM:
+        connection.execute(
+            sqlalchemy.text(
+                "SELECT set_config('maintenance_work_mem', :mem, true);"),
+            {"mem": config.INDEX_MAINTENANCE_WORK_MEM})
+      logger.info(f"Building {index_type} index '{index_name}' ({options})...")
+      started = time.monotonic()
+      connection.execute(
+          sqlalchemy.text(f"""
+            CREATE INDEX "{index_name}" ON "{config.DB_TABLE}"
+            USING {index_type} ({expression} {operator_class})
+            WITH ({options});
+            """))
+  elapsed = time.monotonic() - started
+  logger.info(f"Built vector index '{index_name}' in {elapsed:.1f}s.")
+  return elapsed
+
+
+def progress_table_name() -> str:
+  """Returns the name of the table holding the ingestion checkpoints."""
+  return f"{config.DB_TABLE}_ingestion_progress"
+
+
+def create_progress_table_if_not_exists():
+  """Creates the table holding the last checkpoint of every run and shard."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text(f"""
+            CREATE TABLE IF NOT EXISTS "{progress_table_name()}" (
+                run_id TEXT NOT NULL,
+                shard_index INTEGER NOT NULL,
+                last_id BIGINT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (run_id, shard_index)
+            );
+            """))
+
+
+def load_checkpoint(run_id: str, shard_index: int) -> int | None:
+  """Returns the last ID checkpointed for the run and shard, if any."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    return connection.execute(
+        sqlalchemy.text(f"""
+          SELECT last_id FROM "{progress_table_name()}"
+          WHERE run_id = :run_id AND shard_index = :shard_index
+          """), {
+            "run_id": run_id,
+            "shard_index": shard_index
+        }).scalar()
+
+
+def save_checkpoint(run_id: str, shard_index: int, last_id: int):
+  """Records that every row of the shard up to `last_id` has been written."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text(f"""
+            INSERT INTO "{progress_table_name()}" (run_id, shard_index, last_id)
+            VALUES (:run_id, :shard_index, :last_id)
+            ON CONFLICT (run_id, shard_index) DO UPDATE
+            SET last_id = EXCLUDED.last_id, updated_at = now();
+            """), {
+              "run_id": run_id,
+              "shard_index": shard_index,
+              "last_id": last_id
+          })
+
+
+def finished_shards_table_name() -> str:
+  """Returns the name of the table recording the shards that finished loading."""
+  return f"{config.DB_TABLE}_finished_shards"
+
+
+def create_finished_shards_table_if_not_exists():
+  """Creates the table recording, per run, the shards that finished loading."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text(f"""
+            CREATE TABLE IF NOT EXISTS "{finished_shards_table_name()}" (
+                run_id TEXT NOT NULL,
+                shard_index INTEGER NOT NULL,
+                finished_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (run_id, shard_index)
+            );
+            """))
+
+
+def mark_shard_finished(run_id: str, shard_index: int) -> int:
+  """
+    Records that the shard finished loading its rows.
+
+    Returns:
+        The number of shards of the run finished so far, this one included.
+        Tasks are serialized, so exactly one task of the run sees them all.
+    """
+  engine = get_db_pool()
+  table_name = finished_shards_table_name()
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext(:name));"),
+          {"name": f"{table_name}/{run_id}"})
+      connection.execute(
+          sqlalchemy.text(f"""
+            INSERT INTO "{table_name}" (run_id, shard_index)
+            VALUES (:run_id, :shard_index)
+            ON CONFLICT (run_id, shard_index) DO NOTHING;
+            """), {
+              "run_id": run_id,
+              "shard_index": shard_index
+          })
+      return connection.execute(
+          sqlalchemy.text(
+              f'SELECT count(*) FROM "{table_name}" WHERE run_id = :run_id;'), {
+                  "run_id": run_id
+              }).scalar()
+
+
+def get_embedding_column_dimensions() -> int | None:
+  """Returns the declared size of the existing embedding column, if any."""
+  engine = get_db_pool()
+  with engine.connect() as connection:
+    # pgvector stores the dimensions of vector(n) as the type modifier.
+    dimensions = connection.execute(
+        sqlalchemy.text("""
+          SELECT atttypmod FROM pg_attribute
+          WHERE attrelid = to_regclass(:table) AND attname = 'embedding'
+            AND NOT attisdropped
+          """), {
+            "table": f'"{config.DB_TABLE}"'
+        }).scalar()
+  return dimensions if dimensions and dimensions > 0 else None
+
+
+def create_embedding_cache_table_if_not_exists():
+  """Creates the table caching embeddings across runs."""
+  engine = get_db_pool()
+  table_name = config.EMBEDDING_CACHE_TABLE
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(
+          sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext(:name));"),
+          {"name": table_name})
+      connection.execute(
+          sqlalchemy.text(f"""
+            CREATE TABLE IF NOT EXISTS "{table_name}" (
+                model_name TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding vector NOT NULL,
+                PRIMARY KEY (model_name, dimensions, text_hash)
+            );
+            """))
+  logger.info(f"Ensured embedding cache table '{table_name}' exists.")
+
+
+def get_cached_embeddings(model_name: str, dimensions: int,
+                          hashes: list[str]) -> dict[str, list[float]]:
+  """Returns the cached embeddings of the given text hashes, keyed by hash."""
+  engine = get_db_pool()
+  query = sqlalchemy.text(f"""
+    SELECT text_hash, embedding::text FROM "{config.EMBEDDING_CACHE_TABLE}"
+    WHERE model_name = :model_name AND dimensions = :dimensions
+      AND text_hash = ANY(:hashes)
+    """)
+  with engine.connect() as connection:
+    result = connection.execute(query, {
+        "model_name": model_name,
+        "dimensions": dimensions,
+        "hashes": hashes
+    })
+    return {row[0]: json.loads(row[1]) for row in result}
+
+
+def put_cached_embeddings(model_name: str, dimensions: int,
+                          entries: dict[str, list[float]]):
+  """Stores embeddings in the cache table, keyed by text hash."""
+  engine = get_db_pool()
+  insert_sql_stmt = sqlalchemy.text(f"""
+    INSERT INTO "{config.EMBEDDING_CACHE_TABLE}"
+        (model_name, dimensions, text_hash, embedding)
+    VALUES (:model_name, :dimensions, :text_hash, :embedding)
+    ON CONFLICT (model_name, dimensions, text_hash) DO NOTHING;
+    """)
+  rows = [{
+      "model_name": model_name,
+      "dimensions": dimensions,
+      "text_hash": key,
+      "embedding": str(embedding)
+  } for key, embedding in entries.items()]
+  with engine.connect() as connection:
+    with connection.begin():
+      connection.execute(insert_sql_stmt, rows)
+
+
+def delete_orphan_chunks(batch_data: list[dict]) -> int:
+  """
+    Deletes the chunks left over from a previous, longer version of the
+    items of the batch, i.e. those whose index is beyond the new chunk count.
+    Unchunked items count as their own single chunk, so that turning
+    chunking off removes the chunks of the previous runs. Returns the number
+    of rows deleted.
+    """
+  chunk_counts = {}
+  for item in batch_data:
+    if item.get('parent_id') is None:
+      chunk_counts[int(item['id'])] = 1
+    else:
+      chunk_counts[int(item['parent_id'])] = int(item.get('chunk_count') or 1)
+  if not chunk_counts:
     return 0
+  engine = get_db_pool()
+  delete_sql_stmt = sqlalchemy.text(f"""
+    DELETE FROM "{config.DB_TABLE}" AS t
+    USING unnest(CAST(:parent_ids AS BIGINT[]), CAST(:chunk_counts AS INTEGER[]))
+        AS p(parent_id, chunk_count)
+    WHERE t.parent_id = p.parent_id AND t.chunk_index >= p.chunk_count
+    """)
+  with engine.connect() as connection:
+    with connection.begin():
+      result = connection.execute(
+          delete_sql_stmt, {
+              "parent_ids": list(chunk_counts),
+              "chunk_counts": list(chunk_counts.values())
+          })
+  return result.rowcount
@@ -0,0 +1,147 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# Item keys kept in dead-letter records, enough to re-ingest the item.
+_ITEM_KEYS = ("id", "parent_id", "chunk_index", "chunk_count", "text_to_embed",
+              "content_hash", "metadata")
+
+
+def _split_gcs_uri(uri: str) -> tuple[str, str]:
+  bucket, _, name = uri[len("gs://"):].partition("/")
+  return bucket, name
+
+
+class DeadLetterSink:
+  """
+    Appends the items that could not be embedded or written to a JSONL file,
+    one record per item with the stage and the error class.
+
+    `location` is a local directory or a gs:// prefix. Records are written
+    to a local file named after the run, task and attempt. For gs://
+    locations the file is uploaded under the prefix by the first write, then
+    at most every `upload_interval_seconds` and by close(), so that a crashed
+    task keeps the records written before its last upload. Safe to share
+    between threads.
+    """
+
+  def __init__(self, location: str, run_id: str, task_index: int,
+               task_attempt: int, upload_interval_seconds: float = 30.0):
+    self.location = location.rstrip("/")
+    self.file_name = f"dead-letter-{run_id}-task{task_index}-attempt{task_attempt}.jsonl"
+    self.count = 0
+    self.upload_interval_seconds = upload_interval_seconds
+    self._lock = threading.Lock()
+    self._last_upload = None
+    if self.location.startswith("gs://"):
+      self.local_path = os.path.join(tempfile.mkdtemp(), self.file_name)
+    else:
+      os.makedirs(self.location, exist_ok=True)
+      self.local_path = os.path.join(self.location, self.file_name)
+    self._file = None
+
+  @property
+  def uri(self) -> str:
+    return f"{self.location}/{self.file_name}"
+
+  def write(self, items: list[dict], stage: str, error: BaseException) -> None:
+    """Records failed items with the stage ('embedding' or 'write') and error."""
+    lines = [
+        json.dumps(
+            {
+                **{
+                    key: item.get(key) for key in _ITEM_KEYS
+                },
+                "stage": stage,
+                "error_class": type(error).__name__,
+                "error": str(error),
+            }, default=str) + "\n" for item in items
+    ]
+    with self._lock:
+      if self._file is None:
+        self._file = open(self.local_path, "a", encoding="utf-8")
+      self._file.writelines(lines)
+      self._file.flush()
+      self.count += len(items)
+      if self.location.startswith("gs://") and (
+          self._last_upload is None or
+          time.monotonic() - self._last_upload >= self.upload_interval_seconds):
+        self._upload()
+
+  def _upload(self) -> None:
+    """Uploads the local file to the object under the gs:// prefix."""
+    from google.cloud import storage
+    bucket_name, name = _split_gcs_uri(self.uri)
+    try:
+      storage.Client().bucket(bucket_name).blob(name).upload_from_filename(
+          self.local_path)
+    except Exception as e:
+      logger.error(f"Failed to upload dead-letter file to {self.uri}: {e}")
+    self._last_upload = time.monotonic()
+
+  def close(self) -> None:
+    """Closes the file and uploads it for gs:// locations."""
+    with self._lock:
+      if self._file is None:
+        return
+      self._file.close()
+      self._file = None
+      if self.location.startswith("gs://"):
+        self._upload()
+    logger.warning(f"{self.count} failed items written to {self.uri}.")
+
+
+def _iter_lines(location: str) -> Iterator[str]:
+  """Yields the lines of a JSONL file, or of every .jsonl file under a directory or prefix."""
+  if location.startswith("gs://"):
+    from google.cloud import storage
+    bucket_name, name = _split_gcs_uri(location)
+    client = storage.Client()
+    for blob in client.list_blobs(bucket_name, prefix=name):
+      if blob.name == name or blob.name.endswith(".jsonl"):
+        logger.info(f"Replaying gs://{bucket_name}/{blob.name}")
+        yield from blob.download_as_text().splitlines()
+  elif os.path.isdir(location):
+    for file_name in sorted(os.listdir(location)):
+      if file_name.endswith(".jsonl"):
+        yield from _iter_lines(os.path.join(location, file_name))
+  else:
+    logger.info(f"Replaying {location}")
+    with open(location, encoding="utf-8") as f:
+      yield from f
+
+
+def read_items(location: str) -> Iterator[dict]:
+  """
+    Yields the ingestion items recorded by a DeadLetterSink. An item that
+    failed more than once is only yielded once.
+    """
+  seen_ids = set()
+  for line in _iter_lines(location):
+    if not line.strip():
+      continue
+    record = json.loads(line)
+    if record["id"] in seen_ids:
+      continue
+    seen_ids.add(record["id"])
+    yield {key: record.get(key) for key in _ITEM_KEYS} | {"embedding": None}
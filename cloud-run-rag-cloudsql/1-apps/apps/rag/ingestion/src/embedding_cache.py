@@ -0,0 +1,202 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text: str) -> str:
+  """Returns the hash identifying a text in the embedding stores."""
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore(Protocol):
+  """A persistent map from (model, dimensions, text hash) to an embedding."""
+
+  def get_many(self, model_name: str, dimensions: int,
+               hashes: list[str]) -> dict[str, list[float]]:
+    ...
+
+  def put_many(self, model_name: str, dimensions: int,
+               entries: dict[str, list[float]]) -> None:
+    ...
+
+
+class SQLiteEmbeddingStore:
+  """Embedding store in a local SQLite file, shared by the threads of a run."""
+
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._lock, self._connection:
+      self._connection.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model_name TEXT NOT NULL,
+            dimensions INTEGER NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            PRIMARY KEY (model_name, dimensions, text_hash)
+        )
+        """)
+    logger.info(f"Using local embedding cache '{path}'.")
+
+  def get_many(self, model_name: str, dimensions: int,
+               hashes: list[str]) -> dict[str, list[float]]:
+    found = {}
+    # Stay well below SQLite's limit on the number of bound parameters.
+    for start in range(0, len(hashes), 500):
+      chunk = hashes[start:start + 500]
+      placeholders = ", ".join("?" for _ in chunk)
+      with self._lock:
+        rows = self._connection.execute(
+            f"""
+            SELECT text_hash, embedding FROM embeddings
+            WHERE model_name = ? AND dimensions = ? AND text_hash IN ({placeholders})
+            """, [model_name, dimensions, *chunk]).fetchall()
+      for key, blob in rows:
+        found[key] = array.array("f", blob).tolist()
+    return found
+
+  def put_many(self, model_name: str, dimensions: int,
+               entries: dict[str, list[float]]) -> None:
+    rows = [(model_name, dimensions, key, array.array("f", embedding).tobytes())
+            for key, embedding in entries.items()]
+    with self._lock, self._connection:
+      self._connection.executemany(
+          "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+
+  def close(self) -> None:
+    with self._lock:
+      self._connection.close()
+
+
+class DatabaseEmbeddingStore:
+  """Embedding store in a table of the target database, shared across runs."""
+
+  def __init__(self, database):
+    self.database = database
+
+  def get_many(self, model_name: str, dimensions: int,
+               hashes: list[str]) -> dict[str, list[float]]:
+    return self.database.get_cached_embeddings(model_name, dimensions, hashes)
+
+  def put_many(self, model_name: str, dimensions: int,
+               entries: dict[str, list[float]]) -> None:
+    self.database.put_cached_embeddings(model_name, dimensions, entries)
+
+
+class CachingEmbedder:
+  """
+    Puts embedding stores in front of an EmbeddingClient.
+
+    Identical texts of a request are embedded once. Each distinct text is
+    then looked up in the stores in order (e.g. local first, then the
+    database); hits in a later store are copied into the earlier ones and
+    only the remaining texts are sent to the model. New embeddings are
+    written to every store. Store errors are logged and treated as misses,
+    a broken cache never fails the ingestion.
+    """
+
+  def __init__(self, client, stores: list[EmbeddingStore]):
+    self.client = client
+    self.stores = stores
+    self._lock = threading.Lock()
+    self._stats = {
+        "texts": 0,
+        "duplicates": 0,
+        "misses": 0,
+        "hits": [0] * len(stores),
+    }
+
+  def get_stats(self) -> dict:
+    """Returns a copy of the cache counters; 'hits' has one entry per store."""
+    with self._lock:
+      return {**self._stats, "hits": list(self._stats["hits"])}
+
+  def _get_many(self, store: EmbeddingStore, model_name: str, dimensions: int,
+                hashes: list[str]) -> dict[str, list[float]]:
+    try:
+      return store.get_many(model_name, dimensions, hashes)
+    except Exception as e:
+      logger.warning(
+          f"Embedding cache lookup failed ({type(e).__name__}: {e}).")
+      return {}
+
+  def _put_many(self, store: EmbeddingStore, model_name: str, dimensions: int,
+                entries: dict[str, list[float]]) -> None:
+    try:
+      store.put_many(model_name, dimensions, entries)
+    except Exception as e:
+      logger.warning(f"Embedding cache write failed ({type(e).__name__}: {e}).")
+
+  def embed(
+      self, texts: list[str], errors: dict[int, BaseException] | None = None
+  ) -> list[list[float] | None]:
+    """Same contract as EmbeddingClient.embed()."""
+    if not texts:
+      return []
+    model_name, dimensions = self.client.model_name, self.client.dimensions
+    keys = [text_hash(text) for text in texts]
+    texts_by_key = dict(zip(keys, texts))
+    found: dict[str, list[float] | None] = {}
+    hits = [0] * len(self.stores)
+
+    missing = list(texts_by_key)
+    for i, store in enumerate(self.stores):
+      if not missing:
+        break
+      store_hits = self._get_many(store, model_name, dimensions, missing)
+      if store_hits:
+        hits[i] = len(store_hits)
+        found.update(store_hits)
+        for earlier_store in self.stores[:i]:
+          self._put_many(earlier_store, model_name, dimensions, store_hits)
+        missing = [key for key in missing if key not in store_hits]
+
+    errors_by_key: dict[str, BaseException] = {}
+    if missing:
+      client_errors: dict[int, BaseException] = {}
+      new_embeddings = self.client.embed([texts_by_key[key] for key in missing],
+                                         client_errors)
+      errors_by_key = {
+          missing[index]: error for index, error in client_errors.items()
+      }
+      found.update(zip(missing, new_embeddings))
+      to_store = {
+          key: embedding
+          for key, embedding in zip(missing, new_embeddings)
+          if embedding is not None
+      }
+      if to_store:
+        for store in self.stores:
+          self._put_many(store, model_name, dimensions, to_store)
+
+    with self._lock:
+      self._stats["texts"] += len(texts)
+      self._stats["duplicates"] += len(texts) - len(texts_by_key)
+      self._stats["misses"] += len(missing)
+      for i, count in enumerate(hits):
+        self._stats["hits"][i] += count
+    if errors is not None:
+      errors.update((index, errors_by_key[key])
+                    for index, key in enumerate(keys)
+                    if key in errors_by_key)
+    return [found[key] for key in keys]
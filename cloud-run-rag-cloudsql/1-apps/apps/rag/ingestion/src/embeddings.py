@@ -0,0 +1,223 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+import random
+import threading
+import time
+from typing import Iterable, Iterator
+
+import google.api_core.exceptions as exceptions
+from vertexai.language_models import TextEmbeddingModel
+
+from src.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# 429 and 5xx responses are worth retrying as-is.
+RETRYABLE_ERRORS = (
+    exceptions.TooManyRequests,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    exceptions.DeadlineExceeded,
+)
+# Retryable errors that mean the quota is exhausted.
+QUOTA_ERRORS = (exceptions.TooManyRequests, exceptions.ResourceExhausted)
+
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+  """Cheap, conservative token estimate used to size embedding requests."""
+  return max(1, math.ceil(len(text) / chars_per_token))
+
+
+def pack_batches(items: Iterable[dict], max_items: int, max_tokens: int,
+                 chars_per_token: float,
+                 text_key: str = "text_to_embed") -> Iterator[list[dict]]:
+  """
+    Groups items into batches that stay under both the item count and the
+    estimated token count limits of a single embedding request. An item that
+    alone exceeds `max_tokens` is sent in a batch of its own.
+    """
+  batch: list[dict] = []
+  batch_tokens = 0
+  for item in items:
+    item_tokens = estimate_tokens(item[text_key], chars_per_token)
+    if batch and (len(batch) >= max_items or
+                  batch_tokens + item_tokens > max_tokens):
+      yield batch
+      batch = []
+      batch_tokens = 0
+    batch.append(item)
+    batch_tokens += item_tokens
+  if batch:
+    yield batch
+
+
+class EmbeddingClient:
+  """
+    Wraps a Vertex AI text embedding model loaded once per process.
+
+    Requests are retried with exponential backoff on quota and server errors;
+    once the retries are exhausted, every text of the request fails with the
+    last error. Requests that fail with a non-retryable error are split in
+    half and retried so that a single bad text only loses itself.
+    With a `rate_limiter`, every request is paced by it and quota errors
+    slow it down. With `output_dimensionality`, the model is asked for
+    embeddings of that reduced size. The client is safe to share between threads.
+    """
+
+  def __init__(self, model_name: str, dimensions: int, max_retries: int,
+               retry_base_delay: float, retry_max_delay: float,
+               chars_per_token: float, rate_limiter: RateLimiter | None = None,
+               output_dimensionality: int | None = None):
+    self.model_name = model_name
+    self.dimensions = dimensions
+    self.output_dimensionality = output_dimensionality
+    self.max_retries = max_retries
+    self.retry_base_delay = retry_base_delay
+    self.retry_max_delay = retry_max_delay
+    self.chars_per_token = chars_per_token
+    self.rate_limiter = rate_limiter
+    self._model: TextEmbeddingModel | None = None
+    self._lock = threading.Lock()
+    self._stats = {
+        "requests": 0,
+        "retries": 0,
+        "splits": 0,
+        "texts_embedded": 0,
+        "texts_failed": 0,
+        "latency_seconds": 0.0,
+    }
+
+  def _get_model(self) -> TextEmbeddingModel:
+    with self._lock:
+      if self._model is None:
+        logger.info(f"Loading embedding model '{self.model_name}'...")
+        self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+      return self._model
+
+  def _add_stats(self, **increments: float) -> None:
+    with self._lock:
+      for key, value in increments.items():
+        self._stats[key] += value
+
+  def get_stats(self) -> dict:
+    """Returns a copy of the cumulative request counters."""
+    with self._lock:
+      return dict(self._stats)
+
+  def _request(self, texts: list[str]) -> list[list[float]]:
+    """Sends a single embedding request and validates the response."""
+    approx_tokens = sum(
+        estimate_tokens(text, self.chars_per_token) for text in texts)
+    if self.rate_limiter:
+      self.rate_limiter.acquire(approx_tokens)
+    started = time.monotonic()
+    if self.output_dimensionality:
+      response = self._get_model().get_embeddings(
+          texts, output_dimensionality=self.output_dimensionality)
+    else:
+      response = self._get_model().get_embeddings(texts)
+    latency = time.monotonic() - started
+    self._add_stats(requests=1, latency_seconds=latency)
+
+    embeddings = [embedding.values for embedding in response]
+    if len(embeddings) != len(texts):
+      raise exceptions.InternalServerError(
+          f"Expected {len(texts)} embeddings, got {len(embeddings)}.")
+    if embeddings and len(embeddings[0]) != self.dimensions:
+      # A configuration error: retrying or splitting cannot fix it.
+      raise ValueError(
+          f"Embedding dimension mismatch! Model '{self.model_name}' returned {len(embeddings[0])} dims, expected {self.dimensions}."
+      )
+    logger.info(
+        f"Embedded {len(texts)} texts (~{approx_tokens} tokens) in {latency * 1000:.0f} ms."
+    )
+    return embeddings
+
+  def _request_with_retries(self, texts: list[str]) -> list[list[float]]:
+    """Retries retryable errors with exponential backoff and jitter."""
+    attempt = 0
+    while True:
+      try:
+        return self._request(texts)
+      except RETRYABLE_ERRORS as e:
+        if self.rate_limiter and isinstance(e, QUOTA_ERRORS):
+          self.rate_limiter.throttled()
+        if attempt >= self.max_retries:
+          raise
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2**attempt)
+        delay = random.uniform(delay / 2, delay)
+        attempt += 1
+        self._add_stats(retries=1)
+        logger.warning(
+            f"Embedding request for {len(texts)} texts failed ({type(e).__name__}: {e}). "
+            f"Retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+        time.sleep(delay)
+
+  def embed(
+      self, texts: list[str], errors: dict[int, BaseException] | None = None
+  ) -> list[list[float] | None]:
+    """
+      Returns one embedding per text, in order. Texts that could not be
+      embedded, after retries or splitting, get None, and the error
+      that made them fail is stored in `errors` under their index.
+
+      Raises:
+          ValueError: If the model returns vectors of the wrong size.
+      """
+    if not texts:
+      return []
+    try:
+      embeddings: list[list[float] | None] = list(
+          self._request_with_retries(texts))
+      self._add_stats(texts_embedded=len(texts))
+      return embeddings
+    except ValueError:
+      raise
+    except RETRYABLE_ERRORS as e:
+      # Not caused by the texts: splitting would only send more requests to
+      # an overloaded or throttled service.
+      logger.error(
+          f"Giving up on {len(texts)} texts after {self.max_retries} retries ({type(e).__name__}: {e})."
+      )
+      self._add_stats(texts_failed=len(texts))
+      if errors is not None:
+        errors.update((index, e) for index in range(len(texts)))
+      return [None] * len(texts)
+    except Exception as e:
+      if len(texts) == 1:
+        logger.error(
+            f"Giving up on text ({type(e).__name__}: {e}). Text[:50]='{texts[0][:50]}'"
+        )
+        self._add_stats(texts_failed=1)
+        if errors is not None:
+          errors[0] = e
+        return [None]
+      middle = len(texts) // 2
+      self._add_stats(splits=1)
+      logger.warning(
+          f"Embedding request for {len(texts)} texts failed ({type(e).__name__}: {e}). "
+          f"Splitting into {middle} + {len(texts) - middle}.")
+      right_errors: dict[int, BaseException] = {}
+      embeddings = self.embed(texts[:middle], errors) + self.embed(
+          texts[middle:], right_errors)
+      if errors is not None:
+        errors.update(
+            (middle + index, error) for index, error in right_errors.items())
+      return embeddings
@@ -0,0 +1,196 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input. One is sent per consumer thread.
+_END_OF_STREAM = object()
+# How often blocked threads wake up to check whether the pipeline was aborted.
+_POLL_INTERVAL_SECONDS = 0.5
+
+
+def run_pipeline(
+    batches: Iterable[list[dict]],
+    embed_fn: Callable[[list[dict]], list[dict] | None],
+    write_fn: Callable[[list[dict]], int],
+    embedding_workers: int,
+    db_writers: int,
+    max_inflight_batches: int,
+) -> dict[str, Any]:
+  """
+    Runs the read -> embed -> write stages concurrently.
+
+    A single reader thread pulls batches from `batches` (the BigQuery
+    iterator), `embedding_workers` threads call `embed_fn` and `db_writers`
+    threads call `write_fn`. Stages are connected by queues holding at most
+    `max_inflight_batches` batches each, so a slow stage blocks the stages
+    before it instead of letting memory grow.
+
+    `embed_fn` returns the batch with embeddings filled in, or None if the
+    batch failed and must not be written. `write_fn` returns the number of
+    rows written.
+
+    Any exception raised by a stage aborts the whole pipeline and is re-raised
+    in the calling thread once all workers have stopped.
+
+    Returns:
+        A dictionary with batch/row counters and busy seconds per stage.
+    """
+  embed_queue: queue.Queue = queue.Queue(maxsize=max_inflight_batches)
+  write_queue: queue.Queue = queue.Queue(maxsize=max_inflight_batches)
+  abort_event = threading.Event()
+  stats_lock = threading.Lock()
+  errors: list[BaseException] = []
+  stats: dict[str, Any] = {
+      "batches_read": 0,
+      "batches_embedded": 0,
+      "batches_failed": 0,
+      "batches_written": 0,
+      "rows_written": 0,
+      "read_seconds": 0.0,
+      "embed_seconds": 0.0,
+      "write_seconds": 0.0,
+  }
+
+  def _add_stats(**increments: float) -> None:
+    with stats_lock:
+      for key, value in increments.items():
+        stats[key] += value
+
+  def _abort(stage: str, error: BaseException) -> None:
+    logger.error(f"Pipeline stage '{stage}' failed, aborting: {error}")
+    with stats_lock:
+      errors.append(error)
+    abort_event.set()
+
+  def _put(target: queue.Queue, item: Any) -> bool:
+    """Blocks until there is room in the queue (backpressure) or abort."""
+    while not abort_event.is_set():
+      try:
+        target.put(item, timeout=_POLL_INTERVAL_SECONDS)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _get(source: queue.Queue) -> Any:
+    """Blocks until an item is available, returning end-of-stream on abort."""
+    while not abort_event.is_set():
+      try:
+        return source.get(timeout=_POLL_INTERVAL_SECONDS)
+      except queue.Empty:
+        continue
+    return _END_OF_STREAM
+
+  def _reader() -> None:
+    try:
+      iterator = iter(batches)
+      while True:
+        started = time.monotonic()
+        batch = next(iterator, None)
+        _add_stats(read_seconds=time.monotonic() - started)
+        if batch is None:
+          break
+        if not _put(embed_queue, batch):
+          return
+        _add_stats(batches_read=1)
+    except BaseException as e:
+      _abort("reader", e)
+    finally:
+      for _ in range(embedding_workers):
+        _put(embed_queue, _END_OF_STREAM)
+
+  def _embedder() -> None:
+    try:
+      while True:
+        batch = _get(embed_queue)
+        if batch is _END_OF_STREAM:
+          return
+        started = time.monotonic()
+        embedded_batch = embed_fn(batch)
+        _add_stats(embed_seconds=time.monotonic() - started)
+        if embedded_batch is None:
+          _add_stats(batches_failed=1)
+          continue
+        _add_stats(batches_embedded=1)
+        if not _put(write_queue, embedded_batch):
+          return
+    except BaseException as e:
+      _abort("embedding", e)
+
+  def _writer() -> None:
+    try:
+      while True:
+        batch = _get(write_queue)
+        if batch is _END_OF_STREAM:
+          return
+        started = time.monotonic()
+        written = write_fn(batch)
+        _add_stats(write_seconds=time.monotonic() - started, batches_written=1,
+                   rows_written=written)
+        with stats_lock:
+          batches_written = stats["batches_written"]
+          rows_written = stats["rows_written"]
+        if batches_written % 10 == 0:
+          logger.info(
+              f"Pipeline progress: {batches_written} batches written ({rows_written} rows). "
+              f"Queue depth: embed={embed_queue.qsize()}, write={write_queue.qsize()}."
+          )
+    except BaseException as e:
+      _abort("db-writer", e)
+
+  logger.info(
+      f"Starting pipeline: {embedding_workers} embedding workers, {db_writers} DB writers, "
+      f"max {max_inflight_batches} in-flight batches per stage.")
+  started = time.monotonic()
+
+  reader_thread = threading.Thread(target=_reader, name="bq-reader",
+                                   daemon=True)
+  embedder_threads = [
+      threading.Thread(target=_embedder, name=f"embedder-{i}", daemon=True)
+      for i in range(embedding_workers)
+  ]
+  writer_threads = [
+      threading.Thread(target=_writer, name=f"db-writer-{i}", daemon=True)
+      for i in range(db_writers)
+  ]
+  for thread in [reader_thread, *embedder_threads, *writer_threads]:
+    thread.start()
+
+  reader_thread.join()
+  for thread in embedder_threads:
+    thread.join()
+  # Writers are only told to stop once every embedding worker has drained.
+  for _ in range(db_writers):
+    _put(write_queue, _END_OF_STREAM)
+  for thread in writer_threads:
+    thread.join()
+
+  stats["elapsed_seconds"] = time.monotonic() - started
+  if errors:
+    raise errors[0]
+
+  logger.info(
+      f"Pipeline finished in {stats['elapsed_seconds']:.1f}s: "
+      f"{stats['batches_read']} batches read, {stats['batches_embedded']} embedded, "
+      f"{stats['batches_failed']} failed, {stats['rows_written']} rows written. "
+      f"Busy time: read={stats['read_seconds']:.1f}s, embed={stats['embed_seconds']:.1f}s, "
+      f"write={stats['write_seconds']:.1f}s.")
+  return stats
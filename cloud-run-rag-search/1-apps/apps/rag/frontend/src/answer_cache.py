@@ -0,0 +1,138 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+  """
+    Caches answers by query embedding: a query whose embedding has a cosine
+    similarity of at least `threshold` with a cached query gets its answer.
+
+    Up to `max_entries` entries are kept, the oldest being replaced first,
+    for `ttl_seconds`. Entries only match queries of the same `scope` (the
+    request options that change the retrieval, e.g. filters).
+
+    The whole cache is cleared when the corpus changes: refresh_version()
+    fetches a version of the corpus, at most every `version_check_seconds`,
+    and nothing is served until a version is known.
+
+    Only used from the event loop, no locking needed.
+    """
+
+  def __init__(self, max_entries: int, threshold: float, ttl_seconds: float,
+               version_check_seconds: float):
+    self.max_entries = max_entries
+    self.threshold = threshold
+    self.ttl_seconds = ttl_seconds
+    self.version_check_seconds = version_check_seconds
+    self._vectors: np.ndarray | None = None
+    self._expires = np.zeros(max_entries)
+    self._scopes: list[str | None] = [None] * max_entries
+    self._values: list[dict[str, Any] | None] = [None] * max_entries
+    self._next_slot = 0
+    self._version: Any = None
+    self._version_checked = float("-inf")
+    self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+  def clear(self) -> None:
+    self._expires[:] = 0
+    self._scopes = [None] * self.max_entries
+    self._values = [None] * self.max_entries
+
+  async def refresh_version(
+      self, fetch_version: Callable[[], Awaitable[Any]]) -> None:
+    """Clears the cache if the version returned by `fetch_version` changed."""
+    now = time.monotonic()
+    if now - self._version_checked < self.version_check_seconds:
+      return
+    self._version_checked = now
+    try:
+      version = await fetch_version()
+    except Exception as e:
+      logger.warning(
+          f"Could not check the corpus version ({type(e).__name__}: {e}).")
+      return
+    if version != self._version:
+      if self._version is not None:
+        self._stats["invalidations"] += 1
+        logger.info(
+            f"Corpus changed ({self._version} -> {version}), clearing the answer cache."
+        )
+      self.clear()
+      self._version = version
+
+  @staticmethod
+  def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+  def lookup(self, embedding: list[float],
+             scope: str) -> tuple[dict[str, Any], float] | None:
+    """
+      Returns the cached value of the most similar query above the threshold
+      and its similarity, or None.
+      """
+    if self.max_entries <= 0 or self._version is None or self._vectors is None:
+      return None
+    query = self._normalize(embedding)
+    if query.shape[0] != self._vectors.shape[1]:
+      return None
+    similarities = self._vectors @ query
+    valid = self._expires > time.monotonic()
+    valid &= np.array([entry_scope == scope for entry_scope in self._scopes])
+    similarities[~valid] = -np.inf
+    slot = int(np.argmax(similarities))
+    if similarities[slot] < self.threshold:
+      self._stats["misses"] += 1
+      return None
+    self._stats["hits"] += 1
+    return self._values[slot], float(similarities[slot])
+
+  def store(self, embedding: list[float], scope: str, value: dict[str,
+                                                                  Any]) -> None:
+    """Caches the value (answer, retrieved documents) of a query."""
+    if self.max_entries <= 0 or self._version is None:
+      return
+    vector = self._normalize(embedding)
+    if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+      self._vectors = np.zeros((self.max_entries, vector.shape[0]),
+                               dtype=np.float32)
+      self.clear()
+    slot = self._next_slot
+    self._next_slot = (slot + 1) % self.max_entries
+    self._vectors[slot] = vector
+    self._expires[slot] = time.monotonic() + self.ttl_seconds
+    self._scopes[slot] = scope
+    self._values[slot] = value
+
+  def get_stats(self) -> dict:
+    """Returns the cache counters and the number of live entries."""
+    lookups = self._stats["hits"] + self._stats["misses"]
+    return {
+        **self._stats,
+        "hit_rate":
+            round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries":
+            int((self._expires > time.monotonic()).sum()),
+        "corpus_version":
+            str(self._version),
+    }
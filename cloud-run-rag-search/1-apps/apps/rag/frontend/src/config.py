@@ -14,6 +14,8 @@
 
 import os
 
+from . import utils
+
 PROJECT_ID = os.environ.get("PROJECT_ID")
 REGION = os.environ.get("REGION", "europe-west1")
 
@@ -29,6 +31,42 @@ LLM_MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", 1024))
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME",
                                       "text-multilingual-embedding-002")
 EMBEDDING_TASK_TYPE = "RETRIEVAL_QUERY"
+# Reduced query embedding size, must match the index dimensions
+# (0 = model default). Reduced embeddings are L2-normalized, like the ingested
+# ones, for the dot product distance of the index.
+EMBEDDING_OUTPUT_DIMENSIONALITY = int(
+    os.environ.get("EMBEDDING_OUTPUT_DIMENSIONALITY", 0))
+
+# Query Embedding Cache Configuration
+# Up to QUERY_EMBEDDING_CACHE_SIZE prompt embeddings (0 disables the cache)
+# are kept in memory for QUERY_EMBEDDING_CACHE_TTL_SECONDS, keyed by model and
+# normalized prompt. QUERY_EMBEDDING_CACHE_REDIS_URL (e.g.
+# "redis://10.0.0.3:6379/0") adds a Redis-compatible store shared by all
+# instances.
+QUERY_EMBEDDING_CACHE_SIZE = int(
+    os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(
+    os.environ.get("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 3600))
+QUERY_EMBEDDING_CACHE_REDIS_URL = os.environ.get(
+    "QUERY_EMBEDDING_CACHE_REDIS_URL", "")
+
+# Semantic Answer Cache Configuration
+# With SEMANTIC_CACHE_ENABLED, a prompt whose embedding has a cosine
+# similarity of at least SEMANTIC_CACHE_THRESHOLD with a recently answered
+# one (up to SEMANTIC_CACHE_SIZE answers kept SEMANTIC_CACHE_TTL_SECONDS) gets
+# the cached answer, without retrieval nor generation. The cache is cleared
+# once the ingestion job has updated the index, i.e. written a new version to
+# the INDEX_VERSION_URI marker, which is checked every
+# SEMANTIC_CACHE_VERSION_CHECK_SECONDS.
+SEMANTIC_CACHE_ENABLED = utils.str_to_bool(
+    os.environ.get("SEMANTIC_CACHE_ENABLED", "false"))
+SEMANTIC_CACHE_THRESHOLD = float(
+    os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 1000))
+SEMANTIC_CACHE_TTL_SECONDS = float(
+    os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 86400))
+SEMANTIC_CACHE_VERSION_CHECK_SECONDS = float(
+    os.environ.get("SEMANTIC_CACHE_VERSION_CHECK_SECONDS", 60))
 
 # Vertex AI Vector Search Configuration
 VECTOR_SEARCH_INDEX_ENDPOINT_NAME = os.environ.get(
@@ -39,10 +77,16 @@ VECTOR_SEARCH_ENDPOINT_IP_ADDRESS = os.environ.get(
     "VECTOR_SEARCH_ENDPOINT_IP_ADDRESS")
 
 # GCS Source for Document Lookup
+# GCS_SOURCE_BLOB_NAME is the source of the ingestion job: an object name, a
+# prefix ending with "/" or a glob such as "exports/part-*.jsonl.gz". Gzip and
+# zstd compressed objects are decompressed.
 GCS_SOURCE_BUCKET = os.environ.get("GCS_SOURCE_BUCKET")
 GCS_SOURCE_BLOB_NAME = os.environ.get("GCS_SOURCE_BLOB_NAME", "data.jsonl")
 DOCUMENT_CACHE_TTL_SECONDS = int(
     os.environ.get("DOCUMENT_CACHE_TTL_SECONDS", 600))
+# Version marker written by the ingestion job once it has updated the index.
+INDEX_VERSION_URI = os.environ.get(
+    "INDEX_VERSION_URI", f"gs://{GCS_SOURCE_BUCKET}/index-version.json")
 
 # Retriever Configuration
 RETRIEVER_TOP_K = int(os.environ.get("RETRIEVER_TOP_K", 10))
@@ -12,13 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 
+class NumericFilter(BaseModel):
+  """
+    A comparison against a numeric restrict of the datapoints,
+    e.g. {"namespace": "year", "op": "GREATER_EQUAL", "value": 2000}.
+    """
+
+  namespace: str = Field(min_length=1)
+  op: Literal["LESS", "LESS_EQUAL", "EQUAL", "GREATER_EQUAL", "GREATER",
+              "NOT_EQUAL"]
+  value: float
+
+
 class Prompt(BaseModel):
   """
     Represents the request body for the prediction endpoint.
-    It expects a single field 'prompt' containing the text to be processed by the model.
+    It expects a field 'prompt' containing the text to be processed by the model
+    and optional filters applied inside the Vector Search query.
     """
 
   prompt: str = Field(
@@ -28,3 +43,14 @@ class Prompt(BaseModel):
       "The text prompt to send to the generative model for a response.",
       min_length=1,
   )
+  filters: dict[str, list[str]] | None = Field(
+      default=None,
+      title="Restrict filters",
+      description=
+      "Allowed tokens per restrict namespace, e.g. {\"genre\": [\"Action\"]}. Documents must match one token of every namespace.",
+  )
+  numeric_filters: list[NumericFilter] | None = Field(
+      default=None,
+      title="Numeric restrict filters",
+      description="Comparisons that documents must all satisfy.",
+  )
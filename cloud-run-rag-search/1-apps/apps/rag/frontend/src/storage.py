@@ -12,12 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fnmatch
+import gzip
+import io
 import json
 import logging
 import sys
 import threading
 import time
-from typing import Any, List, Dict
+from typing import Any, BinaryIO, List, Dict
 
 from google.cloud import storage as gcs
 import google.api_core.exceptions as exceptions
@@ -34,11 +37,59 @@ _document_lookup_cache: Dict[str, Dict] = {}
 _cache_load_time: float = 0.0
 _cache_lock = threading.Lock()
 
+# Magic numbers of the supported compression formats.
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _list_source_blobs(storage_client: gcs.Client, bucket_name: str,
+                       blob_pattern: str) -> List[gcs.Blob]:
+  """
+    Resolves the source objects like the ingestion job: `blob_pattern` is an
+    object name, a prefix ending with '/' (every object under it), or a glob
+    such as 'exports/part-*.jsonl.gz'. Returns them sorted by name.
+    """
+  if any(char in blob_pattern for char in "*?["):
+    prefix = blob_pattern
+    for char in "*?[":
+      prefix = prefix.split(char, 1)[0]
+    blobs = [
+        blob for blob in storage_client.list_blobs(bucket_name, prefix=prefix)
+        if fnmatch.fnmatchcase(blob.name, blob_pattern)
+    ]
+  elif blob_pattern.endswith("/"):
+    blobs = [
+        blob
+        for blob in storage_client.list_blobs(bucket_name, prefix=blob_pattern)
+        if not blob.name.endswith("/")
+    ]
+  else:
+    blob = storage_client.bucket(bucket_name).get_blob(blob_pattern)
+    blobs = [blob] if blob is not None else []
+  return sorted(blobs, key=lambda blob: blob.name)
+
+
+def _open_decompressed(raw: BinaryIO) -> BinaryIO:
+  """
+    Wraps a binary stream so that gzip and zstd compressed content is
+    decompressed on the fly, the format being detected from the first bytes.
+    """
+  reader = io.BufferedReader(raw) if not hasattr(raw, "peek") else raw
+  magic = reader.peek(4)[:4]
+  if magic.startswith(_GZIP_MAGIC):
+    return gzip.GzipFile(fileobj=reader)
+  if magic == _ZSTD_MAGIC:
+    import zstandard
+    # The zstd reader has no readline(): buffer it for line iteration.
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+        reader, read_across_frames=True))
+  return reader
+
 
 def _load_documents_from_gcs():
   """
-    Internal function to download a JSONL file from GCS and load it into
-    the in-memory dictionary. This is the slow operation.
+    Internal function to download the JSONL source files from GCS and load
+    them into the in-memory dictionary. This is the slow operation.
     """
   global _document_lookup_cache, _cache_load_time
   bucket_name = config.GCS_SOURCE_BUCKET
@@ -53,24 +104,33 @@ def _load_documents_from_gcs():
     logging.info(
         f"Refreshing document cache from gs://{bucket_name}/{blob_name}...")
     storage_client = gcs.Client(project=config.PROJECT_ID)
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+    blobs = _list_source_blobs(storage_client, bucket_name, blob_name)
+    if not blobs:
+      logging.error(f"No GCS object matches gs://{bucket_name}/{blob_name}.")
+      _document_lookup_cache = {}
+      return
 
     new_cache = {}
-    with blob.open("r") as f:
-      for line in f:
-        record = json.loads(line)
-        record_id = record.get("id")
-        if record_id:
-          # Ensure ID is a string for consistent key lookup
-          new_cache[str(record_id)] = record
-        else:
-          logging.warning(f"Skipping record with missing 'id': {record}")
+    for blob in blobs:
+      # Objects stored with Content-Encoding: gzip are downloaded as-is and
+      # decompressed here, like any other compressed object.
+      with blob.open("rb", raw_download=True) as raw:
+        with _open_decompressed(raw) as f:
+          for line in f:
+            if not line.strip():
+              continue
+            record = json.loads(line)
+            record_id = record.get("id")
+            if record_id:
+              # Ensure ID is a string for consistent key lookup
+              new_cache[str(record_id)] = record
+            else:
+              logging.warning(f"Skipping record with missing 'id': {record}")
 
     _document_lookup_cache = new_cache
     _cache_load_time = time.time()
     logging.info(
-        f"Successfully loaded {len(_document_lookup_cache)} documents into memory cache."
+        f"Successfully loaded {len(_document_lookup_cache)} documents from {len(blobs)} file(s) into memory cache."
     )
 
   except exceptions.NotFound:
@@ -119,6 +179,21 @@ def get_documents_by_ids(ids: List[str]) -> List[str]:
   return found_docs
 
 
+def get_index_version() -> str | None:
+  """
+    Returns the version in the marker the ingestion job writes to
+    INDEX_VERSION_URI once it has updated the index, None before the first
+    ingestion.
+    """
+  bucket_name, _, blob_name = config.INDEX_VERSION_URI[len("gs://"):].partition(
+      "/")
+  storage_client = gcs.Client(project=config.PROJECT_ID)
+  blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+  if blob is None:
+    return None
+  return json.loads(blob.download_as_bytes())["version"]
+
+
 def get_cache_status() -> str:
   """Returns a string describing the current state of the cache."""
   if _document_lookup_cache:
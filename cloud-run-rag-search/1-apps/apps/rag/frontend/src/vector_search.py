@@ -14,9 +14,11 @@
 
 import logging
 import sys
-from typing import List
+from typing import Dict, List, Optional
 
 from google.cloud import aiplatform
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import (
+    Namespace, NumericNamespace)
 import google.api_core.exceptions as exceptions
 
 from src import config
@@ -31,15 +33,22 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)])
 
 
-def find_similar_document_ids(query_embedding: List[float],
-                              num_neighbors: int) -> List[str]:
+def find_similar_document_ids(
+    query_embedding: List[float], num_neighbors: int,
+    filters: Optional[Dict[str, List[str]]] = None,
+    numeric_filters: Optional[List[Dict]] = None) -> List[str]:
   """
     Searches for documents with embeddings similar to the query_embedding
-    using Vertex AI Vector Search and returns their IDs.
+    using Vertex AI Vector Search and returns their IDs. Filters are applied
+    inside the search, on the restricts stored at ingestion.
 
     Args:
         query_embedding: A list of floats representing the query embedding.
         num_neighbors: The number of nearest neighbors to retrieve.
+        filters: Allowed tokens per restrict namespace. A document must match
+            one token of every namespace.
+        numeric_filters: Dicts with 'namespace', 'op' (e.g. "GREATER_EQUAL")
+            and 'value', compared with the numeric restricts (stored as doubles).
 
     Returns:
         A list of strings, where each string is the ID of a similar document.
@@ -64,13 +73,28 @@ def find_similar_document_ids(query_embedding: List[float],
         f"Using private service connect with IP: {config.VECTOR_SEARCH_ENDPOINT_IP_ADDRESS}"
     )
 
-    logging.info(f"Querying Vector Search index for {num_neighbors} neighbors.")
+    token_namespaces = [
+        Namespace(name=name, allow_tokens=tokens)
+        for name, tokens in (filters or {}).items()
+    ]
+    numeric_namespaces = [
+        NumericNamespace(name=numeric_filter["namespace"],
+                         value_double=float(numeric_filter["value"]),
+                         op=numeric_filter["op"])
+        for numeric_filter in numeric_filters or []
+    ]
+    logging.info(
+        f"Querying Vector Search index for {num_neighbors} neighbors "
+        f"({len(token_namespaces)} restrict and {len(numeric_namespaces)} numeric filters)."
+    )
 
     # The match method expects a list of queries.
     # We are sending a single query.
     response = index_endpoint.match(
         deployed_index_id=config.VECTOR_SEARCH_DEPLOYED_INDEX_ID,
-        queries=[query_embedding], num_neighbors=num_neighbors)
+        queries=[query_embedding], num_neighbors=num_neighbors,
+        filter=token_namespaces or None, numeric_filter=numeric_namespaces or
+        None)
 
     # The response is a list of lists of MatchNeighbor objects.
     neighbors = response[0] if response else []
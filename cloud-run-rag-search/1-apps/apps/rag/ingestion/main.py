@@ -12,16 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ast
+import math
 import os
 import logging
 import sys
 import json
-from typing import Any, List, Dict
+import time
+from typing import Any, Iterator, List, Dict, Optional
 
 from vertexai.language_models import TextEmbeddingModel
 from google.cloud import aiplatform
 
+from src import checkpoint
 from src import config
+from src import staging
 from src import storage
 from src import vector_search
 
@@ -71,14 +76,37 @@ def format_json_value_for_embedding(value: Any) -> str:
   return str(value).strip()
 
 
+def normalize_embedding(values: list[float]) -> list[float]:
+  """
+    Scales an embedding to unit length. Reduced-dimension embeddings are
+    truncated full-size ones, so their norm is below 1 and varies: the dot
+    product distance of the index only ranks them like cosine once normalized.
+    """
+  norm = math.sqrt(sum(value * value for value in values))
+  return [value / norm for value in values] if norm else values
+
+
 def get_embeddings_batch_vertexai(texts: list[str]) -> list[list[float]]:
   """Gets embeddings for a batch of texts using Vertex AI TextEmbeddingModel."""
   if not texts:
     return []
   try:
     model = TextEmbeddingModel.from_pretrained(config.EMBEDDING_MODEL_NAME)
-    response = model.get_embeddings(texts)
-    return [embedding.values for embedding in response]
+    if config.EMBEDDING_OUTPUT_DIMENSIONALITY:
+      response = model.get_embeddings(
+          texts, output_dimensionality=config.EMBEDDING_OUTPUT_DIMENSIONALITY)
+    else:
+      response = model.get_embeddings(texts)
+    embeddings = [embedding.values for embedding in response]
+    if embeddings and len(embeddings[0]) != config.EMBEDDING_DIMENSIONS:
+      logger.error(
+          f"Embedding dimension mismatch! Model '{config.EMBEDDING_MODEL_NAME}' returned "
+          f"{len(embeddings[0])} dims, the index expects {config.EMBEDDING_DIMENSIONS}."
+      )
+      return []
+    if config.EMBEDDING_OUTPUT_DIMENSIONALITY:
+      embeddings = [normalize_embedding(values) for values in embeddings]
+    return embeddings
   except Exception as e:
     logger.error(
         f"Error getting embeddings from Vertex AI (model: {config.EMBEDDING_MODEL_NAME}): {e}"
@@ -86,15 +114,74 @@ def get_embeddings_batch_vertexai(texts: list[str]) -> list[list[float]]:
     return []
 
 
-def create_datapoint(record_id: str, embedding: list[float]) -> dict:
+def restrict_tokens(value: Any) -> list[str]:
+  """
+    Returns the restrict tokens of a JSON value: one per list item. Strings
+    holding a list literal, such as "['Action', 'Drama']", are split too.
+    """
+  if value is None:
+    return []
+  if isinstance(value, str) and value.startswith("["):
+    try:
+      value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+      pass
+  if not isinstance(value, list):
+    value = [value]
+  return [str(item).strip() for item in value if str(item).strip()]
+
+
+def build_restricts(record: Dict[str, Any]) -> Dict[str, list]:
+  """
+    Maps the configured fields of a record to the 'restricts' and
+    'numeric_restricts' of its datapoint. Missing fields and numeric fields
+    that are not numbers are left out.
+    """
+  restricts = []
+  for field in config.VECTOR_SEARCH_RESTRICT_FIELDS:
+    tokens = restrict_tokens(record.get(field))
+    if tokens:
+      restricts.append({"namespace": field, "allow_list": tokens})
+  numeric_restricts = []
+  for field in config.VECTOR_SEARCH_NUMERIC_RESTRICT_FIELDS:
+    value = record.get(field)
+    try:
+      numeric_restricts.append({
+          "namespace": field,
+          "value_double": float(value)
+      })
+    except (TypeError, ValueError):
+      continue
+  return {"restricts": restricts, "numeric_restricts": numeric_restricts}
+
+
+def create_datapoint(record_id: str, embedding: list[float],
+                     restricts: Optional[Dict[str, list]] = None) -> dict:
   """
-    Creates a simple datapoint dictionary for the Vector Search upsert API,
-    containing only the ID and the feature vector.
+    Creates a datapoint dictionary for the Vector Search upsert API,
+    containing the ID, the feature vector and, if any, the restricts
+    returned by build_restricts().
     """
-  return {
+  datapoint = {
       "datapoint_id": record_id,
       "feature_vector": embedding,
   }
+  if restricts:
+    datapoint.update({key: value for key, value in restricts.items() if value})
+  return datapoint
+
+
+def track_read_offsets(
+    source_iterator: Iterator[Any],
+    read_offsets: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+  """
+    Yields the records of stream_gcs_jsonl_files() read with offsets,
+    recording in `read_offsets` the end offset of the last line read of each
+    source file.
+    """
+  for record, (key, offset) in source_iterator:
+    read_offsets[key] = offset
+    yield record
 
 
 def run_indexer():
@@ -105,7 +192,7 @@ def run_indexer():
   logger.info("Starting indexer job...")
   logger.info(f"Project ID: {config.PROJECT_ID}, Region: {config.REGION}")
   logger.info(
-      f"GCS source: gs://{config.GCS_SOURCE_BUCKET}/{config.GCS_SOURCE_BLOB_NAME}"
+      f"GCS source: gs://{config.GCS_SOURCE_BUCKET}/{config.GCS_SOURCE_BLOB_NAME} ({config.GCS_SOURCE_READERS} readers)"
   )
   logger.info(f"Vector Search Index: {config.VECTOR_SEARCH_INDEX_NAME}")
   logger.info(
@@ -114,16 +201,63 @@ def run_indexer():
   logger.info(
       f"Batch sizes: Embedding Request={config.EMBEDDING_BATCH_SIZE}, Vector Search Upsert={config.VECTOR_SEARCH_UPSERT_BATCH_SIZE}"
   )
+  if config.VECTOR_SEARCH_WRITE_MODE not in ("stream", "batch"):
+    logger.error(
+        f"Unknown VECTOR_SEARCH_WRITE_MODE '{config.VECTOR_SEARCH_WRITE_MODE}'. Use 'stream' or 'batch'."
+    )
+    sys.exit(1)
 
   batch_for_embedding = []
   batch_for_upsert = []
   total_processed_count = 0
-  total_upserted_count = 0
+  offsets = None
+  read_offsets: Dict[str, int] = {}
+  if config.CHECKPOINTING and config.VECTOR_SEARCH_WRITE_MODE == "batch":
+    logger.warning(
+        "CHECKPOINTING is ignored in batch mode: nothing is written to the index before the batch update."
+    )
+  elif config.CHECKPOINTING:
+    offsets = checkpoint.OffsetCheckpoint(
+        config.CHECKPOINT_URI,
+        interval_seconds=config.CHECKPOINT_INTERVAL_SECONDS,
+        project_id=config.PROJECT_ID)
+    # Files that are not read again keep their offsets.
+    read_offsets = offsets.load()
+  if config.VECTOR_SEARCH_WRITE_MODE == "batch":
+    run_id = config.RUN_ID or time.strftime("%Y%m%d-%H%M%S")
+    contents_delta_uri = f"{config.VECTOR_SEARCH_STAGING_URI.rstrip('/')}/{run_id}"
+    logger.info(
+        f"Batch update mode, staging datapoints in {contents_delta_uri}/")
+    upserter = staging.StagingWriter(
+        contents_delta_uri,
+        records_per_file=config.VECTOR_SEARCH_STAGING_FILE_RECORDS,
+        project_id=config.PROJECT_ID)
+  else:
+    logger.info(
+        f"Concurrent upserts: {config.VECTOR_SEARCH_UPSERT_CONCURRENCY}")
+    # Upserts run in the background, overlapping with embedding.
+    upserter = vector_search.ConcurrentUpserter(
+        project=config.PROJECT_ID, location=config.REGION,
+        index_name=config.VECTOR_SEARCH_INDEX_NAME,
+        max_in_flight=config.VECTOR_SEARCH_UPSERT_CONCURRENCY,
+        max_retries=config.VECTOR_SEARCH_UPSERT_MAX_RETRIES,
+        retry_base_delay=config.VECTOR_SEARCH_UPSERT_RETRY_BASE_DELAY_SECONDS)
 
-  # Stream the source file line by line
-  source_iterator = storage.stream_gcs_jsonl_file(
+  # Stream the source files line by line, several files at a time
+  source_iterator = storage.stream_gcs_jsonl_files(
       project_id=config.PROJECT_ID, bucket_name=config.GCS_SOURCE_BUCKET,
-      blob_name=config.GCS_SOURCE_BLOB_NAME)
+      blob_pattern=config.GCS_SOURCE_BLOB_NAME,
+      readers=config.GCS_SOURCE_READERS,
+      start_offsets=dict(read_offsets) if offsets else None)
+  if offsets:
+    source_iterator = track_read_offsets(source_iterator, read_offsets)
+
+  def submit(datapoints: List[dict]) -> None:
+    if offsets is None:
+      upserter.submit(datapoints)
+      return
+    # Every line read so far is in this batch, in an earlier one or skipped.
+    upserter.submit(datapoints, on_done=offsets.register(dict(read_offsets)))
 
   for record in source_iterator:
     total_processed_count += 1
@@ -155,7 +289,8 @@ def run_indexer():
 
     batch_for_embedding.append({
         "id": record_id,
-        "text_to_embed": text_to_embed
+        "text_to_embed": text_to_embed,
+        "restricts": build_restricts(record)
     })
 
     # 2. Process batch for embeddings when full
@@ -168,7 +303,7 @@ def run_indexer():
 
       if embeddings and len(embeddings) == len(batch_for_embedding):
         for item, embedding in zip(batch_for_embedding, embeddings):
-          datapoint = create_datapoint(item['id'], embedding)
+          datapoint = create_datapoint(item['id'], embedding, item['restricts'])
           batch_for_upsert.append(datapoint)
       else:
         logger.error("Failed to get embeddings for a batch, skipping.")
@@ -180,12 +315,8 @@ def run_indexer():
       logger.info(
           f"Upserting a batch of {len(batch_for_upsert)} datapoints to Vector Search..."
       )
-      vector_search.upsert_datapoints_to_index(
-          project=config.PROJECT_ID, location=config.REGION,
-          index_name=config.VECTOR_SEARCH_INDEX_NAME,
-          datapoints=batch_for_upsert)
-      total_upserted_count += len(batch_for_upsert)
-      batch_for_upsert = []  # Clear the batch
+      submit(batch_for_upsert)
+      batch_for_upsert = []  # Start a new batch, the upserter owns this one
 
   # Process any remaining items in the embedding batch
   if batch_for_embedding:
@@ -196,7 +327,7 @@ def run_indexer():
     embeddings = get_embeddings_batch_vertexai(texts)
     if embeddings and len(embeddings) == len(batch_for_embedding):
       for item, embedding in zip(batch_for_embedding, embeddings):
-        datapoint = create_datapoint(item['id'], embedding)
+        datapoint = create_datapoint(item['id'], embedding, item['restricts'])
         batch_for_upsert.append(datapoint)
 
   # Upsert any remaining datapoints
@@ -204,16 +335,31 @@ def run_indexer():
     logger.info(
         f"Upserting the final batch of {len(batch_for_upsert)} datapoints to Vector Search..."
     )
-    vector_search.upsert_datapoints_to_index(
+    submit(batch_for_upsert)
+  total_upserted_count = upserter.close()
+  if offsets:
+    offsets.clear()
+
+  if config.VECTOR_SEARCH_WRITE_MODE == "batch" and total_upserted_count:
+    vector_search.batch_update_index(
         project=config.PROJECT_ID, location=config.REGION,
-        index_name=config.VECTOR_SEARCH_INDEX_NAME, datapoints=batch_for_upsert)
-    total_upserted_count += len(batch_for_upsert)
+        index_name=config.VECTOR_SEARCH_INDEX_NAME,
+        contents_delta_uri=contents_delta_uri,
+        complete_overwrite=config.VECTOR_SEARCH_COMPLETE_OVERWRITE,
+        poll_interval_seconds=config.VECTOR_SEARCH_BATCH_POLL_SECONDS)
+
+  if total_upserted_count:
+    # Tells the frontends to drop the answers cached before this update.
+    storage.write_index_version(
+        config.INDEX_VERSION_URI, version=config.RUN_ID or
+        time.strftime("%Y%m%d-%H%M%S"), datapoints=total_upserted_count,
+        project_id=config.PROJECT_ID)
 
   logger.info("Indexer job finished.")
   logger.info(
-      f"Total records processed from GCS file: {total_processed_count}.")
+      f"Total records processed from GCS files: {total_processed_count}.")
   logger.info(
-      f"Total datapoints successfully upserted to Vector Search: {total_upserted_count}."
+      f"Total datapoints successfully written to Vector Search ({config.VECTOR_SEARCH_WRITE_MODE} mode): {total_upserted_count}."
   )
 
 
@@ -0,0 +1,146 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Set
+
+import orjson
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+
+def _split_gcs_uri(uri: str) -> tuple[str, str]:
+  bucket, _, name = uri[len("gs://"):].partition("/")
+  return bucket, name
+
+
+class OffsetCheckpoint:
+  """
+    Tracks, per source object, the byte offset below which every line has
+    been written to the index, and persists it to `uri` (a gs:// object or a
+    local file) so that a retried run resumes from there.
+
+    Batches are registered in read order with the read offsets reached when
+    they were submitted: by then, every line below those offsets is in this
+    batch, in an earlier one, or was skipped. Batches may complete out of
+    order; the committed offsets only move past a batch once it and all the
+    batches registered before it are done.
+
+    The offsets are saved at most every `interval_seconds`, and once more by
+    flush(). Safe to share between threads.
+    """
+
+  def __init__(self, uri: str, interval_seconds: float,
+               project_id: Optional[str] = None):
+    self.uri = uri
+    self.interval_seconds = interval_seconds
+    self.project_id = project_id
+    self._lock = threading.Lock()
+    self._save_lock = threading.Lock()
+    self._next_seq = 0
+    self._offsets_by_seq: Dict[int, Dict[str, int]] = {}
+    self._done: Set[int] = set()
+    self._watermark_seq = -1
+    self._committed: Dict[str, int] = {}
+    self._saved: Dict[str, int] = {}
+    self._last_save = time.monotonic()
+
+  def _blob(self) -> storage.Blob:
+    bucket_name, name = _split_gcs_uri(self.uri)
+    return storage.Client(
+        project=self.project_id).bucket(bucket_name).blob(name)
+
+  def load(self) -> Dict[str, int]:
+    """
+      Reads the persisted offsets.
+
+      Returns:
+          The byte offset to resume from per source key, empty without a
+          checkpoint.
+      """
+    if self.uri.startswith("gs://"):
+      blob = self._blob()
+      content = blob.download_as_bytes() if blob.exists() else None
+    elif os.path.exists(self.uri):
+      with open(self.uri, "rb") as f:
+        content = f.read()
+    else:
+      content = None
+    if content is None:
+      logger.info(f"No checkpoint at {self.uri}, reading from the start.")
+      return {}
+    offsets = orjson.loads(content)["offsets"]
+    with self._lock:
+      self._committed = dict(offsets)
+      self._saved = dict(offsets)
+    logger.info(f"Resuming {len(offsets)} source file(s) from {self.uri}.")
+    return offsets
+
+  def register(self, offsets: Dict[str, int]) -> Callable[[], None]:
+    """
+      Registers the next batch with the read offsets reached so far.
+
+      Returns:
+          The function to call once the batch is written.
+      """
+    with self._lock:
+      seq = self._next_seq
+      self._next_seq += 1
+      self._offsets_by_seq[seq] = offsets
+    return lambda: self._mark_done(seq)
+
+  def _mark_done(self, seq: int) -> None:
+    with self._lock:
+      self._done.add(seq)
+      while self._watermark_seq + 1 in self._done:
+        self._watermark_seq += 1
+        self._done.remove(self._watermark_seq)
+        self._committed = self._offsets_by_seq.pop(self._watermark_seq)
+      due = time.monotonic() - self._last_save >= self.interval_seconds
+    if due:
+      self.flush()
+
+  def flush(self) -> None:
+    """Persists the committed offsets if they changed since the last save."""
+    with self._save_lock:
+      with self._lock:
+        committed = self._committed
+        self._last_save = time.monotonic()
+      if committed == self._saved:
+        return
+      content = orjson.dumps({"offsets": committed})
+      if self.uri.startswith("gs://"):
+        self._blob().upload_from_string(content,
+                                        content_type="application/json")
+      else:
+        with open(self.uri, "wb") as f:
+          f.write(content)
+      self._saved = committed
+      logger.info(
+          f"Checkpoint saved: {sum(committed.values())} bytes committed in {len(committed)} file(s)."
+      )
+
+  def clear(self) -> None:
+    """Deletes the checkpoint once the whole source has been written."""
+    if self.uri.startswith("gs://"):
+      blob = self._blob()
+      if blob.exists():
+        blob.delete()
+    elif os.path.exists(self.uri):
+      os.remove(self.uri)
+    logger.info(f"Checkpoint {self.uri} cleared.")
@@ -14,17 +14,33 @@
 
 import os
 
+from . import utils
+
 PROJECT_ID = os.environ.get("PROJECT_ID")
 REGION = os.environ.get("REGION", "europe-west1")
 
-# Google Cloud Storage Configuration (for the SOURCE file)
+# Google Cloud Storage Configuration (for the SOURCE files)
+# GCS_SOURCE_BLOB_NAME is an object name, a prefix ending with "/" or a glob
+# such as "exports/part-*.jsonl.gz". Gzip and zstd compressed objects are
+# decompressed transparently. Up to GCS_SOURCE_READERS objects are read in
+# parallel.
 GCS_SOURCE_BUCKET = os.environ.get("GCS_SOURCE_BUCKET")
 GCS_SOURCE_BLOB_NAME = os.environ.get("GCS_SOURCE_BLOB_NAME", "data.jsonl")
+GCS_SOURCE_READERS = int(os.environ.get("GCS_SOURCE_READERS", 4))
 
 # Embedding Model Configuration
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME",
                                       "text-multilingual-embedding-002")
-EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", 768))
+# EMBEDDING_OUTPUT_DIMENSIONALITY requests reduced-dimension embeddings from
+# models that support it (Matryoshka embeddings, e.g. 256 instead of 768),
+# and defaults EMBEDDING_DIMENSIONS, the size of the index, to it. 0 keeps the
+# model's default size. Reduced embeddings are L2-normalized, as the index
+# uses the dot product distance; the frontend normalizes queries the same way.
+EMBEDDING_OUTPUT_DIMENSIONALITY = int(
+    os.environ.get("EMBEDDING_OUTPUT_DIMENSIONALITY", 0))
+EMBEDDING_DIMENSIONS = int(
+    os.environ.get("EMBEDDING_DIMENSIONS", EMBEDDING_OUTPUT_DIMENSIONALITY or
+                   768))
 EMBEDDING_BATCH_SIZE = int(os.environ.get(
     "EMBEDDING_BATCH_SIZE", 200))  # Batch for calling the embedding model API
 
@@ -33,3 +49,74 @@ VECTOR_SEARCH_INDEX_NAME = os.environ.get("VECTOR_SEARCH_INDEX_NAME")
 # Batch size for the upsert_datapoints API call (max 1000, recommended 100-200)
 VECTOR_SEARCH_UPSERT_BATCH_SIZE = int(
     os.environ.get("VECTOR_SEARCH_UPSERT_BATCH_SIZE", 100))
+# Upserts run in the background while the next batches are embedded, with at
+# most VECTOR_SEARCH_UPSERT_CONCURRENCY batches in flight. Quota and server
+# errors are retried per batch with exponential backoff.
+VECTOR_SEARCH_UPSERT_CONCURRENCY = int(
+    os.environ.get("VECTOR_SEARCH_UPSERT_CONCURRENCY", 4))
+VECTOR_SEARCH_UPSERT_MAX_RETRIES = int(
+    os.environ.get("VECTOR_SEARCH_UPSERT_MAX_RETRIES", 5))
+VECTOR_SEARCH_UPSERT_RETRY_BASE_DELAY_SECONDS = float(
+    os.environ.get("VECTOR_SEARCH_UPSERT_RETRY_BASE_DELAY_SECONDS", 1.0))
+
+# Filtering Metadata Configuration
+# Comma-separated JSONL fields stored with every datapoint, so that queries
+# can be filtered inside the nearest-neighbor search. Each field is a
+# namespace: VECTOR_SEARCH_RESTRICT_FIELDS become token restricts (one token
+# per list item, e.g. "genre") and VECTOR_SEARCH_NUMERIC_RESTRICT_FIELDS
+# numeric restricts stored as doubles (e.g. "year,rating").
+VECTOR_SEARCH_RESTRICT_FIELDS = [
+    field.strip()
+    for field in os.environ.get("VECTOR_SEARCH_RESTRICT_FIELDS", "").split(",")
+    if field.strip()
+]
+VECTOR_SEARCH_NUMERIC_RESTRICT_FIELDS = [
+    field.strip()
+    for field in os.environ.get("VECTOR_SEARCH_NUMERIC_RESTRICT_FIELDS",
+                                "").split(",")
+    if field.strip()
+]
+
+# Vector Search Write Mode
+# "stream" upserts the datapoints as they are embedded, for incremental
+# changes. "batch" writes them as JSON files of at most
+# VECTOR_SEARCH_STAGING_FILE_RECORDS records under
+# VECTOR_SEARCH_STAGING_URI/<run ID>/, then runs a single batch update of the
+# index from that directory and polls it every VECTOR_SEARCH_BATCH_POLL_SECONDS,
+# for initial loads and rebuilds. VECTOR_SEARCH_COMPLETE_OVERWRITE replaces the
+# whole content of the index with the staged datapoints.
+VECTOR_SEARCH_WRITE_MODE = os.environ.get("VECTOR_SEARCH_WRITE_MODE", "stream")
+VECTOR_SEARCH_STAGING_URI = os.environ.get(
+    "VECTOR_SEARCH_STAGING_URI",
+    f"gs://{GCS_SOURCE_BUCKET}/vector-search-staging")
+VECTOR_SEARCH_STAGING_FILE_RECORDS = int(
+    os.environ.get("VECTOR_SEARCH_STAGING_FILE_RECORDS", 50000))
+VECTOR_SEARCH_COMPLETE_OVERWRITE = utils.str_to_bool(
+    os.environ.get("VECTOR_SEARCH_COMPLETE_OVERWRITE", "false"))
+VECTOR_SEARCH_BATCH_POLL_SECONDS = float(
+    os.environ.get("VECTOR_SEARCH_BATCH_POLL_SECONDS", 30))
+# Cloud Run Jobs set the execution name, which names the staging directory.
+RUN_ID = os.environ.get("CLOUD_RUN_EXECUTION", "")
+
+# Checkpoint Configuration
+# With CHECKPOINTING (stream mode only), the byte offset of each source file
+# below which every line has been upserted is saved to CHECKPOINT_URI at most
+# every CHECKPOINT_INTERVAL_SECONDS. A failed run or task retry resumes each
+# file from its offset, with ranged reads for uncompressed files, and redoes
+# at most the lines written since the last save. The checkpoint is deleted
+# once the run completes.
+CHECKPOINTING = utils.str_to_bool(os.environ.get("CHECKPOINTING", "false"))
+CHECKPOINT_URI = os.environ.get(
+    "CHECKPOINT_URI",
+    f"gs://{GCS_SOURCE_BUCKET}/indexer-checkpoints/{VECTOR_SEARCH_INDEX_NAME}.json"
+)
+CHECKPOINT_INTERVAL_SECONDS = float(
+    os.environ.get("CHECKPOINT_INTERVAL_SECONDS", 30))
+
+# Index Version Configuration
+# Once a run has written datapoints to the index (after the last upsert, or
+# once the batch update completes), a JSON marker with a new version is
+# written to INDEX_VERSION_URI. The frontend reads it to invalidate its
+# semantic answer cache.
+INDEX_VERSION_URI = os.environ.get(
+    "INDEX_VERSION_URI", f"gs://{GCS_SOURCE_BUCKET}/index-version.json")
@@ -0,0 +1,106 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import orjson
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+
+def _split_gcs_uri(uri: str) -> tuple[str, str]:
+  bucket, _, name = uri[len("gs://"):].partition("/")
+  return bucket, name
+
+
+def to_index_record(datapoint: Dict[str, Any]) -> Dict[str, Any]:
+  """
+    Converts an upsert datapoint to a record of the Vector Search batch
+    input format ('id', 'embedding', and optional restricts).
+    """
+  record = {
+      "id": datapoint["datapoint_id"],
+      "embedding": datapoint["feature_vector"],
+  }
+  if datapoint.get("restricts"):
+    # The batch format names the token lists 'allow' and 'deny'.
+    record["restricts"] = [{
+        "namespace": restrict["namespace"],
+        "allow": restrict.get("allow_list", []),
+        "deny": restrict.get("deny_list", []),
+    } for restrict in datapoint["restricts"]]
+  if datapoint.get("numeric_restricts"):
+    record["numeric_restricts"] = datapoint["numeric_restricts"]
+  return record
+
+
+class StagingWriter:
+  """
+    Writes datapoints as JSON files under a GCS directory, the contents
+    delta URI of a batch index update.
+
+    Files are streamed to GCS with resumable uploads, so memory stays
+    bounded whatever their size, and a new file is started every
+    `records_per_file` records. Has the same submit()/close() interface as
+    vector_search.ConcurrentUpserter.
+    """
+
+  def __init__(self, directory_uri: str, records_per_file: int,
+               project_id: Optional[str] = None):
+    self.directory_uri = directory_uri.rstrip("/")
+    self.records_per_file = records_per_file
+    self.written_count = 0
+    self.file_count = 0
+    self._bucket_name, self._prefix = _split_gcs_uri(self.directory_uri)
+    self._bucket = storage.Client(project=project_id).bucket(self._bucket_name)
+    self._file: Optional[BinaryIO] = None
+    self._file_records = 0
+
+  def _open_next_file(self) -> None:
+    name = f"{self._prefix}/embeddings-{self.file_count:05d}.json"
+    logger.info(f"Writing staging file gs://{self._bucket_name}/{name}...")
+    self._file = self._bucket.blob(name).open("wb",
+                                              content_type="application/json")
+    self.file_count += 1
+    self._file_records = 0
+
+  def _close_file(self) -> None:
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def submit(self, datapoints: List[Dict[str, Any]]) -> None:
+    """Appends the datapoints to the current staging file."""
+    for datapoint in datapoints:
+      if self._file is None or self._file_records >= self.records_per_file:
+        self._close_file()
+        self._open_next_file()
+      self._file.write(orjson.dumps(to_index_record(datapoint)) + b"\n")
+      self._file_records += 1
+      self.written_count += 1
+
+  def close(self) -> int:
+    """
+      Finishes the last file.
+
+      Returns:
+          The number of datapoints written.
+      """
+    self._close_file()
+    logger.info(
+        f"Staged {self.written_count} datapoints in {self.file_count} file(s) under {self.directory_uri}/."
+    )
+    return self.written_count
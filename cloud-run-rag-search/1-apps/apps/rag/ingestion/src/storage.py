@@ -12,43 +12,299 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fnmatch
+import gzip
+import io
 import logging
-import json
-from typing import Generator, Dict, Any, Optional
+import queue
+import threading
+import time
+from typing import BinaryIO, Generator, Dict, Any, List, Optional, Tuple
+
+import orjson
 from google.cloud import storage
 
 logger = logging.getLogger(__name__)
 
+# Magic numbers of the supported compression formats.
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Records are handed from the reader threads to the consumer in chunks, to
+# keep queue overhead low.
+_RECORDS_PER_CHUNK = 500
+_END_OF_FILE = object()
+# How often blocked threads wake up to check whether the consumer stopped.
+_POLL_INTERVAL_SECONDS = 0.5
+# Compressed content is skipped on resume by decompressing pieces this large.
+_SKIP_READ_SIZE = 1024 * 1024
+
+
+def source_key(blob_name: str, generation: Optional[int]) -> str:
+  """
+    Returns the key of an object version in byte offset checkpoints, so that
+    the offsets of an object are not applied to a newer version of it.
+    """
+  return f"{blob_name}#{generation}"
+
+
+def list_source_blobs(bucket_name: str, blob_pattern: str,
+                      storage_client: storage.Client) -> List[storage.Blob]:
+  """
+    Resolves the source objects. `blob_pattern` is an object name, a prefix
+    ending with '/' (every object under it), or a glob such as
+    'exports/part-*.jsonl.gz'.
+
+    Returns:
+        The objects, with their metadata, sorted by name.
+    """
+  if any(char in blob_pattern for char in "*?["):
+    prefix = blob_pattern
+    for char in "*?[":
+      prefix = prefix.split(char, 1)[0]
+    blobs = [
+        blob for blob in storage_client.list_blobs(bucket_name, prefix=prefix)
+        if fnmatch.fnmatchcase(blob.name, blob_pattern)
+    ]
+  elif blob_pattern.endswith("/"):
+    blobs = [
+        blob
+        for blob in storage_client.list_blobs(bucket_name, prefix=blob_pattern)
+        if not blob.name.endswith("/")
+    ]
+  else:
+    blob = storage_client.bucket(bucket_name).get_blob(blob_pattern)
+    blobs = [blob] if blob is not None else []
+  return sorted(blobs, key=lambda blob: blob.name)
+
+
+def open_decompressed(raw: BinaryIO) -> BinaryIO:
+  """
+    Wraps a binary stream so that gzip and zstd compressed content is
+    decompressed on the fly. The format is detected from the first bytes,
+    whatever the object name or metadata say.
+    """
+  reader = io.BufferedReader(raw) if not hasattr(raw, "peek") else raw
+  magic = reader.peek(4)[:4]
+  if magic.startswith(_GZIP_MAGIC):
+    return gzip.GzipFile(fileobj=reader)
+  if magic == _ZSTD_MAGIC:
+    import zstandard
+    # The zstd reader has no readline(): buffer it for line iteration.
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+        reader, read_across_frames=True))
+  return reader
+
+
+def _skip(f: BinaryIO, size: int) -> None:
+  """Reads and discards `size` bytes of a stream that cannot seek."""
+  while size > 0:
+    piece = f.read(min(size, _SKIP_READ_SIZE))
+    if not piece:
+      return
+    size -= len(piece)
+
 
 def stream_gcs_jsonl_file(
-    bucket_name: str, blob_name: str,
-    project_id: Optional[str] = None) -> Generator[Dict[str, Any], None, None]:
+    bucket_name: str, blob_name: str, project_id: Optional[str] = None,
+    storage_client: Optional[storage.Client] = None,
+    generation: Optional[int] = None, start_offset: int = 0,
+    with_offsets: bool = False) -> Generator[Any, None, None]:
   """
     Streams a JSONL file from GCS and yields each line as a parsed JSON object.
-    This is memory-efficient for large files.
+    This is memory-efficient for large files. Gzip and zstd compressed files
+    are decompressed transparently.
+
+    Reading can resume at `start_offset`, the byte offset of a line start in
+    the (decompressed) content. Uncompressed objects are then read with a
+    ranged download from that offset; compressed ones are decompressed from
+    the start and the content before the offset is skipped without parsing.
 
     Args:
         bucket_name (str): The name of the GCS bucket.
         blob_name (str): The name of the object (file) in GCS.
         project_id (str, optional): The GCP project ID. Defaults to None.
+        storage_client (storage.Client, optional): A client to reuse.
+        generation (int, optional): The object version to read, so that all
+            ranged reads see the same content. Defaults to the latest one.
+        start_offset (int): The byte offset to resume from. Defaults to 0.
+        with_offsets (bool): Whether to yield the offset after each line.
 
     Yields:
-        A dictionary parsed from a line in the JSONL file.
+        A dictionary parsed from a line in the JSONL file or, with
+        `with_offsets`, a tuple of that dictionary and the byte offset of the
+        end of its line.
     """
   try:
-    storage_client = storage.Client(project=project_id)
+    if storage_client is None:
+      storage_client = storage.Client(project=project_id)
     bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-
-    logger.info(f"Streaming file gs://{bucket_name}/{blob_name}...")
-    with blob.open("rt", encoding="utf-8") as f:
-      for line in f:
-        if line.strip():
-          try:
-            yield json.loads(line)
-          except json.JSONDecodeError:
-            logger.warning(f"Skipping malformed JSON line: {line.strip()}")
+    blob = bucket.blob(blob_name, generation=generation)
+
+    compressed = False
+    if start_offset:
+      # Raw bytes, since the offset of a compressed object is not a position
+      # in the stored object.
+      magic = blob.download_as_bytes(start=0, end=3, raw_download=True)
+      compressed = magic.startswith(_GZIP_MAGIC) or magic == _ZSTD_MAGIC
+      logger.info(
+          f"Resuming file gs://{bucket_name}/{blob_name} at byte {start_offset}"
+          f"{' of the decompressed content' if compressed else ''}...")
+    else:
+      logger.info(f"Streaming file gs://{bucket_name}/{blob_name}...")
+    # Objects stored with Content-Encoding: gzip are downloaded as-is and
+    # decompressed here, like any other compressed object.
+    with blob.open("rb", raw_download=True) as raw:
+      if start_offset and not compressed:
+        # The next read downloads the object from this offset.
+        raw.seek(start_offset)
+      with open_decompressed(raw) as f:
+        if start_offset and compressed:
+          _skip(f, start_offset)
+        offset = start_offset
+        for line in f:
+          offset += len(line)
+          if line.strip():
+            try:
+              record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+              logger.warning(
+                  f"Skipping malformed JSON line in {blob_name}: {line.strip()[:200]!r}"
+              )
+              continue
+            yield (record, offset) if with_offsets else record
   except Exception as e:
     logger.error(
         f"Failed to stream file 'gs://{bucket_name}/{blob_name}'. Error: {e}")
     raise
+
+
+def stream_gcs_jsonl_files(
+    bucket_name: str, blob_pattern: str, project_id: Optional[str] = None,
+    readers: int = 4, max_buffered_chunks: int = 20,
+    start_offsets: Optional[Dict[str,
+                                 int]] = None) -> Generator[Any, None, None]:
+  """
+    Streams the records of every JSONL object matched by `blob_pattern` (see
+    list_source_blobs), reading up to `readers` objects in parallel.
+
+    Records of one object keep their order, records of different objects are
+    interleaved as they arrive. At most `max_buffered_chunks` chunks of
+    records wait for the consumer, so slow embedding blocks the readers
+    instead of filling memory. An error in any reader is raised here.
+
+    With `start_offsets`, a map from source_key() to the byte offset to
+    resume each object from (possibly empty), the records are yielded with
+    their position.
+
+    Yields:
+        A dictionary parsed from a line of one of the files or, with
+        `start_offsets`, a tuple of that dictionary and a (source key, end
+        offset of the line) tuple.
+    """
+  storage_client = storage.Client(project=project_id)
+  blobs = list_source_blobs(bucket_name, blob_pattern, storage_client)
+  if not blobs:
+    raise FileNotFoundError(
+        f"No object matches 'gs://{bucket_name}/{blob_pattern}'.")
+  logger.info(
+      f"Reading {len(blobs)} file(s) matching gs://{bucket_name}/{blob_pattern} with up to {readers} readers."
+  )
+
+  def _stream(blob: storage.Blob) -> Generator[Any, None, None]:
+    if start_offsets is None:
+      yield from stream_gcs_jsonl_file(bucket_name, blob.name,
+                                       storage_client=storage_client)
+      return
+    key = source_key(blob.name, blob.generation)
+    for record, offset in stream_gcs_jsonl_file(
+        bucket_name, blob.name, storage_client=storage_client,
+        generation=blob.generation, start_offset=start_offsets.get(key, 0),
+        with_offsets=True):
+      yield record, (key, offset)
+
+  if len(blobs) == 1 or readers <= 1:
+    for blob in blobs:
+      yield from _stream(blob)
+    return
+
+  blobs_queue: queue.Queue = queue.Queue()
+  for blob in blobs:
+    blobs_queue.put(blob)
+  records_queue: queue.Queue = queue.Queue(maxsize=max_buffered_chunks)
+  stop_event = threading.Event()
+  errors: List[BaseException] = []
+
+  def _put(item: Any) -> bool:
+    while not stop_event.is_set():
+      try:
+        records_queue.put(item, timeout=_POLL_INTERVAL_SECONDS)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _reader() -> None:
+    try:
+      while not stop_event.is_set():
+        try:
+          blob = blobs_queue.get_nowait()
+        except queue.Empty:
+          return
+        chunk = []
+        for record in _stream(blob):
+          chunk.append(record)
+          if len(chunk) >= _RECORDS_PER_CHUNK:
+            if not _put(chunk):
+              return
+            chunk = []
+        if chunk and not _put(chunk):
+          return
+    except BaseException as e:
+      errors.append(e)
+      stop_event.set()
+    finally:
+      _put(_END_OF_FILE)
+
+  reader_count = min(readers, len(blobs))
+  threads = [
+      threading.Thread(target=_reader, name=f"gcs-reader-{i}", daemon=True)
+      for i in range(reader_count)
+  ]
+  for thread in threads:
+    thread.start()
+  try:
+    finished = 0
+    while finished < reader_count and not errors:
+      try:
+        chunk = records_queue.get(timeout=_POLL_INTERVAL_SECONDS)
+      except queue.Empty:
+        continue
+      if chunk is _END_OF_FILE:
+        finished += 1
+        continue
+      yield from chunk
+  finally:
+    # Also stops the readers when the consumer gives up early.
+    stop_event.set()
+    for thread in threads:
+      thread.join()
+  if errors:
+    raise errors[0]
+
+
+def write_index_version(uri: str, version: str, datapoints: int,
+                        project_id: Optional[str] = None) -> None:
+  """
+    Writes the marker telling the frontends that the index was updated, as a
+    JSON object with the `version`, the number of `datapoints` written and
+    the update time.
+    """
+  bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+  content = orjson.dumps({
+      "version": version,
+      "datapoints": datapoints,
+      "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+  })
+  storage.Client(project=project_id).bucket(bucket_name).blob(
+      blob_name).upload_from_string(content, content_type="application/json")
+  logger.info(f"Index version '{version}' written to {uri}.")
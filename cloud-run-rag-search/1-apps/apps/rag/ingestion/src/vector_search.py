@@ -12,22 +12,60 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
-from typing import List, Dict, Any
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Any, Optional
+
+import google.api_core.exceptions as exceptions
 from google.cloud.aiplatform import MatchingEngineIndex
+from google.cloud.aiplatform.compat.types import (
+    matching_engine_index as gca_matching_engine_index,)
+from google.protobuf import field_mask_pb2
 
 logger = logging.getLogger(__name__)
 
+# Quota and server errors are worth retrying with the same datapoints.
+RETRYABLE_ERRORS = (
+    exceptions.TooManyRequests,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    exceptions.DeadlineExceeded,
+    exceptions.Aborted,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_index(project: str, location: str,
+              index_name: str) -> MatchingEngineIndex:
+  """
+    Returns the MatchingEngineIndex for the index, created once per process.
+    Creating it fetches the index resource, so it must not be done per batch.
+    """
+  logger.info(f"Loading Vector Search index '{index_name}'...")
+  return MatchingEngineIndex(index_name=index_name, project=project,
+                             location=location)
+
 
 def upsert_datapoints_to_index(
     project: str,
     location: str,
     index_name: str,
     datapoints: List[Dict[str, Any]],
+    max_retries: int = 5,
+    retry_base_delay: float = 1.0,
+    retry_max_delay: float = 60.0,
 ) -> None:
   """
     Upserts a list of datapoints into a Vertex AI Vector Search index.
-    This method is suitable for streaming-enabled indexes.
+    This method is suitable for streaming-enabled indexes. Quota and server
+    errors are retried with exponential backoff and jitter.
 
     Args:
         project (str): The GCP project ID.
@@ -35,6 +73,9 @@ def upsert_datapoints_to_index(
         index_name (str): The ID or full resource name of the Vector Search index.
         datapoints (List[Dict[str, Any]]): A list of datapoint dictionaries.
             Each dict must have 'datapoint_id' and 'feature_vector'.
+        max_retries (int): Retries of a failing batch before giving up.
+        retry_base_delay (float): Delay before the first retry, in seconds.
+        retry_max_delay (float): Upper bound of the delay between retries.
     """
   if not datapoints:
     logger.warning("No datapoints provided to upsert.")
@@ -43,21 +84,146 @@ def upsert_datapoints_to_index(
   logger.info(
       f"Sending {len(datapoints)} datapoints to be upserted into index '{index_name}'."
   )
-  try:
-    # Initialize the MatchingEngineIndex object
-    index = MatchingEngineIndex(index_name=index_name, project=project,
-                                location=location)
+  attempt = 0
+  while True:
+    try:
+      index = get_index(project, location, index_name)
+      # Call the method for streaming updates
+      index.upsert_datapoints(datapoints=datapoints)
+      logger.info(
+          f"Successfully sent {len(datapoints)} datapoints to index '{index_name}'."
+      )
+      return
+    except RETRYABLE_ERRORS as e:
+      if attempt >= max_retries:
+        logger.error(
+            f"Failed to upsert to Vector Search index '{index_name}' after {attempt} retries. Error: {e}"
+        )
+        raise
+      delay = min(retry_max_delay, retry_base_delay * 2**attempt)
+      delay = random.uniform(delay / 2, delay)
+      attempt += 1
+      logger.warning(
+          f"Upsert of {len(datapoints)} datapoints failed ({type(e).__name__}: {e}). "
+          f"Retry {attempt}/{max_retries} in {delay:.1f}s.")
+      time.sleep(delay)
+    except Exception as e:
+      logger.error(
+          f"Failed to upsert to Vector Search index '{index_name}'. Error: {e}")
+      # For a batch job, raising the exception will cause the job to fail.
+      raise
+
 
-    # Call the method for streaming updates
-    index.upsert_datapoints(datapoints=datapoints)
+class ConcurrentUpserter:
+  """
+    Upserts batches of datapoints in background threads, so that the caller
+    can embed the next batches meanwhile.
+
+    At most `max_in_flight` batches are being upserted or waiting at any
+    time: submit() blocks when the window is full. A batch that still fails
+    after its retries makes the next submit() or close() raise, and the
+    remaining queued batches are skipped.
+    """
+
+  def __init__(self, project: str, location: str, index_name: str,
+               max_in_flight: int, **upsert_kwargs: Any):
+    self.project = project
+    self.location = location
+    self.index_name = index_name
+    self.upsert_kwargs = upsert_kwargs
+    self.upserted_count = 0
+    self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                        thread_name_prefix="upserter")
+    self._window = threading.BoundedSemaphore(max_in_flight)
+    self._lock = threading.Lock()
+    self._error: Optional[BaseException] = None
 
+  def _raise_if_failed(self) -> None:
+    with self._lock:
+      if self._error is not None:
+        raise self._error
+
+  def _upsert(self, datapoints: List[Dict[str, Any]],
+              on_done: Optional[Callable[[], None]]) -> None:
+    try:
+      with self._lock:
+        if self._error is not None:
+          return
+      upsert_datapoints_to_index(self.project, self.location, self.index_name,
+                                 datapoints, **self.upsert_kwargs)
+      with self._lock:
+        self.upserted_count += len(datapoints)
+      if on_done is not None:
+        on_done()
+    except BaseException as e:
+      with self._lock:
+        if self._error is None:
+          self._error = e
+    finally:
+      self._window.release()
+
+  def submit(self, datapoints: List[Dict[str, Any]],
+             on_done: Optional[Callable[[], None]] = None) -> None:
+    """
+      Schedules an upsert, waiting for a free slot in the window. `on_done`
+      is called once the batch is upserted.
+      """
+    self._raise_if_failed()
+    self._window.acquire()
+    self._executor.submit(self._upsert, datapoints, on_done)
+
+  def close(self) -> int:
+    """
+      Waits for every scheduled upsert.
+
+      Returns:
+          The number of datapoints upserted.
+      """
+    self._executor.shutdown(wait=True)
+    self._raise_if_failed()
+    return self.upserted_count
+
+
+def batch_update_index(project: str, location: str, index_name: str,
+                       contents_delta_uri: str, complete_overwrite: bool,
+                       poll_interval_seconds: float) -> None:
+  """
+    Runs a batch update of the index from the files under
+    `contents_delta_uri` and polls the operation until it completes.
+    With `complete_overwrite`, the files replace the whole index content.
+
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: If the update failed.
+    """
+  index = get_index(project, location, index_name)
+  gapic_index = gca_matching_engine_index.Index(
+      name=index.resource_name,
+      metadata={
+          "contentsDeltaUri": contents_delta_uri,
+          "isCompleteOverwrite": complete_overwrite,
+      },
+  )
+  logger.info(
+      f"Starting batch update of index '{index_name}' from {contents_delta_uri} "
+      f"(complete overwrite: {complete_overwrite})...")
+  operation = index.api_client.update_index(
+      index=gapic_index,
+      update_mask=field_mask_pb2.FieldMask(paths=["metadata"]))
+  logger.info(f"Batch update operation: {operation.operation.name}")
+  started = time.monotonic()
+  while not operation.done():
+    time.sleep(poll_interval_seconds)
     logger.info(
-        f"Successfully sent {len(datapoints)} datapoints to index '{index_name}'."
+        f"Batch update of index '{index_name}' running for {time.monotonic() - started:.0f}s..."
     )
-
-  except Exception as e:
-    logger.error(
-        f"Failed to upsert to Vector Search index '{index_name}'. Error: {e}")
-    # Depending on the desired behavior, you might want to retry or handle this error.
-    # For a batch job, raising the exception will cause the job to fail.
-    raise
+  # Raises if the operation failed.
+  operation.result()
+  metadata = operation.metadata
+  if metadata is not None:
+    for stats in metadata.nearest_neighbor_search_operation_metadata.content_validation_stats:
+      logger.info(
+          f"{stats.source_gcs_uri}: {stats.valid_record_count} valid records, "
+          f"{stats.invalid_record_count} invalid records.")
+  logger.info(
+      f"Batch update of index '{index_name}' completed in {time.monotonic() - started:.0f}s."
+  )